@@ -1,8 +1,18 @@
 from django.contrib import admin
 
-from .models import Country, Region, Referer
+from .models import (
+    Country,
+    Region,
+    Referer,
+    RefererHost,
+    RefererRollup,
+    RegionRollup
+)
 
 # Register your models here.
 admin.site.register(Country)
 admin.site.register(Region)
-admin.site.register(Referer)
\ No newline at end of file
+admin.site.register(Referer)
+admin.site.register(RefererHost)
+admin.site.register(RegionRollup)
+admin.site.register(RefererRollup)
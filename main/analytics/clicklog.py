@@ -0,0 +1,443 @@
+import array
+import collections
+import datetime
+import glob
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import threading
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+from config.utils import process_exists
+from links.models import Link
+from links.utils import reconcile_click_counts
+
+from .models import Referer, Region
+from .referers import referer_hosts
+
+
+# link id, timestamp in microseconds, packed ip address,
+# country id and referer id. Id 0 stands for none.
+RECORD = struct.Struct('<Iq16sII')
+
+# Columns of sealed segments and their array typecodes.
+# Packed ip addresses are kept as one column of 16 byte values.
+COLUMNS = (
+    ('link_id', 'I'),
+    ('timestamp', 'q'),
+    ('country_id', 'I'),
+    ('referer_id', 'I'),
+)
+
+NO_ADDRESS = bytes(16)
+
+
+class ClickLogBusy(Exception):
+    pass
+
+
+def pack_ip(address):
+    '''
+    Pack an ip address into 16 bytes. IPv4 addresses are IPv4-mapped.
+    '''
+
+    try:
+        ip = ipaddress.ip_address(address or '')
+    except ValueError:
+        return NO_ADDRESS
+
+    if ip.version == 4:
+        ip = ipaddress.IPv6Address('::ffff:' + str(ip))
+    return ip.packed
+
+
+def unpack_ip(packed):
+    if packed == NO_ADDRESS:
+        return None
+    ip = ipaddress.IPv6Address(bytes(packed))
+    return str(ip.ipv4_mapped or ip)
+
+
+def to_timestamp(value):
+    return int(value.timestamp() * 1000000)
+
+
+def from_timestamp(value):
+    return datetime.datetime.fromtimestamp(value / 1000000, timezone.utc)
+
+
+class ClickLog(object):
+    '''
+    Append-only log of every applied click.
+
+    Each process appends fixed-width records to its own segment file in
+    CLICK_LOG_DIR. A segment is named `<started>-<pid>.open` while it is
+    written and renamed to `.log` once it grows past CLICK_LOG_SEGMENT_SIZE
+    bytes or the log is closed. Referer sources are stored once per
+    segment, in a `.sources` file of JSON strings, one per referer id.
+
+    The first segment also creates a `started` file with the time the
+    log began. Only Links created since have all of their clicks in it.
+    '''
+
+    def __init__(self):
+        self._file = None
+        self._sources_file = None
+        self._sources = {}
+        self._path = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def write(self, clicks):
+        '''
+        Append clicks, given as (link_id, timestamp, ip_address,
+        country_id, source) tuples.
+        '''
+
+        with self._lock:
+            # Segments opened before a fork belong to the parent process.
+            if self._file is None or self._pid != os.getpid():
+                self._open()
+
+            records = bytearray()
+            for link_id, timestamp, ip_address, country_id, source in clicks:
+                records += RECORD.pack(
+                    link_id,
+                    to_timestamp(timestamp),
+                    pack_ip(ip_address),
+                    country_id or 0,
+                    self._source_id(source)
+                )
+
+            self._sources_file.flush()
+            self._file.write(records)
+            self._file.flush()
+
+            if self._file.tell() >= settings.CLICK_LOG_SEGMENT_SIZE:
+                self._close()
+
+    def close(self):
+        '''
+        Close the current segment, so it can be sealed.
+        '''
+
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._close()
+
+    def _open(self):
+        directory = settings.CLICK_LOG_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        try:
+            with open(os.path.join(directory, 'started'), 'x') as f:
+                f.write(str(to_timestamp(timezone.now())))
+        except FileExistsError:
+            pass
+
+        name = '{}-{}'.format(
+            timezone.now().strftime('%Y%m%d%H%M%S%f'), os.getpid()
+        )
+        self._path = os.path.join(directory, name)
+        self._file = open(self._path + '.open', 'ab')
+        self._sources_file = open(self._path + '.sources', 'a')
+        self._sources = {'': 0}
+        self._pid = os.getpid()
+
+    def _close(self):
+        # Never keep writing to a closed file, even if the rename failed.
+        try:
+            self._file.close()
+            self._sources_file.close()
+            os.rename(self._path + '.open', self._path + '.log')
+        finally:
+            self._file = self._sources_file = None
+
+    def _source_id(self, source):
+        if source not in self._sources:
+            self._sources[source] = len(self._sources)
+            self._sources_file.write(json.dumps(source) + '\n')
+        return self._sources[source]
+
+
+def read_sources(path):
+    sources = ['']
+    if os.path.exists(path):
+        with open(path) as f:
+            sources.extend(json.loads(line) for line in f if line.strip())
+    return sources
+
+
+class RowSegment(object):
+    '''
+    A segment that is still in the fixed-width record layout.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = read_sources(os.path.splitext(path)[0] + '.sources')
+
+    def columns(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        # Ignore a record that is still being written.
+        data = data[:len(data) - len(data) % RECORD.size]
+
+        columns = {name: array.array(typecode) for name, typecode in COLUMNS}
+        addresses = []
+        for link_id, timestamp, ip, country_id, referer_id in \
+                RECORD.iter_unpack(data):
+            columns['link_id'].append(link_id)
+            columns['timestamp'].append(timestamp)
+            columns['country_id'].append(country_id)
+            columns['referer_id'].append(referer_id)
+            addresses.append(ip)
+        columns['ip_address'] = addresses
+        return columns
+
+
+class ColumnSegment(object):
+    '''
+    A sealed segment: a directory with one raw file per column,
+    which is memory-mapped instead of read.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = read_sources(os.path.join(path, 'sources'))
+
+    def _map(self, name, typecode):
+        with open(os.path.join(self.path, name), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return array.array(typecode)
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(data).cast(typecode)
+
+    def columns(self):
+        columns = {
+            name: self._map(name, typecode) for name, typecode in COLUMNS
+        }
+        ip = self._map('ip_address', 'B')
+        columns['ip_address'] = [
+            ip[i:i + 16] for i in range(0, len(ip), 16)
+        ]
+        return columns
+
+
+def seal_segment(path):
+    '''
+    Convert a closed segment to the columnar layout.
+    Return the path of the sealed segment.
+    '''
+
+    base = os.path.splitext(path)[0]
+    segment = RowSegment(path)
+    columns = segment.columns()
+
+    # Write to a temporary directory first, so readers
+    # never see a partly sealed segment.
+    temporary = base + '.sealing'
+    os.makedirs(temporary, exist_ok=True)
+    for name, typecode in COLUMNS:
+        with open(os.path.join(temporary, name), 'wb') as f:
+            columns[name].tofile(f)
+    with open(os.path.join(temporary, 'ip_address'), 'wb') as f:
+        f.write(b''.join(columns['ip_address']))
+    with open(os.path.join(temporary, 'sources'), 'w') as f:
+        f.writelines(json.dumps(source) + '\n' for source in segment.sources[1:])
+
+    os.rename(temporary, base + '.seg')
+    os.remove(path)
+    if os.path.exists(base + '.sources'):
+        os.remove(base + '.sources')
+    return base + '.seg'
+
+
+def segment_pid(path):
+    '''
+    Return the pid of the process that wrote a segment.
+    '''
+
+    name = os.path.basename(path).split('.')[0]
+    return int(name.rsplit('-', 1)[1])
+
+
+def seal_segments():
+    '''
+    Seal every closed segment, and every open segment whose process
+    is gone. Return the number of sealed segments.
+    '''
+
+    directory = settings.CLICK_LOG_DIR
+    paths = glob.glob(os.path.join(directory, '*.log'))
+    paths.extend(
+        path for path in glob.glob(os.path.join(directory, '*.open'))
+        if not process_exists(segment_pid(path))
+    )
+
+    for path in sorted(paths):
+        seal_segment(path)
+    return len(paths)
+
+
+def live_writers():
+    '''
+    Return the pids of other live processes that have an open segment.
+    '''
+
+    paths = glob.glob(os.path.join(settings.CLICK_LOG_DIR, '*.open'))
+    return sorted(
+        pid for pid in {segment_pid(path) for path in paths}
+        if pid != os.getpid() and process_exists(pid)
+    )
+
+
+def log_started():
+    '''
+    Return when the log began, or None if it never did.
+    '''
+
+    try:
+        with open(os.path.join(settings.CLICK_LOG_DIR, 'started')) as f:
+            return from_timestamp(int(f.read()))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def segments():
+    '''
+    Return every segment of the log, sealed or not, oldest first.
+    '''
+
+    directory = settings.CLICK_LOG_DIR
+    paths = []
+    for pattern in ('*.seg', '*.log', '*.open'):
+        paths.extend(glob.glob(os.path.join(directory, pattern)))
+
+    return [
+        ColumnSegment(path) if path.endswith('.seg') else RowSegment(path)
+        for path in sorted(paths)
+    ]
+
+
+def aggregate_clicks(link_ids=None):
+    '''
+    Scan the log and count clicks per (link, country) and
+    (link, source). Both map to [clicks, last_visited timestamp].
+    '''
+
+    regions = collections.defaultdict(lambda: [0, 0])
+    referers = collections.defaultdict(lambda: [0, 0])
+
+    for segment in segments():
+        columns = segment.columns()
+        records = zip(
+            columns['link_id'],
+            columns['timestamp'],
+            columns['country_id'],
+            columns['referer_id'],
+        )
+        for link_id, timestamp, country_id, referer_id in records:
+            if link_ids is not None and link_id not in link_ids:
+                continue
+
+            for counter in (
+                    regions[(link_id, country_id)],
+                    referers[(link_id, segment.sources[referer_id])]):
+                counter[0] += 1
+                counter[1] = max(counter[1], timestamp)
+
+    return regions, referers
+
+
+def rebuild_analytics(link_ids=None, batch_size=500):
+    '''
+    Replace the Region and Referer rows of the Links in the log, or of
+    link_ids, with counts derived from the log, and reconcile their
+    click counters. Links created before the log began are skipped,
+    since their earlier clicks are not in it. Return the number of
+    rebuilt Links.
+
+    Workers apply clicks to the Database before they log them, so
+    clicks applied while the log is read would be lost. The rebuild
+    is offline only, and raises ClickLogBusy while other processes
+    are writing the log.
+    '''
+
+    writers = live_writers()
+    if writers:
+        raise ClickLogBusy(
+            'Processes {} are writing the click log. '
+            'Stop the workers first.'.format(
+                ', '.join(str(pid) for pid in writers)
+            )
+        )
+
+    # Clicks this process logged are read from a closed segment.
+    click_log.close()
+
+    started = log_started()
+    if started is None:
+        return 0
+
+    regions, referers = aggregate_clicks(link_ids)
+
+    # Skip Links that were deleted since, or are older than the log.
+    link_ids = set(
+        Link.objects
+        .filter(
+            pk__in={link_id for link_id, country_id in regions},
+            created_on__gte=started
+        )
+        .values_list('pk', flat=True)
+    )
+    if not link_ids:
+        return 0
+
+    # The log keeps host names. Resolve them before the transaction.
+    host_ids = referer_hosts.resolve(
+        source for link_id, source in referers if link_id in link_ids
+    )
+
+    with transaction.atomic(using=router.db_for_write(Region)):
+        Region.objects.filter(link_id__in=link_ids).delete()
+        Referer.objects.filter(link_id__in=link_ids).delete()
+
+        Region.objects.bulk_create(
+            [
+                Region(
+                    link_id=link_id,
+                    country_id=country_id,
+                    total_clicks=clicks,
+                    last_visited=from_timestamp(last_visited)
+                )
+                for (link_id, country_id), (clicks, last_visited)
+                in regions.items() if link_id in link_ids
+            ],
+            batch_size=batch_size
+        )
+        Referer.objects.bulk_create(
+            [
+                Referer(
+                    link_id=link_id,
+                    host_id=host_ids[source],
+                    total_clicks=clicks,
+                    last_visited=from_timestamp(last_visited)
+                )
+                for (link_id, source), (clicks, last_visited)
+                in referers.items() if link_id in link_ids
+            ],
+            batch_size=batch_size
+        )
+
+    reconcile_click_counts(link_ids=link_ids)
+    return len(link_ids)
+
+
+click_log = ClickLog()
@@ -0,0 +1,159 @@
+import csv
+import itertools
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from links.models import Link
+
+from .models import Referer, Region
+
+
+COLUMNS = (
+    'record',
+    'key',
+    'destination',
+    'dimension',
+    'total_clicks',
+    'unique_clicks',
+    'last_visited',
+)
+
+
+class Echo(object):
+    '''
+    A file-like object that returns what is written to it,
+    so csv.writer can produce one line at a time.
+    '''
+
+    def write(self, value):
+        return value
+
+
+def chunked_rows(queryset, fields, chunk_size=2000):
+    '''
+    Yield value tuples of fields for every row of queryset.
+
+    Rows are read chunk_size at a time, each chunk starting after the
+    last primary key of the previous one. The SQLite backend reads whole
+    result sets into memory, so this keeps memory flat where .iterator()
+    alone would not.
+    '''
+
+    queryset = queryset.order_by('pk').values_list('pk', *fields)
+    last_pk = None
+
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+
+        for row in rows:
+            yield row[1:]
+        last_pk = rows[-1][0]
+
+
+def link_rows(user, queryset, fields, chunk_size=2000):
+    '''
+    Yield (key, *fields) for every row of queryset that belongs to a
+    Link of user. The rows are in another database than the Links, so
+    they are read for one chunk of Links at a time instead of joined.
+    '''
+
+    links = chunked_rows(
+        Link.objects.filter(user=user), ('pk', 'key'), chunk_size
+    )
+    while True:
+        keys = dict(itertools.islice(links, chunk_size))
+        if not keys:
+            return
+
+        rows = chunked_rows(
+            queryset.filter(link_id__in=keys),
+            ('link_id',) + fields,
+            chunk_size
+        )
+        for row in rows:
+            yield (keys[row[0]],) + row[1:]
+
+
+def export_rows(user, chunk_size=2000):
+    '''
+    Yield one dict per Link of user with its click totals, then one
+    per Region and per Referer of those Links.
+    '''
+
+    links = chunked_rows(
+        Link.objects.filter(user=user),
+        ('key', 'destination', 'total_clicks', 'unique_clicks'),
+        chunk_size
+    )
+    for key, destination, total_clicks, unique_clicks in links:
+        yield {
+            'record': 'link',
+            'key': key,
+            'destination': destination,
+            'total_clicks': total_clicks,
+            'unique_clicks': unique_clicks,
+        }
+
+    regions = link_rows(
+        user,
+        Region.objects.all(),
+        ('country__code', 'total_clicks', 'last_visited'),
+        chunk_size
+    )
+    for key, country_code, total_clicks, last_visited in regions:
+        yield {
+            'record': 'region',
+            'key': key,
+            'dimension': country_code or '',
+            'total_clicks': total_clicks,
+            'last_visited': last_visited,
+        }
+
+    referers = link_rows(
+        user,
+        Referer.objects.all(),
+        ('host__name', 'total_clicks', 'last_visited'),
+        chunk_size
+    )
+    for key, host_name, total_clicks, last_visited in referers:
+        yield {
+            'record': 'referer',
+            'key': key,
+            'dimension': host_name,
+            'total_clicks': total_clicks,
+            'last_visited': last_visited,
+        }
+
+
+def export_csv(user):
+    '''
+    Yield the export of user as CSV lines, starting with a header.
+    '''
+
+    writer = csv.DictWriter(Echo(), fieldnames=COLUMNS)
+    yield writer.writerow(dict(zip(COLUMNS, COLUMNS)))
+    for row in export_rows(user):
+        if row.get('last_visited'):
+            row['last_visited'] = row['last_visited'].isoformat()
+        yield writer.writerow(row)
+
+
+def export_ndjson(user):
+    '''
+    Yield the export of user as NDJSON lines.
+    '''
+
+    for row in export_rows(user):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+FORMATS = {
+    'csv': (export_csv, 'text/csv'),
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+}
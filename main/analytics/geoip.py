@@ -0,0 +1,110 @@
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.gis.geoip2 import GeoIP2, GeoIP2Exception
+
+import geoip2
+
+from config.metrics import metrics
+
+
+class GeoIPService(object):
+    '''
+    Process-wide GeoIP2 country lookups.
+
+    The database is opened once, memory-mapped, so workers forked after
+    it was opened share its pages. Results are kept in a bounded LRU
+    keyed by ip address, including misses, and hits and misses are
+    counted.
+    '''
+
+    def __init__(self):
+        self._reader = None
+        self._opened = False
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def open(self):
+        '''
+        Open the GeoIP2 database if it was not opened yet.
+        Return True if the database is available.
+        '''
+
+        with self._lock:
+            if not self._opened:
+                self._opened = True
+                try:
+                    # MODE_AUTO uses the C extension of maxminddb when it
+                    # is installed, and its pure Python mmap reader if not.
+                    # MODE_MMAP would always pick the pure Python reader.
+                    self._reader = GeoIP2(
+                        settings.GEOIP_PATH,
+                        cache=GeoIP2.MODE_AUTO
+                    )
+                except GeoIP2Exception:
+                    # No database in GEOIP_PATH.
+                    self._reader = None
+
+        return self._reader is not None
+
+    def close(self):
+        '''
+        Close the database and forget cached lookups.
+        '''
+
+        # GeoIP2 closes its file handles when it is collected.
+        with self._lock:
+            self._reader = None
+            self._opened = False
+            self._cache.clear()
+
+    def country(self, ip_address):
+        '''
+        Return a (country name, country code) tuple for an ip address,
+        or None if it cannot be resolved.
+        '''
+
+        if not ip_address:
+            return None
+
+        with self._lock:
+            if ip_address in self._cache:
+                self._cache.move_to_end(ip_address)
+                self.hits += 1
+                return self._cache[ip_address]
+            self.misses += 1
+
+        start = time.perf_counter()
+        country = self._lookup(ip_address)
+        metrics.add_time('geoip', time.perf_counter() - start)
+
+        with self._lock:
+            self._cache[ip_address] = country
+            while len(self._cache) > settings.GEOIP_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+        return country
+
+    def _lookup(self, ip_address):
+        if not self.open():
+            return None
+
+        try:
+            data = self._reader.country(ip_address)
+        except (TypeError, ValueError, GeoIP2Exception,
+                geoip2.errors.AddressNotFoundError):
+            # Ignore invalid addresses, and addresses that
+            # do not exist in the GeoIP2 database.
+            return None
+
+        if not data.get('country_name'):
+            return None
+
+        return data['country_name'], data['country_code']
+
+
+geoip_service = GeoIPService()
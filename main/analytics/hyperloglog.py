@@ -0,0 +1,93 @@
+import hashlib
+import math
+import zlib
+
+
+class HyperLogLog(object):
+    '''
+    HyperLogLog sketch for counting distinct values.
+
+    With the default precision of 12 the sketch has 4096 one byte
+    registers and a standard error of about 1.6%. Sketches of the same
+    precision can be merged, and the merged sketch counts the union.
+    '''
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = (
+            bytearray(registers) if registers else bytearray(self.size)
+        )
+
+    def add(self, value):
+        '''
+        Add a value to the sketch.
+        '''
+
+        digest = hashlib.sha1(str(value).encode()).digest()
+        x = int.from_bytes(digest[:8], 'big')
+
+        # The first bits select a register, the rest are ranked by the
+        # position of their leftmost 1 bit.
+        bits = 64 - self.precision
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        '''
+        Fold another sketch into this one.
+        '''
+
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of different precision.')
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        '''
+        Return the estimated number of distinct values.
+        '''
+
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        # Use linear counting for small cardinalities.
+        zeros = self.registers.count(0)
+        if zeros and estimate <= 2.5 * m:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    def to_bytes(self):
+        '''
+        Serialize the sketch. Sparse sketches compress well.
+        '''
+
+        return zlib.compress(bytes([self.precision]) + bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = zlib.decompress(bytes(data))
+        return cls(precision=data[0], registers=data[1:])
+
+    @classmethod
+    def union(cls, sketches):
+        '''
+        Return a sketch that counts the union of sketches.
+        '''
+
+        result = None
+        for sketch in sketches:
+            if result is None:
+                result = cls(sketch.precision, sketch.registers)
+            else:
+                result.merge(sketch)
+        return result if result is not None else cls()
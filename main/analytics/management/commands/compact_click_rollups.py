@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from analytics.rollups import compact_rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold hourly click rollups past the retention window into daily ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of Links compacted per transaction.'
+        )
+
+    def handle(self, *args, **options):
+        folded = compact_rollups(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Folded {} hourly rollups into daily rollups.'.format(folded)
+        ))
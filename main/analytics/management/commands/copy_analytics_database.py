@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+
+from analytics.models import (
+    Country,
+    IPAddress,
+    Referer,
+    RefererHost,
+    RefererRollup,
+    Region,
+    RegionRollup,
+    UniqueVisitorSketch
+)
+from links.utils import reconcile_click_counts
+
+
+MODELS = (
+    Country,
+    RefererHost,
+    IPAddress,
+    UniqueVisitorSketch,
+    Referer,
+    Region,
+    RegionRollup,
+    RefererRollup,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the analytics rows of a database that held every app into '
+        'ANALYTICS_DATABASE, recompute the click counters of the Links '
+        'from them and drop the analytics tables of the source. List the '
+        'source in LEGACY_ANALYTICS_DATABASES and migrate both databases '
+        'first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            default='default',
+            help='The database to copy the analytics rows from.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of rows copied at a time.'
+        )
+
+    def handle(self, *args, **options):
+        source = options['source']
+        target = settings.ANALYTICS_DATABASE
+        batch_size = options['batch_size']
+
+        if source == target:
+            raise CommandError('The source is the analytics database.')
+        if source not in settings.LEGACY_ANALYTICS_DATABASES:
+            raise CommandError(
+                '{} is not in LEGACY_ANALYTICS_DATABASES.'.format(source)
+            )
+        tables = connections[source].introspection.table_names()
+        if Country._meta.db_table not in tables:
+            raise CommandError('{} has no analytics tables.'.format(source))
+        # Rows with pk 0 are sentinels every migrated database has.
+        # They are left out of the check and of the copy.
+        for model in MODELS:
+            if model.objects.using(target).filter(pk__gt=0).exists():
+                raise CommandError('{} already has {} rows.'.format(
+                    target, model._meta.verbose_name
+                ))
+
+        with transaction.atomic(using=target):
+            for model in MODELS:
+                rows = model.objects.using(source).order_by('pk')
+                copied = 0
+                last_pk = 0
+
+                while True:
+                    batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+                    if not batch:
+                        break
+                    model.objects.using(target).bulk_create(batch)
+                    copied += len(batch)
+                    last_pk = batch[-1].pk
+
+                self.stdout.write('Copied {} {} rows.'.format(
+                    copied, model._meta.verbose_name
+                ))
+
+        # The counters of the Links must match the copied rows.
+        corrected = reconcile_click_counts()
+        self.stdout.write(
+            'Corrected the counters of {} links.'.format(corrected)
+        )
+
+        # Drop the copied tables, referencing ones first, and forget their
+        # migrations, so the source holds no stale analytics rows.
+        with connections[source].schema_editor() as editor:
+            for model in reversed(MODELS):
+                editor.delete_model(model)
+            MigrationRecorder(connections[source]).migration_qs.filter(
+                app=Country._meta.app_label
+            ).delete()
+        self.stdout.write(
+            'Dropped the analytics tables of {}. Remove it from '
+            'LEGACY_ANALYTICS_DATABASES.'.format(source)
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            'Copied the analytics rows of {} to {}.'.format(source, target)
+        ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.export import FORMATS
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Export the click totals and breakdowns of a user\'s links'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user to export.')
+        parser.add_argument(
+            '--format',
+            choices=sorted(FORMATS),
+            default='csv',
+            help='Output format.'
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write to. Defaults to standard output.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError('No user with email \'{}\''.format(
+                options['email']
+            ))
+
+        export, content_type = FORMATS[options['format']]
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(export(user))
+        else:
+            for line in export(user):
+                self.stdout.write(line, ending='')
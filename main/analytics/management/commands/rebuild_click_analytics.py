@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.clicklog import ClickLogBusy, rebuild_analytics
+from links.models import Link
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the Region and Referer rows and the click counters of '
+        'links from the click log. Links created before the log was '
+        'enabled are skipped, since their earlier clicks are not in it. '
+        'Stop the workers first: clicks they apply during the rebuild '
+        'would be lost.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'keys',
+            nargs='*',
+            help='Keys of the links to rebuild. Defaults to every link in the log.'
+        )
+
+    def handle(self, *args, **options):
+        link_ids = None
+        if options['keys']:
+            link_ids = set(
+                Link.objects
+                .filter(key__in=options['keys'])
+                .values_list('pk', flat=True)
+            )
+
+        try:
+            rebuilt = rebuild_analytics(link_ids)
+        except ClickLogBusy as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            'Rebuilt the analytics of {} links.'.format(rebuilt)
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from analytics.clicklog import seal_segments
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert closed click log segments, and segments of processes '
+        'that are gone, to the columnar layout'
+    )
+
+    def handle(self, *args, **options):
+        sealed = seal_segments()
+        self.stdout.write(self.style.SUCCESS(
+            'Sealed {} click log segments.'.format(sealed)
+        ))
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:31
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import F, Max, Min, Sum
+
+
+def merge_duplicates(model, field, db):
+    '''
+    Fold rows that share (link, field) into the oldest row,
+    summing their clicks and keeping the latest visit.
+    '''
+
+    duplicates = (
+        model.objects.using(db)
+        .values('link', field)
+        .annotate(
+            first=Min('pk'),
+            last=Max('pk'),
+            clicks=Sum('total_clicks'),
+            visited=Max('last_visited'),
+        )
+        .filter(first__lt=F('last'))
+    )
+
+    for row in duplicates:
+        model.objects.using(db).filter(pk=row['first']).update(
+            total_clicks=row['clicks'],
+            last_visited=row['visited'],
+        )
+        (
+            model.objects.using(db)
+            .filter(link=row['link'], **{field: row[field]})
+            .exclude(pk=row['first'])
+            .delete()
+        )
+
+
+class Migration(migrations.Migration):
+    def remove_duplicates(apps, schema_editor):
+        IPAddresses = apps.get_model('analytics', 'IPAddress')
+        Referers = apps.get_model('analytics', 'Referer')
+        Regions = apps.get_model('analytics', 'Region')
+        db = schema_editor.connection.alias
+
+        merge_duplicates(Referers, 'source', db)
+        merge_duplicates(Regions, 'country', db)
+
+        # Addresses carry no counts, so keep the oldest row.
+        duplicates = (
+            IPAddresses.objects.using(db)
+            .values('link', 'address')
+            .annotate(first=Min('pk'), last=Max('pk'))
+            .filter(first__lt=F('last'))
+        )
+        for row in duplicates:
+            (
+                IPAddresses.objects.using(db)
+                .filter(link=row['link'], address=row['address'])
+                .exclude(pk=row['first'])
+                .delete()
+            )
+
+    dependencies = [
+        ('links', '0008_link_key_unique'),
+        ('analytics', '0004_region_country_remove_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='ipaddress',
+            unique_together=set([('link', 'address')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='referer',
+            unique_together=set([('link', 'source')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='region',
+            unique_together=set([('link', 'country')]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('links', '0010_link_click_counters'),
+        ('analytics', '0005_unique_link_rows'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UniqueVisitorSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='The day covered by this sketch, or the earliest date for all time', verbose_name='Day')),
+                ('registers', models.BinaryField(help_text='The serialized HyperLogLog sketch', verbose_name='Registers')),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sketches', to='links.Link', verbose_name='Link')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='uniquevisitorsketch',
+            unique_together=set([('link', 'day')]),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    def create_unknown_country(apps, schema_editor):
+        Countries = apps.get_model('analytics', 'Country')
+        db = schema_editor.connection.alias
+
+        # Clicks from unknown countries roll up on a country with a fixed
+        # id, so the rollup rows stay unique per bucket.
+        Countries.objects.using(db).create(pk=0, name='Unknown', code='')
+
+    dependencies = [
+        ('links', '0012_key_counter'),
+        ('analytics', '0006_unique_visitor_sketch'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_unknown_country, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='RefererRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('h', 'Hourly'), ('d', 'Daily')], help_text='The length of the bucket', max_length=1, verbose_name='Resolution')),
+                ('bucket', models.DateTimeField(help_text='The start of the hour or day', verbose_name='Bucket')),
+                ('total_clicks', models.PositiveIntegerField(default=0, help_text='The total clicks within the bucket', verbose_name='Total clicks')),
+                ('source', models.CharField(blank=True, help_text='The source of the referer', max_length=80, verbose_name='Referer source')),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='referer_rollups', to='links.Link', verbose_name='Link')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RegionRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('h', 'Hourly'), ('d', 'Daily')], help_text='The length of the bucket', max_length=1, verbose_name='Resolution')),
+                ('bucket', models.DateTimeField(help_text='The start of the hour or day', verbose_name='Bucket')),
+                ('total_clicks', models.PositiveIntegerField(default=0, help_text='The total clicks within the bucket', verbose_name='Total clicks')),
+                ('country', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='analytics.Country', verbose_name='Country')),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='region_rollups', to='links.Link', verbose_name='Link')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='regionrollup',
+            unique_together=set([('link', 'resolution', 'bucket', 'country')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='refererrollup',
+            unique_together=set([('link', 'resolution', 'bucket', 'source')]),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_click_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ipaddress',
+            name='link',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='addresses', to='links.Link', verbose_name='Link'),
+        ),
+        migrations.AlterField(
+            model_name='referer',
+            name='link',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='referers', to='links.Link', verbose_name='Link'),
+        ),
+        migrations.AlterField(
+            model_name='refererrollup',
+            name='link',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='referer_rollups', to='links.Link', verbose_name='Link'),
+        ),
+        migrations.AlterField(
+            model_name='region',
+            name='link',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='regions', to='links.Link', verbose_name='Link'),
+        ),
+        migrations.AlterField(
+            model_name='regionrollup',
+            name='link',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='region_rollups', to='links.Link', verbose_name='Link'),
+        ),
+        migrations.AlterField(
+            model_name='uniquevisitorsketch',
+            name='link',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='sketches', to='links.Link', verbose_name='Link'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 18:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    def move_sources_to_hosts(apps, schema_editor):
+        RefererHosts = apps.get_model('analytics', 'RefererHost')
+        Referers = apps.get_model('analytics', 'Referer')
+        RefererRollups = apps.get_model('analytics', 'RefererRollup')
+        db = schema_editor.connection.alias
+
+        # Direct clicks have an empty source and count on the host without
+        # a name, whose id is fixed so the pipeline needs no lookup.
+        RefererHosts.objects.using(db).create(pk=0, name='')
+
+        # One RefererHost per source.
+        for model in (Referers, RefererRollups):
+            sources = (
+                model.objects.using(db)
+                .values_list('source', flat=True)
+                .distinct()
+            )
+            for source in sources:
+                host, created = (
+                    RefererHosts.objects.using(db).get_or_create(name=source)
+                )
+                model.objects.using(db).filter(source=source).update(host=host)
+
+    dependencies = [
+        ('links', '0014_link_search'),
+        ('analytics', '0008_link_across_databases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefererHost',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='The host name of the referer', max_length=80, unique=True, verbose_name='Host name')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='referer',
+            name='host',
+            field=models.ForeignKey(blank=True, help_text='The host of the referer', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='referers', to='analytics.RefererHost', verbose_name='Referer host'),
+        ),
+        migrations.AddField(
+            model_name='refererrollup',
+            name='host',
+            field=models.ForeignKey(blank=True, help_text='The host of the referer', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='analytics.RefererHost', verbose_name='Referer host'),
+        ),
+        migrations.RunPython(move_sources_to_hosts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='referer',
+            name='host',
+            field=models.ForeignKey(help_text='The host of the referer, which has no name for direct clicks', on_delete=django.db.models.deletion.CASCADE, related_name='referers', to='analytics.RefererHost', verbose_name='Referer host'),
+        ),
+        migrations.AlterField(
+            model_name='refererrollup',
+            name='host',
+            field=models.ForeignKey(help_text='The host of the referer, which has no name for direct clicks', on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='analytics.RefererHost', verbose_name='Referer host'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='referer',
+            unique_together=set([('link', 'host')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='refererrollup',
+            unique_together=set([('link', 'resolution', 'bucket', 'host')]),
+        ),
+        migrations.RemoveField(
+            model_name='referer',
+            name='source',
+        ),
+        migrations.RemoveField(
+            model_name='refererrollup',
+            name='source',
+        ),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 23:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Max, Min, Sum
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    def use_unknown_country(apps, schema_editor):
+        Regions = apps.get_model('analytics', 'Region')
+        db = schema_editor.connection.alias
+
+        # Fold the regions without a country into one row per Link,
+        # on the unknown country.
+        unknown = Regions.objects.using(db).filter(country=None)
+        rows = (
+            unknown
+            .values('link')
+            .annotate(
+                first=Min('pk'),
+                clicks=Sum('total_clicks'),
+                visited=Max('last_visited')
+            )
+        )
+        for row in rows:
+            Regions.objects.using(db).filter(pk=row['first']).update(
+                country_id=0,
+                total_clicks=row['clicks'],
+                last_visited=row['visited']
+            )
+        unknown.delete()
+
+    dependencies = [
+        ('analytics', '0009_referer_hosts'),
+    ]
+
+    operations = [
+        migrations.RunPython(use_unknown_country, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='region',
+            name='country',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='regions', to='analytics.Country', verbose_name='Country'),
+        ),
+    ]
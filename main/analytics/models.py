@@ -1,3 +1,4 @@
+import datetime
 from urllib.parse import urlparse
 
 from django.db import models
@@ -5,6 +6,8 @@ from django.utils import timezone
 
 from links.models import Link
 
+from .hyperloglog import HyperLogLog
+
 
 class IPAddress(models.Model):
     '''
@@ -16,7 +19,8 @@ class IPAddress(models.Model):
         Link,
         related_name='addresses',
         verbose_name='Link',
-        on_delete=models.CASCADE
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
     )
 
     address = models.GenericIPAddressField()
@@ -24,20 +28,84 @@ class IPAddress(models.Model):
     def __str__(self):
         return self.address
 
+    class Meta:
+        unique_together = ('link', 'address')
+
+
+class UniqueVisitorSketch(models.Model):
+    '''
+    A HyperLogLog sketch of the ip addresses that visited a Link.
+    The sketch of the LIFETIME day covers the lifetime of the Link.
+    '''
+
+    # A NULL day would not be covered by the unique constraint.
+    LIFETIME = datetime.date.min
+
+    link = models.ForeignKey(
+        Link,
+        related_name='sketches',
+        verbose_name='Link',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
+    )
+
+    day = models.DateField(
+        verbose_name='Day',
+        help_text='The day covered by this sketch, or the earliest date for all time'
+    )
+
+    registers = models.BinaryField(
+        verbose_name='Registers',
+        help_text='The serialized HyperLogLog sketch'
+    )
+
+    def __str__(self):
+        day = 'all time' if self.day == self.LIFETIME else self.day
+        return '{} ({})'.format(self.link.key, day)
+
+    def get_sketch(self):
+        return HyperLogLog.from_bytes(self.registers)
+
+    class Meta:
+        unique_together = ('link', 'day')
+
+
+class RefererHost(models.Model):
+    '''
+    A referer host name, stored once and shared by the
+    Referer rows of every Link.
+    '''
+
+    # The host of direct clicks, and of clicks from this site. Every
+    # analytics database has it, so Referer rows never need a NULL
+    # host, which their unique constraints would not cover.
+    DIRECT_ID = 0
+
+    name = models.CharField(
+        max_length=80,
+        unique=True,
+        verbose_name='Host name',
+        help_text='The host name of the referer'
+    )
+
+    def __str__(self):
+        return self.name
+
 
 class Referer(models.Model):
     link = models.ForeignKey(
         Link,
         related_name='referers',
         verbose_name='Link',
-        on_delete=models.CASCADE
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
     )
 
-    source = models.CharField(
-        max_length=80,
-        verbose_name='Referer source',
-        help_text='The source of the referer',
-        blank=True
+    host = models.ForeignKey(
+        RefererHost,
+        related_name='referers',
+        verbose_name='Referer host',
+        help_text='The host of the referer, which has no name for direct clicks'
     )
 
     total_clicks = models.PositiveIntegerField(
@@ -49,7 +117,7 @@ class Referer(models.Model):
     last_visited = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
-        return '{}'.format(self.source if self.source else 'N/A')
+        return '{}'.format(self.host.name or 'N/A')
 
     @staticmethod
     def normalize_source(url):
@@ -59,8 +127,15 @@ class Referer(models.Model):
         url = urlparse(url)
         return url.hostname or url.path
 
+    class Meta:
+        unique_together = ('link', 'host')
+
 
 class Country(models.Model):
+    # Stands for clicks from an unknown country, since the unique
+    # constraints of regions and rollups would not cover a NULL country.
+    UNKNOWN_ID = 0
+
     name = models.CharField(
         max_length=120,
         verbose_name='Country name',
@@ -82,15 +157,14 @@ class Region(models.Model):
         Link,
         related_name='regions',
         verbose_name='Link',
-        on_delete=models.CASCADE
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
     )
 
     country = models.ForeignKey(
         Country,
         related_name='regions',
-        verbose_name='Country',
-        blank=True,
-        null=True
+        verbose_name='Country'
     )
 
     total_clicks = models.PositiveIntegerField(
@@ -102,5 +176,92 @@ class Region(models.Model):
     last_visited = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
-        country_code = self.country.code if self.country else 'N/A'
+        country_code = self.country.code or 'N/A'
         return '{} ({})'.format(self.link.key, country_code)
+
+    class Meta:
+        unique_together = ('link', 'country')
+
+
+class Rollup(models.Model):
+    '''
+    Clicks on a Link within one hour or one day (UTC).
+    Hourly buckets are folded into daily buckets once they are
+    older than CLICK_ROLLUP_HOURLY_RETENTION hours.
+    '''
+
+    HOURLY = 'h'
+    DAILY = 'd'
+
+    RESOLUTION_CHOICES = (
+        (HOURLY, 'Hourly'),
+        (DAILY, 'Daily'),
+    )
+
+    resolution = models.CharField(
+        max_length=1,
+        choices=RESOLUTION_CHOICES,
+        verbose_name='Resolution',
+        help_text='The length of the bucket'
+    )
+
+    bucket = models.DateTimeField(
+        verbose_name='Bucket',
+        help_text='The start of the hour or day'
+    )
+
+    total_clicks = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Total clicks',
+        help_text='The total clicks within the bucket'
+    )
+
+    class Meta:
+        abstract = True
+
+
+class RegionRollup(Rollup):
+    link = models.ForeignKey(
+        Link,
+        related_name='region_rollups',
+        verbose_name='Link',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
+    )
+
+    country = models.ForeignKey(
+        Country,
+        related_name='rollups',
+        verbose_name='Country'
+    )
+
+    def __str__(self):
+        country_code = self.country.code or 'N/A'
+        return '{} ({}) {}'.format(self.link.key, country_code, self.bucket)
+
+    class Meta:
+        unique_together = ('link', 'resolution', 'bucket', 'country')
+
+
+class RefererRollup(Rollup):
+    link = models.ForeignKey(
+        Link,
+        related_name='referer_rollups',
+        verbose_name='Link',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
+    )
+
+    host = models.ForeignKey(
+        RefererHost,
+        related_name='rollups',
+        verbose_name='Referer host',
+        help_text='The host of the referer, which has no name for direct clicks'
+    )
+
+    def __str__(self):
+        host_name = self.host.name or 'N/A'
+        return '{} ({}) {}'.format(self.link.key, host_name, self.bucket)
+
+    class Meta:
+        unique_together = ('link', 'resolution', 'bucket', 'host')
@@ -0,0 +1,485 @@
+import atexit
+import collections
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import (
+    IntegrityError,
+    OperationalError,
+    close_old_connections,
+    router,
+    transaction
+)
+from django.db.models import (
+    Case,
+    DateTimeField,
+    F,
+    IntegerField,
+    Q,
+    Value,
+    When
+)
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from links.models import Link
+from links.utils import lookup_country
+
+from .clicklog import click_log
+from .hyperloglog import HyperLogLog
+from .models import (
+    Country,
+    IPAddress,
+    Referer,
+    Region,
+    UniqueVisitorSketch
+)
+from .referers import referer_hosts
+from .rollups import ROLLUPS, hour_bucket, upsert_rollups
+
+logger = logging.getLogger(__name__)
+
+# Rows upserted per statement, five parameters each, so a statement
+# stays within the 999 parameters older SQLite versions allow.
+UPSERT_BATCH_SIZE = 100
+
+
+ClickEvent = collections.namedtuple(
+    'ClickEvent',
+    ['link_id', 'ip_address', 'referer', 'timestamp']
+)
+
+
+class ClickPipeline(object):
+    '''
+    Collect click events from the redirect view and apply them to the
+    analytics tables in batches, outside of the request.
+
+    Events are put on a bounded in-process queue. A background thread
+    drains the queue every CLICK_FLUSH_INTERVAL milliseconds, or as soon
+    as CLICK_FLUSH_SIZE events are waiting, and applies the aggregated
+    counts in one transaction.
+
+    When CLICK_PIPELINE_ASYNC is off, events are applied immediately.
+    '''
+
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def record(self, link_id, ip_address=None, referer=None, timestamp=None):
+        '''
+        Record a click on a Link.
+        '''
+
+        event = ClickEvent(
+            link_id,
+            ip_address,
+            referer or '',
+            timestamp or timezone.now()
+        )
+
+        if not settings.CLICK_PIPELINE_ASYNC:
+            self._flush([event])
+            return
+
+        self._ensure_started()
+
+        # Never block the request. If the flusher cannot keep up,
+        # the event is dropped and counted.
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        '''
+        Apply every event that is waiting in the queue.
+        '''
+
+        events = []
+        while self._queue is not None:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if events:
+            self._flush(events)
+
+    def _ensure_started(self):
+        '''
+        Start the flusher thread, once per process.
+        Forked workers get their own queue and thread.
+        '''
+
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._queue = queue.Queue(maxsize=settings.CLICK_QUEUE_SIZE)
+            self._thread = threading.Thread(
+                target=self._run,
+                name='click-pipeline',
+                daemon=True
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        interval = settings.CLICK_FLUSH_INTERVAL / 1000.0
+        batch_size = settings.CLICK_FLUSH_SIZE
+
+        while True:
+            events = [self._queue.get()]
+            deadline = time.monotonic() + interval
+
+            # Collect events until the interval passes or the batch is full.
+            while len(events) < batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    events.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            close_old_connections()
+            self._flush(events)
+
+    def _flush(self, events):
+        '''
+        Apply events, retrying once if a concurrent writer created one
+        of the same rows first. The flusher thread also retries up to
+        SQLITE_LOCK_RETRIES times, with backoff, while another connection
+        holds the write lock. Requests applying their own events do not,
+        since every attempt already waits for the busy timeout.
+        '''
+
+        retries = (
+            settings.SQLITE_LOCK_RETRIES if settings.CLICK_PIPELINE_ASYNC
+            else 0
+        )
+
+        conflicts = 0
+        locks = 0
+        while True:
+            try:
+                apply_click_events(events)
+                return
+            except Exception as e:
+                locked = (
+                    isinstance(e, OperationalError) and
+                    'database is locked' in str(e)
+                )
+                if isinstance(e, IntegrityError) and not conflicts:
+                    conflicts += 1
+                elif locked and locks < retries:
+                    delay = settings.SQLITE_LOCK_BACKOFF * 2 ** locks
+                    time.sleep(random.uniform(0, delay))
+                    locks += 1
+                else:
+                    logger.exception(
+                        'Could not apply %d click events.', len(events)
+                    )
+                    return
+
+
+def apply_click_events(events):
+    '''
+    Aggregate click events per (link, country), (link, source) and
+    (link, address), and apply them as batched upserts. Hourly rollups
+    per (link, hour, country) and (link, hour, source) are updated too.
+
+    With UNIQUE_CLICKS_MODE set to 'hll', addresses are added to
+    HyperLogLog sketches instead of being stored one row each.
+    '''
+
+    # Ignore events for Links that were deleted in the meantime.
+    link_ids = set(
+        Link.objects
+        .filter(pk__in={event.link_id for event in events})
+        .values_list('pk', flat=True)
+    )
+
+    countries = {}
+
+    regions = collections.defaultdict(lambda: [0, None])
+    referers = collections.defaultdict(lambda: [0, None])
+    addresses = set()
+    rollups = [collections.Counter() for model, field in ROLLUPS]
+    logged = []
+
+    for event in events:
+        if event.link_id not in link_ids:
+            continue
+
+        # Resolve the country of each address once per batch.
+        if event.ip_address not in countries:
+            country = lookup_country(event.ip_address)
+            countries[event.ip_address] = (
+                country.pk if country else Country.UNKNOWN_ID
+            )
+        country_id = countries[event.ip_address]
+
+        # Normalize referer. Clicks from this site have no referer.
+        source = referer_hosts.normalize(event.referer)
+
+        _count(regions[(event.link_id, country_id)], event.timestamp)
+        _count(referers[(event.link_id, source)], event.timestamp)
+
+        bucket = hour_bucket(event.timestamp)
+        rollups[0][(event.link_id, bucket, country_id)] += 1
+        rollups[1][(event.link_id, bucket, source)] += 1
+
+        logged.append((
+            event.link_id,
+            event.timestamp,
+            event.ip_address,
+            country_id,
+            source
+        ))
+
+        if event.ip_address:
+            day = timezone.localtime(event.timestamp).date()
+            addresses.add((event.link_id, day, event.ip_address))
+
+    # Resolve referer hosts to ids. New hosts are created outside of the
+    # transaction, so the map never keeps the id of a rolled back host.
+    host_ids = referer_hosts.resolve(
+        source for link_id, source in referers
+    )
+    referers = {
+        (link_id, host_ids[source]): counts
+        for (link_id, source), counts in referers.items()
+    }
+    rollups[1] = collections.Counter({
+        (link_id, bucket, host_ids[source]): clicks
+        for (link_id, bucket, source), clicks in rollups[1].items()
+    })
+
+    # The clicks and the Link counters are in different databases.
+    # The clicks commit first, and reconcile_click_counts repairs
+    # counters left behind if the Link update fails after that.
+    with transaction.atomic(), \
+            transaction.atomic(using=router.db_for_write(Region)):
+        _upsert_counts(Region, 'country_id', regions)
+        _upsert_counts(Referer, 'host_id', referers)
+        for (model, field), counts in zip(ROLLUPS, rollups):
+            upsert_rollups(model, field, counts)
+
+        # Count unique addresses, either exactly or with sketches.
+        if settings.UNIQUE_CLICKS_MODE == 'hll':
+            unique_clicks = _update_sketches(addresses)
+        else:
+            new_addresses = _insert_addresses(
+                {(link_id, address) for link_id, day, address in addresses}
+            )
+            unique_clicks = {
+                link_id: F('unique_clicks') + clicks
+                for link_id, clicks in collections.Counter(
+                    link_id for link_id, address in new_addresses
+                ).items()
+            }
+
+        # Update the click counters of each Link.
+        total_clicks = collections.Counter()
+        for (link_id, country_id), (clicks, last_visited) in regions.items():
+            total_clicks[link_id] += clicks
+
+        for link_id, clicks in total_clicks.items():
+            counters = {'total_clicks': F('total_clicks') + clicks}
+            if link_id in unique_clicks:
+                counters['unique_clicks'] = unique_clicks[link_id]
+            Link.objects.filter(pk=link_id).update(**counters)
+
+    # Log the clicks once they are applied, so a retried batch
+    # is not logged twice.
+    if settings.CLICK_LOG_ENABLED:
+        click_log.write(logged)
+
+
+def _count(counter, timestamp):
+    counter[0] += 1
+    if counter[1] is None or timestamp > counter[1]:
+        counter[1] = timestamp
+
+
+def _upsert_counts(model, field, counts):
+    '''
+    Add click counts to existing rows and create the missing ones.
+    `counts` maps (link_id, value of `field`) to [clicks, last_visited].
+    Rows keep their latest last_visited.
+    '''
+
+    keys = sorted(counts)
+    for start in range(0, len(keys), UPSERT_BATCH_SIZE):
+        batch = keys[start:start + UPSERT_BATCH_SIZE]
+
+        # Select only the (link, value) pairs of the batch.
+        link_ids = collections.defaultdict(set)
+        for link_id, value in batch:
+            link_ids[value].add(link_id)
+        pairs = Q()
+        for value, ids in link_ids.items():
+            pairs |= Q(link_id__in=ids, **{field: value})
+        existing = {
+            (row['link_id'], row[field]): row['pk']
+            for row in model.objects.filter(pairs).values(
+                'pk', 'link_id', field
+            )
+        }
+
+        new_rows = []
+        clicks = []
+        visits = []
+        for key in batch:
+            total_clicks, last_visited = counts[key]
+            pk = existing.get(key)
+            if pk is None:
+                new_rows.append(model(**{
+                    'link_id': key[0],
+                    field: key[1],
+                    'total_clicks': total_clicks,
+                    'last_visited': last_visited,
+                }))
+            else:
+                clicks.append(When(pk=pk, then=Value(total_clicks)))
+                visits.append(When(pk=pk, then=Value(
+                    last_visited, output_field=DateTimeField()
+                )))
+
+        # Update all existing rows of the batch in one statement.
+        if existing:
+            model.objects.filter(pk__in=existing.values()).update(
+                total_clicks=F('total_clicks') + Case(
+                    *clicks, output_field=IntegerField()
+                ),
+                last_visited=Greatest('last_visited', Case(
+                    *visits, output_field=DateTimeField()
+                ))
+            )
+
+        model.objects.bulk_create(new_rows)
+
+
+def _insert_addresses(addresses):
+    '''
+    Create the IPAddress rows that do not exist yet.
+    Return the (link_id, address) pairs that were created.
+    '''
+
+    if not addresses:
+        return set()
+
+    existing = set(
+        IPAddress.objects.filter(
+            link_id__in={link_id for link_id, address in addresses},
+            address__in={address for link_id, address in addresses},
+        ).values_list('link_id', 'address')
+    )
+
+    new_addresses = addresses - existing
+    IPAddress.objects.bulk_create(
+        IPAddress(link_id=link_id, address=address)
+        for link_id, address in new_addresses
+    )
+    return new_addresses
+
+
+def _update_sketches(addresses):
+    '''
+    Add (link_id, day, address) visits to the lifetime sketch of each
+    Link, and to its daily sketches if UNIQUE_CLICKS_DAILY_SKETCHES is on.
+    Return the new unique click estimate of each Link.
+
+    Sketches are read and written back in the caller's transaction,
+    which holds the write lock from its start, so concurrent batches
+    never overwrite each other's registers.
+    '''
+
+    if not addresses:
+        return {}
+
+    lifetime = UniqueVisitorSketch.LIFETIME
+    daily = settings.UNIQUE_CLICKS_DAILY_SKETCHES
+    link_ids = {link_id for link_id, day, address in addresses}
+    days = {day for link_id, day, address in addresses}
+
+    # Load the sketches touched by this batch.
+    wanted = Q(day=lifetime)
+    if daily:
+        wanted |= Q(day__in=days)
+    rows = {
+        (row.link_id, row.day): row
+        for row in UniqueVisitorSketch.objects.filter(wanted, link_id__in=link_ids)
+    }
+
+    # Links counted exactly before 'hll' mode was turned on have no
+    # lifetime sketch yet. Start theirs from their IPAddress rows.
+    seeds = collections.defaultdict(HyperLogLog)
+    unseeded = {
+        link_id for link_id in link_ids if (link_id, lifetime) not in rows
+    }
+    if unseeded:
+        for link_id, address in (
+                IPAddress.objects
+                .filter(link_id__in=unseeded)
+                .values_list('link_id', 'address')
+                .iterator()):
+            seeds[link_id].add(address)
+
+    sketches = {}
+    for link_id, day, address in addresses:
+        for sketch_day in ((lifetime, day) if daily else (lifetime,)):
+            sketch_key = (link_id, sketch_day)
+            if sketch_key not in sketches:
+                row = rows.get(sketch_key)
+                if row is not None:
+                    sketches[sketch_key] = row.get_sketch()
+                elif sketch_day == lifetime and link_id in seeds:
+                    sketches[sketch_key] = seeds[link_id]
+                else:
+                    sketches[sketch_key] = HyperLogLog()
+            sketches[sketch_key].add(address)
+
+    # Save existing sketches and create the new ones.
+    new_rows = []
+    for (link_id, day), sketch in sketches.items():
+        row = rows.get((link_id, day))
+        if row is None:
+            new_rows.append(UniqueVisitorSketch(
+                link_id=link_id,
+                day=day,
+                registers=sketch.to_bytes()
+            ))
+        else:
+            UniqueVisitorSketch.objects.filter(pk=row.pk).update(
+                registers=sketch.to_bytes()
+            )
+    UniqueVisitorSketch.objects.bulk_create(new_rows)
+
+    return {
+        link_id: sketch.count()
+        for (link_id, day), sketch in sketches.items()
+        if day == lifetime
+    }
+
+
+click_pipeline = ClickPipeline()
+
+# Do not lose queued clicks on a graceful shutdown. Handlers run
+# in reverse order, so the log is closed after the last flush.
+atexit.register(click_log.close)
+atexit.register(click_pipeline.flush)
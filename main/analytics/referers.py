@@ -0,0 +1,105 @@
+import collections
+import threading
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+
+from .models import Referer, RefererHost
+
+
+class RefererHostMap(object):
+    '''
+    Per-worker map from referer urls to RefererHost ids.
+
+    Urls are normalized to host names once, and the most recently used
+    REFERER_CACHE_SIZE urls are kept. Host ids never change, so every
+    host name this worker resolved is kept as well, until there are
+    more than REFERER_CACHE_SIZE of them. Known referers cost no query.
+    '''
+
+    def __init__(self):
+        self._hosts = collections.OrderedDict()
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def normalize(self, url):
+        '''
+        Return the host name of a referer url. Direct clicks and
+        clicks from this site have the empty host name.
+        '''
+
+        if not url:
+            return ''
+
+        with self._lock:
+            host = self._hosts.get(url)
+            if host is not None:
+                self._hosts.move_to_end(url)
+
+        if host is None:
+            host = Referer.normalize_source(url) or ''
+            with self._lock:
+                self._hosts[url] = host
+                while len(self._hosts) > settings.REFERER_CACHE_SIZE:
+                    self._hosts.popitem(last=False)
+
+        # The current Site is cached by Django after the first query.
+        if host == Site.objects.get_current().domain:
+            return ''
+        return host
+
+    def resolve(self, names):
+        '''
+        Return a dict of RefererHost ids by host name, creating the
+        missing hosts. The empty host name maps to the direct host.
+        '''
+
+        names = set(names)
+        ids = {'': RefererHost.DIRECT_ID} if '' in names else {}
+        names.discard('')
+
+        with self._lock:
+            for name in names:
+                if name in self._ids:
+                    ids[name] = self._ids[name]
+        missing = names.difference(ids)
+
+        if missing:
+            def existing():
+                return dict(
+                    RefererHost.objects
+                    .filter(name__in=missing)
+                    .values_list('name', 'pk')
+                )
+
+            found = existing()
+            if len(found) < len(missing):
+                # bulk_create does not set primary keys on SQLite.
+                RefererHost.objects.bulk_create(
+                    RefererHost(name=name) for name in missing.difference(found)
+                )
+                found = existing()
+
+            with self._lock:
+                if len(self._ids) + len(found) > settings.REFERER_CACHE_SIZE:
+                    self._ids.clear()
+                self._ids.update(found)
+            ids.update(found)
+
+        return ids
+
+    def host_id(self, url):
+        '''
+        Return the RefererHost id of a referer url.
+        '''
+
+        host = self.normalize(url)
+        return self.resolve([host])[host]
+
+    def clear(self):
+        with self._lock:
+            self._hosts.clear()
+            self._ids.clear()
+
+
+referer_hosts = RefererHostMap()
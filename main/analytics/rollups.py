@@ -0,0 +1,151 @@
+import collections
+import datetime
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import RefererRollup, RegionRollup, Rollup
+
+
+ROLLUPS = (
+    (RegionRollup, 'country_id'),
+    (RefererRollup, 'host_id'),
+)
+
+
+def hour_bucket(timestamp):
+    '''
+    Return the start of the UTC hour of timestamp.
+    '''
+
+    return timestamp.astimezone(timezone.utc).replace(
+        minute=0, second=0, microsecond=0
+    )
+
+
+def day_bucket(timestamp):
+    '''
+    Return the start of the UTC day of timestamp.
+    '''
+
+    return hour_bucket(timestamp).replace(hour=0)
+
+
+def upsert_rollups(model, field, counts, resolution=Rollup.HOURLY):
+    '''
+    Add click counts to existing rollup rows and create the missing ones.
+    `counts` maps (link_id, bucket, value of `field`) to clicks.
+    '''
+
+    if not counts:
+        return
+
+    existing = {
+        (row['link_id'], row['bucket'], row[field]): row['pk']
+        for row in model.objects.filter(
+            resolution=resolution,
+            link_id__in={link_id for link_id, bucket, value in counts},
+            bucket__in={bucket for link_id, bucket, value in counts},
+        ).values('pk', 'link_id', 'bucket', field)
+    }
+
+    new_rows = []
+    for (link_id, bucket, value), clicks in counts.items():
+        pk = existing.get((link_id, bucket, value))
+        if pk is None:
+            new_rows.append(model(**{
+                'link_id': link_id,
+                'resolution': resolution,
+                'bucket': bucket,
+                field: value,
+                'total_clicks': clicks,
+            }))
+        else:
+            model.objects.filter(pk=pk).update(
+                total_clicks=F('total_clicks') + clicks
+            )
+
+    model.objects.bulk_create(new_rows)
+
+
+def compact_rollups(now=None, batch_size=1000):
+    '''
+    Fold hourly rollups of whole days older than
+    CLICK_ROLLUP_HOURLY_RETENTION hours into daily rollups.
+    Return the number of hourly rows folded.
+    '''
+
+    now = now or timezone.now()
+    cutoff = day_bucket(
+        now - datetime.timedelta(hours=settings.CLICK_ROLLUP_HOURLY_RETENTION)
+    )
+
+    folded = 0
+    for model, field in ROLLUPS:
+        hourly = model.objects.filter(
+            resolution=Rollup.HOURLY,
+            bucket__lt=cutoff
+        )
+
+        # Fold a batch of Links at a time, each in its own transaction.
+        while True:
+            link_ids = list(
+                hourly.order_by('link_id')
+                .values_list('link_id', flat=True)
+                .distinct()[:batch_size]
+            )
+            if not link_ids:
+                break
+
+            with transaction.atomic(using=router.db_for_write(model)):
+                rows = hourly.filter(link_id__in=link_ids)
+                counts = collections.Counter()
+                for link_id, bucket, value, clicks in rows.values_list(
+                        'link_id', 'bucket', field, 'total_clicks'):
+                    counts[(link_id, day_bucket(bucket), value)] += clicks
+
+                upsert_rollups(model, field, counts, Rollup.DAILY)
+                folded += rows.delete()[1].get(model._meta.label, 0)
+
+    return folded
+
+
+def click_series(link, start, end, resolution=Rollup.HOURLY):
+    '''
+    Return a list of (bucket, clicks) for link, one per bucket from
+    start up to end, with the given resolution.
+
+    Daily series also count hourly rows that are not compacted yet.
+    Hourly series only cover the retention window, since older hours
+    are folded into days.
+    '''
+
+    bucket_of = hour_bucket if resolution == Rollup.HOURLY else day_bucket
+    step = datetime.timedelta(
+        hours=1 if resolution == Rollup.HOURLY else 24
+    )
+    start, end = bucket_of(start), bucket_of(end)
+
+    rows = RegionRollup.objects.filter(
+        link=link,
+        bucket__gte=start,
+        bucket__lt=end + step
+    )
+    if resolution == Rollup.HOURLY:
+        rows = rows.filter(resolution=Rollup.HOURLY)
+
+    clicks = collections.Counter()
+    for bucket, total in (
+            rows.values_list('bucket')
+            .annotate(total=Sum('total_clicks'))
+            .values_list('bucket', 'total')):
+        clicks[bucket_of(bucket)] += total
+
+    series = []
+    bucket = start
+    while bucket <= end:
+        series.append((bucket, clicks[bucket]))
+        bucket += step
+    return series
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from links.models import Link
+
+from .models import (
+    IPAddress,
+    Referer,
+    RefererRollup,
+    Region,
+    RegionRollup,
+    UniqueVisitorSketch
+)
+
+
+@receiver(post_delete, sender=Link)
+def delete_link_analytics(sender, instance, **kwargs):
+    '''
+    Delete the click rows of a deleted Link. They live in another
+    database, where a cascade from the Link cannot reach them.
+    '''
+
+    for model in (IPAddress, UniqueVisitorSketch, Referer, Region,
+                  RegionRollup, RefererRollup):
+        model.objects.filter(link_id=instance.pk).delete()
@@ -1,3 +1,870 @@
-from django.test import TestCase
+import datetime
+import glob
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import (
+    IntegrityError, OperationalError, connections, transaction
+)
+from django.db.migrations.recorder import MigrationRecorder
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+
+from analytics.clicklog import (
+    ClickLogBusy, ColumnSegment, click_log, pack_ip, rebuild_analytics,
+    seal_segments, segments, unpack_ip
+)
+from analytics.export import COLUMNS, export_rows
+from analytics.geoip import GeoIPService
+from analytics.hyperloglog import HyperLogLog
+from analytics.models import (
+    Country,
+    IPAddress,
+    Referer,
+    RefererHost,
+    RefererRollup,
+    Region,
+    RegionRollup,
+    Rollup,
+    UniqueVisitorSketch
+)
+from analytics.pipeline import ClickEvent, ClickPipeline, apply_click_events
+from analytics.referers import referer_hosts
+from analytics.rollups import click_series, compact_rollups
+from links.cache import link_cache
+from links.models import Link
+from links.utils import reconcile_click_counts
+from users.models import User
+
+
+class ClickPipelineTests(TestCase):
+    fixtures = ['users', 'links']
+    multi_db = True
+    site_domain = 'testexample.com'
+
+    def setUp(self):
+        '''
+        Modify the current site with the
+        predefined site domain.
+        '''
+
+        site = Site.objects.get_current()
+        site.domain = self.site_domain
+        site.name = self.site_domain
+        site.save()
+
+        # Drop Links and referer hosts cached by previous tests.
+        link_cache.clear()
+        referer_hosts.clear()
+
+        self.link = Link.objects.first()
+
+    def make_event(self, ip_address, referer=''):
+        return ClickEvent(self.link.pk, ip_address, referer, timezone.now())
+
+    def test_apply_aggregates_events(self):
+        '''
+        Apply a batch of events and check that clicks are
+        aggregated per region, referer and address.
+        '''
+
+        apply_click_events([
+            self.make_event('10.0.0.1', 'http://example.com/a'),
+            self.make_event('10.0.0.1', 'http://example.com/b'),
+            self.make_event('10.0.0.2', 'http://other.com/'),
+            self.make_event('10.0.0.3', 'http://testexample.com/'),
+        ])
+
+        # All clicks belong to the unknown region.
+        region = Region.objects.get(link=self.link)
+        self.assertEqual(region.country_id, Country.UNKNOWN_ID)
+        self.assertEqual(region.total_clicks, 4)
+
+        # Clicks are grouped by referer host, and this site is ignored.
+        referers = dict(
+            Referer.objects
+            .filter(link=self.link)
+            .values_list('host__name', 'total_clicks')
+        )
+        self.assertEqual(
+            referers,
+            {'example.com': 2, 'other.com': 1, '': 1}
+        )
+
+        # Each address is stored once.
+        self.assertEqual(
+            IPAddress.objects.filter(link=self.link).count(),
+            3
+        )
+
+        # The Link's counters follow.
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.total_clicks, 4)
+        self.assertEqual(self.link.unique_clicks, 3)
+
+    def test_apply_updates_existing_rows(self):
+        '''
+        Apply two batches and check that the second batch
+        adds to the rows created by the first.
+        '''
+
+        apply_click_events([self.make_event('10.0.0.1')])
+        apply_click_events([
+            self.make_event('10.0.0.1'),
+            self.make_event('10.0.0.2'),
+        ])
+
+        self.assertEqual(Region.objects.filter(link=self.link).count(), 1)
+        self.assertEqual(Region.objects.get(link=self.link).total_clicks, 3)
+        self.assertEqual(Referer.objects.get(link=self.link).total_clicks, 3)
+        self.assertEqual(IPAddress.objects.filter(link=self.link).count(), 2)
+
+    def test_apply_batches_updates_and_keeps_latest_visit(self):
+        '''
+        Existing rows are updated in one statement per table, and
+        an older click does not move their last visit back.
+        '''
+
+        now = timezone.now()
+        sources = ['http://{}.com/'.format(name) for name in 'abc']
+        apply_click_events([
+            ClickEvent(self.link.pk, '', source, now) for source in sources
+        ])
+
+        earlier = now - datetime.timedelta(hours=1)
+        with CaptureQueriesContext(connections['analytics']) as queries:
+            apply_click_events([
+                ClickEvent(self.link.pk, '', source, earlier)
+                for source in sources
+            ])
+        updates = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "analytics_referer"')
+        ]
+        self.assertEqual(len(updates), 1)
+
+        referers = Referer.objects.filter(link=self.link)
+        self.assertEqual(
+            sorted(referers.values_list('total_clicks', flat=True)),
+            [2, 2, 2]
+        )
+        self.assertEqual(
+            set(referers.values_list('last_visited', flat=True)), {now}
+        )
+        self.assertEqual(
+            Region.objects.get(link=self.link).last_visited, now
+        )
+
+    def test_reconcile_click_counts(self):
+        '''
+        Reconciling recomputes counters that drifted.
+        '''
+
+        apply_click_events([
+            self.make_event('10.0.0.1'),
+            self.make_event('10.0.0.2'),
+        ])
+        Link.objects.filter(pk=self.link.pk).update(
+            total_clicks=10,
+            unique_clicks=0
+        )
+
+        self.assertEqual(reconcile_click_counts(), 1)
+        self.assertEqual(reconcile_click_counts(), 0)
+
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.total_clicks, 2)
+        self.assertEqual(self.link.unique_clicks, 2)
+
+    def test_apply_ignores_deleted_links(self):
+        '''
+        Events for a Link that no longer exists are dropped.
+        '''
+
+        event = self.make_event('10.0.0.1')
+        self.link.delete()
+
+        apply_click_events([event])
+        self.assertFalse(Region.objects.exists())
+
+    @override_settings(SQLITE_LOCK_BACKOFF=0, CLICK_PIPELINE_ASYNC=True)
+    def test_locked_batches_are_retried(self):
+        '''
+        A batch that finds the database locked is applied again
+        by the flusher thread, but not within a request.
+        '''
+
+        locked = OperationalError('database is locked')
+        with mock.patch('analytics.pipeline.apply_click_events') as apply:
+            apply.side_effect = [locked, locked, None]
+            ClickPipeline()._flush([self.make_event('10.0.0.1')])
+        self.assertEqual(apply.call_count, 3)
+
+        with self.settings(CLICK_PIPELINE_ASYNC=False), \
+                mock.patch('analytics.pipeline.apply_click_events') as apply:
+            apply.side_effect = [locked, None]
+            ClickPipeline()._flush([self.make_event('10.0.0.1')])
+        self.assertEqual(apply.call_count, 1)
+
+    def test_clicks_are_kept_in_their_own_database(self):
+        '''
+        Clicks are written to the analytics database, and
+        deleting a Link there deletes its clicks too.
+        '''
+
+        apply_click_events([self.make_event('10.0.0.1')])
+        self.assertEqual(Region.objects.db, settings.ANALYTICS_DATABASE)
+        self.assertEqual(self.link.regions.get().total_clicks, 1)
+
+        self.link.delete()
+        self.assertFalse(Region.objects.exists())
+        self.assertFalse(Referer.objects.exists())
+        self.assertFalse(IPAddress.objects.exists())
+
+    def test_referer_hosts_are_interned(self):
+        '''
+        Referer urls of a known host resolve to the same
+        RefererHost without queries.
+        '''
+
+        host_id = referer_hosts.host_id('http://example.com/a')
+
+        with self.assertNumQueries(0, using=settings.ANALYTICS_DATABASE):
+            self.assertEqual(
+                referer_hosts.host_id('http://example.com/b'), host_id
+            )
+            for url in ('http://testexample.com/', ''):
+                self.assertEqual(
+                    referer_hosts.host_id(url), RefererHost.DIRECT_ID
+                )
+
+        self.assertEqual(RefererHost.objects.get(pk=host_id).name, 'example.com')
+
+    def test_direct_clicks_share_one_row(self):
+        '''
+        Direct clicks are counted on the direct RefererHost,
+        so the unique constraint covers their rows too.
+        '''
+
+        apply_click_events([self.make_event('10.0.0.1')])
+        referer = Referer.objects.get(link=self.link)
+        self.assertEqual(referer.host_id, RefererHost.DIRECT_ID)
+
+        with self.assertRaises(IntegrityError), \
+                transaction.atomic(using=settings.ANALYTICS_DATABASE):
+            Referer.objects.create(
+                link=self.link,
+                host_id=RefererHost.DIRECT_ID
+            )
+
+    def test_redirect_records_click(self):
+        '''
+        Follow a short link and check that the click was recorded.
+        '''
+
+        url = reverse('redirect-to-link', kwargs={'key': self.link.key})
+        response = self.client.get(url, HTTP_REFERER='http://example.com/')
+
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(Region.objects.get(link=self.link).total_clicks, 1)
+        self.assertEqual(
+            Referer.objects.get(link=self.link).host.name,
+            'example.com'
+        )
+
+
+@override_settings(UNIQUE_CLICKS_MODE='hll', UNIQUE_CLICKS_DAILY_SKETCHES=True)
+class UniqueSketchTests(TestCase):
+    fixtures = ['users', 'links']
+    multi_db = True
+
+    def setUp(self):
+        self.link = Link.objects.first()
+
+    def make_event(self, ip_address, day):
+        timestamp = timezone.make_aware(datetime.datetime(2016, 12, day, 12))
+        return ClickEvent(self.link.pk, ip_address, '', timestamp)
+
+    def test_sketches_replace_address_rows(self):
+        '''
+        In 'hll' mode no IPAddress rows are written,
+        and the sketch feeds the unique click counter.
+        '''
+
+        apply_click_events([
+            self.make_event('10.0.0.{}'.format(i % 50), 1)
+            for i in range(200)
+        ])
+
+        self.assertFalse(IPAddress.objects.exists())
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.total_clicks, 200)
+        self.assertAlmostEqual(self.link.unique_clicks, 50, delta=3)
+
+    def test_daily_sketches_merge(self):
+        '''
+        Unique clicks over a range of days count each address once.
+        '''
+
+        apply_click_events([self.make_event('10.0.0.1', 1)])
+        apply_click_events([
+            self.make_event('10.0.0.1', 2),
+            self.make_event('10.0.0.2', 2),
+        ])
+        apply_click_events([self.make_event('10.0.0.3', 3)])
+
+        self.assertEqual(
+            self.link.sketches.exclude(day=UniqueVisitorSketch.LIFETIME).count(),
+            3
+        )
+
+        day = datetime.date(2016, 12, 1)
+        self.assertEqual(self.link.unique_clicks_between(day, day), 1)
+        self.assertEqual(
+            self.link.unique_clicks_between(day, day.replace(day=2)),
+            2
+        )
+        self.assertEqual(
+            self.link.unique_clicks_between(day, day.replace(day=31)),
+            3
+        )
+
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.unique_clicks, 3)
+
+    def test_sketches_start_from_exact_counts(self):
+        '''
+        Links counted exactly before 'hll' mode was turned on
+        keep their unique clicks in their first sketch.
+        '''
+
+        with self.settings(UNIQUE_CLICKS_MODE='exact'):
+            apply_click_events([
+                self.make_event('10.0.0.{}'.format(i), 1) for i in range(10)
+            ])
+        apply_click_events([
+            self.make_event('10.0.0.1', 2),
+            self.make_event('10.0.0.99', 2),
+        ])
+
+        self.link.refresh_from_db()
+        self.assertAlmostEqual(self.link.unique_clicks, 11, delta=1)
+        self.assertEqual(reconcile_click_counts(), 0)
+
+    def test_hyperloglog_estimate(self):
+        '''
+        Large cardinalities are estimated within a few percent,
+        and serialization keeps the estimate.
+        '''
+
+        sketch = HyperLogLog()
+        sketch.update(range(20000))
+        sketch = HyperLogLog.from_bytes(sketch.to_bytes())
+
+        self.assertAlmostEqual(sketch.count(), 20000, delta=20000 * 0.05)
+
+
+class FakeGeoIP2(object):
+    '''
+    Stands in for a GeoIP2 database with one known address.
+    '''
+
+    def __init__(self):
+        self.lookups = 0
+
+    def country(self, ip_address):
+        self.lookups += 1
+        if ip_address == '10.0.0.1':
+            return {'country_name': 'Canada', 'country_code': 'CA'}
+        return {'country_name': None, 'country_code': None}
+
+
+class GeoIPServiceTests(TestCase):
+    def setUp(self):
+        self.reader = FakeGeoIP2()
+        self.service = GeoIPService()
+        self.service._reader = self.reader
+        self.service._opened = True
+
+    def test_repeated_lookups_are_cached(self):
+        '''
+        Each address is looked up in the database once.
+        '''
+
+        for i in range(3):
+            self.assertEqual(
+                self.service.country('10.0.0.1'),
+                ('Canada', 'CA')
+            )
+            self.assertIsNone(self.service.country('10.0.0.2'))
+
+        self.assertEqual(self.reader.lookups, 2)
+        self.assertEqual(self.service.misses, 2)
+        self.assertEqual(self.service.hits, 4)
+
+    @override_settings(GEOIP_CACHE_SIZE=1)
+    def test_cache_is_bounded(self):
+        '''
+        The least recently used address is evicted.
+        '''
+
+        self.service.country('10.0.0.1')
+        self.service.country('10.0.0.2')
+        self.service.country('10.0.0.1')
+
+        self.assertEqual(self.reader.lookups, 3)
+
+    def test_missing_database(self):
+        '''
+        Lookups return None when there is no database.
+        '''
+
+        with self.settings(GEOIP_PATH='/does/not/exist'):
+            service = GeoIPService()
+            self.assertIsNone(service.country('10.0.0.1'))
+            self.assertFalse(service.open())
+
+
+class RollupTests(TestCase):
+    fixtures = ['users', 'links']
+    multi_db = True
+
+    def setUp(self):
+        referer_hosts.clear()
+        self.link = Link.objects.first()
+        self.now = datetime.datetime(2020, 3, 10, 12, 30, tzinfo=timezone.utc)
+
+    def click(self, hours_ago, referer=''):
+        return ClickEvent(
+            self.link.pk,
+            '10.0.0.1',
+            referer,
+            self.now - datetime.timedelta(hours=hours_ago)
+        )
+
+    def test_clicks_are_rolled_up_hourly(self):
+        '''
+        Clicks are counted per hour, per country and per referer.
+        '''
+
+        apply_click_events([self.click(0), self.click(0, 'http://a.com/')])
+        apply_click_events([self.click(0), self.click(1)])
+
+        rollups = RegionRollup.objects.filter(link=self.link)
+        self.assertEqual(
+            sorted(rollups.values_list('bucket', 'total_clicks')),
+            [
+                (datetime.datetime(2020, 3, 10, 11, tzinfo=timezone.utc), 1),
+                (datetime.datetime(2020, 3, 10, 12, tzinfo=timezone.utc), 3),
+            ]
+        )
+        self.assertTrue(all(r.resolution == Rollup.HOURLY for r in rollups))
+        self.assertTrue(all(
+            r.country_id == Country.UNKNOWN_ID for r in rollups
+        ))
+
+        referers = RefererRollup.objects.filter(link=self.link)
+        self.assertEqual(
+            list(
+                referers.order_by('host__name', 'total_clicks')
+                .values_list('host__name', 'total_clicks')
+            ),
+            [('', 1), ('', 2), ('a.com', 1)]
+        )
+
+    def test_compact_rollups(self):
+        '''
+        Hourly rollups of whole days past the retention window are
+        folded into daily rollups, and series still count them.
+        '''
+
+        with self.settings(CLICK_ROLLUP_HOURLY_RETENTION=48):
+            apply_click_events([
+                self.click(84), self.click(80), self.click(80), self.click(1)
+            ])
+            folded = compact_rollups(now=self.now)
+
+        # Both hours of March 7th are folded, per country and per
+        # referer. The recent hour is kept.
+        self.assertEqual(folded, 4)
+        daily = RegionRollup.objects.get(resolution=Rollup.DAILY)
+        self.assertEqual(
+            daily.bucket,
+            datetime.datetime(2020, 3, 7, tzinfo=timezone.utc)
+        )
+        self.assertEqual(daily.total_clicks, 3)
+        self.assertEqual(
+            RegionRollup.objects.filter(resolution=Rollup.HOURLY).count(), 1
+        )
+
+        series = click_series(
+            self.link,
+            self.now - datetime.timedelta(days=4),
+            self.now,
+            Rollup.DAILY
+        )
+        self.assertEqual([clicks for bucket, clicks in series], [0, 3, 0, 0, 1])
+
+        series = click_series(
+            self.link, self.now - datetime.timedelta(hours=2), self.now
+        )
+        self.assertEqual([clicks for bucket, clicks in series], [0, 1, 0])
+
+
+class ClickLogTests(TestCase):
+    fixtures = ['users', 'links']
+    multi_db = True
+
+    def setUp(self):
+        referer_hosts.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        settings = self.settings(
+            CLICK_LOG_ENABLED=True,
+            CLICK_LOG_DIR=self.directory
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(click_log.close)
+
+        self.link = Link.objects.first()
+
+    def click(self, ip_address, referer=''):
+        return ClickEvent(self.link.pk, ip_address, referer, timezone.now())
+
+    def test_pack_ip(self):
+        '''
+        Ip addresses round trip through their packed form.
+        '''
+
+        for address in ('10.0.0.1', '2001:db8::1'):
+            self.assertEqual(unpack_ip(pack_ip(address)), address)
+        self.assertEqual(unpack_ip(pack_ip(None)), None)
+
+    def test_sealed_segments(self):
+        '''
+        Applied clicks are logged, and sealed segments hold
+        the same records in columns.
+        '''
+
+        apply_click_events([
+            self.click('10.0.0.1', 'http://a.com/'),
+            self.click('10.0.0.2'),
+        ])
+        apply_click_events([self.click('10.0.0.1', 'http://b.com/')])
+
+        # The open segment is only sealed once closed.
+        self.assertEqual(seal_segments(), 0)
+        click_log.close()
+        self.assertEqual(seal_segments(), 1)
+
+        segment, = segments()
+        self.assertIsInstance(segment, ColumnSegment)
+        self.assertTrue(segment.path.endswith('.seg'))
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            os.path.basename(segment.path), 'started'
+        ])
+
+        columns = segment.columns()
+        self.assertEqual(list(columns['link_id']), [self.link.pk] * 3)
+        self.assertEqual(
+            [unpack_ip(ip) for ip in columns['ip_address']],
+            ['10.0.0.1', '10.0.0.2', '10.0.0.1']
+        )
+        self.assertEqual(
+            [segment.sources[i] for i in columns['referer_id']],
+            ['a.com', '', 'b.com']
+        )
+
+    def test_segments_of_dead_processes_are_sealed(self):
+        '''
+        Open segments are sealed once the process writing them is gone.
+        '''
+
+        apply_click_events([self.click('10.0.0.1')])
+
+        process = subprocess.Popen(['true'])
+        process.wait()
+        path, = glob.glob(os.path.join(self.directory, '*.open'))
+        shutil.copy(path, os.path.join(
+            self.directory, '20000101000000000000-{}.open'.format(process.pid)
+        ))
+
+        self.assertEqual(seal_segments(), 1)
+        self.assertEqual(len(segments()), 2)
+
+    def test_rebuild_analytics(self):
+        '''
+        Region and Referer rows, and click counters, are rebuilt from
+        the log for the Links created after the log began.
+        '''
+
+        # Clicks on a Link older than the log may be missing from it.
+        apply_click_events([self.click('10.0.0.1')])
+
+        self.link = Link.objects.create(
+            key='logged',
+            destination='http://example.com/'
+        )
+        apply_click_events([
+            self.click('10.0.0.1', 'http://a.com/'),
+            self.click('10.0.0.2', 'http://a.com/'),
+        ])
+        click_log.close()
+        seal_segments()
+
+        # Clicks this process logged in its open segment are read too.
+        apply_click_events([self.click('10.0.0.3')])
+
+        Region.objects.all().delete()
+        Referer.objects.all().delete()
+        Link.objects.update(total_clicks=0)
+
+        self.assertEqual(rebuild_analytics(), 1)
+        self.assertEqual(Region.objects.get(link=self.link).total_clicks, 3)
+        self.assertEqual(
+            list(
+                Referer.objects.filter(link=self.link)
+                .order_by('host__name')
+                .values_list('host__name', 'total_clicks')
+            ),
+            [('', 1), ('a.com', 2)]
+        )
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.total_clicks, 3)
+        self.assertEqual(Region.objects.count(), 1)
+
+    def test_rebuild_refuses_live_writers(self):
+        '''
+        The rebuild does not run while other processes write the log.
+        '''
+
+        apply_click_events([self.click('10.0.0.1')])
+
+        # The parent of the test process is alive.
+        path, = glob.glob(os.path.join(self.directory, '*.open'))
+        shutil.copy(path, os.path.join(
+            self.directory, '20000101000000000000-{}.open'.format(os.getppid())
+        ))
+
+        with self.assertRaises(ClickLogBusy):
+            rebuild_analytics()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_click_analytics', stdout=io.StringIO())
+
+
+class ExportTests(TestCase):
+    fixtures = ['users', 'links']
+    multi_db = True
+
+    def setUp(self):
+        referer_hosts.clear()
+        self.user = User.objects.get(email='user@email.com')
+        self.link = self.user.links.first()
+
+        apply_click_events([
+            ClickEvent(self.link.pk, '10.0.0.1', 'http://a.com/', timezone.now()),
+            ClickEvent(self.link.pk, '10.0.0.2', 'http://b.com/', timezone.now()),
+        ])
+
+    def test_export_rows(self):
+        '''
+        Every Link of the user is exported, followed by
+        its Region and Referer rows.
+        '''
+
+        rows = list(export_rows(self.user, chunk_size=2))
+
+        links = [row for row in rows if row['record'] == 'link']
+        self.assertEqual(len(links), self.user.links.count())
+
+        clicked = [row for row in links if row['key'] == self.link.key][0]
+        self.assertEqual(clicked['total_clicks'], 2)
+        self.assertEqual(clicked['unique_clicks'], 2)
+
+        self.assertEqual(
+            [row['dimension'] for row in rows if row['record'] == 'region'],
+            ['']
+        )
+        self.assertEqual(
+            sorted(row['dimension'] for row in rows if row['record'] == 'referer'),
+            ['a.com', 'b.com']
+        )
+
+    def test_export_view(self):
+        '''
+        The export is streamed as CSV or NDJSON.
+        '''
+
+        self.client.login(email=self.user.email, password='user')
+        url = reverse('export-clicks')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(','), list(COLUMNS))
+        self.assertEqual(len(lines), 1 + self.user.links.count() + 3)
+
+        response = self.client.get(url, {'format': 'ndjson'})
+        self.assertEqual(response.status_code, 200)
+        rows = [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(len(rows), self.user.links.count() + 3)
+
+        response = self.client.get(url, {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_command(self):
+        '''
+        The management command writes the same export.
+        '''
+
+        output = io.StringIO()
+        call_command(
+            'export_clicks', self.user.email, format='ndjson', stdout=output
+        )
+        self.assertEqual(
+            len(output.getvalue().splitlines()),
+            self.user.links.count() + 3
+        )
+
+
+class CopyAnalyticsDatabaseTests(TestCase):
+    multi_db = True
+
+    # Migrations of the last release that kept every app in one database.
+    BASELINE = (
+        ('links', '0007_remove_link_total_clicks'),
+        ('analytics', '0004_region_country_remove_default'),
+    )
+
+    def setUp(self):
+        referer_hosts.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        connections.databases['legacy'] = {
+            'ENGINE': 'config.sqlite_backend',
+            'NAME': os.path.join(directory, 'legacy.sqlite3'),
+        }
+        self.addCleanup(connections.databases.pop, 'legacy')
+        self.addCleanup(self.close_legacy)
+
+    def close_legacy(self):
+        connections['legacy'].close()
+        del connections['legacy']
+
+    def test_upgrade_and_copy(self):
+        '''
+        Upgrade a database of the last single database release in place,
+        copy its analytics rows over and reconcile the Link counters.
+        '''
+
+        with override_settings(DATABASE_ROUTERS=[]):
+            for app_label, migration in self.BASELINE:
+                call_command(
+                    'migrate', app_label, migration,
+                    database='legacy', verbosity=0
+                )
+
+        with connections['legacy'].cursor() as cursor:
+            now = timezone.now()
+            cursor.executemany(
+                'INSERT INTO links_link (id, created_on, modified_on, '
+                'destination, key, title) VALUES (%s, %s, %s, %s, %s, %s)',
+                [
+                    (1, now, now, 'http://one.com', 'one', 'One'),
+                    (2, now, now, 'http://two.com', 'two', 'Two'),
+                ]
+            )
+            cursor.execute(
+                'INSERT INTO analytics_country (id, name, code) '
+                'VALUES (1, \'Canada\', \'CA\')'
+            )
+            cursor.executemany(
+                'INSERT INTO analytics_region (link_id, country_id, '
+                'total_clicks, last_visited) VALUES (%s, %s, %s, %s)',
+                [(1, 1, 3, now), (1, None, 2, now), (2, 1, 1, now)]
+            )
+            cursor.executemany(
+                'INSERT INTO analytics_referer (link_id, source, '
+                'total_clicks, last_visited) VALUES (%s, %s, %s, %s)',
+                [(1, 'a.com', 4, now), (1, '', 1, now), (2, 'a.com', 1, now)]
+            )
+            cursor.executemany(
+                'INSERT INTO analytics_ipaddress (link_id, address) '
+                'VALUES (%s, %s)',
+                [(1, '10.0.0.1'), (1, '10.0.0.2'), (2, '10.0.0.1')]
+            )
+
+        with self.settings(LEGACY_ANALYTICS_DATABASES=('legacy',)):
+            call_command('migrate', database='legacy', verbosity=0)
+
+        # The same Links, as they are in the links database.
+        one, two = (
+            Link.objects.create(pk=1, destination='http://one.com', key='one'),
+            Link.objects.create(pk=2, destination='http://two.com', key='two'),
+        )
+
+        with self.settings(LEGACY_ANALYTICS_DATABASES=('legacy',)):
+            call_command(
+                'copy_analytics_database', source='legacy',
+                stdout=io.StringIO()
+            )
+
+        self.assertEqual(
+            Region.objects.get(link=one, country__code='CA').total_clicks, 3
+        )
+        self.assertEqual(Region.objects.get(
+                link=one, country_id=Country.UNKNOWN_ID
+            ).total_clicks,
+            2
+        )
+        self.assertEqual(
+            Referer.objects.get(link=one, host__name='a.com').total_clicks, 4
+        )
+        self.assertEqual(
+            Referer.objects.get(
+                link=one, host_id=RefererHost.DIRECT_ID
+            ).total_clicks,
+            1
+        )
+        self.assertEqual(IPAddress.objects.count(), 3)
+
+        one.refresh_from_db()
+        two.refresh_from_db()
+        self.assertEqual((one.total_clicks, one.unique_clicks), (5, 2))
+        self.assertEqual((two.total_clicks, two.unique_clicks), (1, 1))
+
+        # The legacy analytics tables are gone, links stay.
+        tables = connections['legacy'].introspection.table_names()
+        self.assertNotIn(Region._meta.db_table, tables)
+        self.assertIn(Link._meta.db_table, tables)
+        recorder = MigrationRecorder(connections['legacy'])
+        self.assertFalse(
+            recorder.migration_qs.filter(app='analytics').exists()
+        )
+
+    def test_source_must_be_legacy(self):
+        '''
+        Only a database listed in LEGACY_ANALYTICS_DATABASES is copied.
+        '''
+
+        with self.assertRaises(CommandError):
+            call_command(
+                'copy_analytics_database', source='legacy',
+                stdout=io.StringIO()
+            )
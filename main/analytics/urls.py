@@ -0,0 +1,11 @@
+from django.conf.urls import url
+
+from . import views
+
+urlpatterns = [
+    url(
+        r'^export/clicks/$',
+        views.export_clicks,
+        name='export-clicks'
+    ),
+]
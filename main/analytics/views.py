@@ -1,3 +1,26 @@
-from django.shortcuts import render
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
 
-# Create your views here.
+from .export import FORMATS
+
+
+@login_required
+def export_clicks(request):
+    '''
+    Stream click totals and Region and Referer breakdowns
+    of the User's links, as CSV or NDJSON.
+    '''
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in FORMATS:
+        return HttpResponseBadRequest('Unknown export format.')
+
+    export, content_type = FORMATS[export_format]
+    response = StreamingHttpResponse(
+        export(request.user),
+        content_type=content_type
+    )
+    response['Content-Disposition'] = (
+        'attachment; filename="clicks.{}"'.format(export_format)
+    )
+    return response
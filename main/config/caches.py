@@ -0,0 +1,19 @@
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class LazyCullFileBasedCache(FileBasedCache):
+    '''
+    A FileBasedCache that checks whether it holds more than MAX_ENTRIES
+    every CULL_INTERVAL sets, instead of listing its whole directory on
+    every set. Meant for many small entries, like rate limit buckets.
+    '''
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._cull_interval = params.get('OPTIONS', {}).get('CULL_INTERVAL', 1000)
+        self._sets = 0
+
+    def _cull(self):
+        self._sets += 1
+        if self._sets % self._cull_interval == 0:
+            super()._cull()
@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+raw_env = 'DJANGO_SETTINGS_MODULE=config.production'
+
+HOST = '0.0.0.0'
+
+PORT = '8000'
+
+bind = '{}:{}'.format(HOST, PORT)
+
+accesslog = '/app/log/gunicorn-access.log'
+
+errorlog = '/app/log/gunicorn-error.log'
+
+# Workers and threads per worker, sized from the cpu count.
+# Threads overlap Database and GeoIP waits within a worker.
+workers = int(os.environ.get(
+    'GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1
+))
+
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+worker_class = 'gthread'
+
+# Load Django once, in the master, and fork the workers from it.
+preload_app = True
+
+# Restart workers after a number of requests, with jitter so
+# they do not all restart at once. This contains slow leaks.
+max_requests = 10000
+
+max_requests_jitter = 1000
+
+timeout = 30
+
+keepalive = 5
+
+
+def when_ready(server):
+    '''
+    Warm up the master before the workers are forked.
+    '''
+
+    from config.warmup import warm_up
+    warm_up()
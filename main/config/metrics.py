@@ -0,0 +1,437 @@
+import bisect
+import collections
+import glob
+import heapq
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+from django.http import HttpResponse
+from django.template.backends.django import DjangoTemplates
+from ipware.ip import get_ip
+
+from .utils import process_exists
+
+
+# Upper bounds of the request latency histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Time spent in each part of a request, next to the total.
+TIMINGS = ('db', 'template', 'geoip')
+
+
+class Metrics(object):
+    '''
+    Request metrics of one process, per URL name.
+
+    Every request adds to a few counters under a lock. If METRICS_DIR is
+    set, each worker also writes its counters to its own file there, at
+    most every METRICS_FLUSH_INTERVAL seconds, and the metrics endpoint
+    adds up the files of all workers.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.views = {}
+            # The slowest time of each of the slowest keys.
+            self.slow_keys = {}
+            self.missing_keys = collections.Counter()
+            self.geoip = [0, 0.0]
+            self._written_at = 0
+
+    def start(self):
+        '''
+        Start timing the parts of a request in this thread.
+        '''
+
+        self._local.timings = collections.Counter()
+        self._local.queries = 0
+
+    def add_query(self, seconds):
+        '''
+        Count a database query of the current request, if any.
+        '''
+
+        timings = getattr(self._local, 'timings', None)
+        if timings is not None:
+            timings['db'] += seconds
+            self._local.queries += 1
+
+    def request_queries(self):
+        '''
+        Return the number of queries of the current request.
+        '''
+
+        return getattr(self._local, 'queries', 0)
+
+    def add_time(self, name, seconds):
+        '''
+        Add time spent in a part of the current request, if any.
+        '''
+
+        timings = getattr(self._local, 'timings', None)
+        if timings is not None:
+            timings[name] += seconds
+
+        if name == 'geoip':
+            with self._lock:
+                self.geoip[0] += 1
+                self.geoip[1] += seconds
+
+    def finish(self, view, seconds, queries=0, key=None):
+        '''
+        Count a request to view that took seconds. The slowest
+        METRICS_SLOW_KEYS keys of redirects are kept.
+        '''
+
+        timings = getattr(self._local, 'timings', None) or {}
+        self._local.timings = None
+
+        with self._lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = {
+                    'requests': 0,
+                    'seconds': 0.0,
+                    'buckets': [0] * (len(BUCKETS) + 1),
+                    'queries': 0,
+                }
+                stats.update(('{}_seconds'.format(name), 0.0) for name in TIMINGS)
+
+            stats['requests'] += 1
+            stats['seconds'] += seconds
+            stats['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+            stats['queries'] += queries
+            for name in TIMINGS:
+                stats['{}_seconds'.format(name)] += timings.get(name, 0.0)
+
+            if key is not None and seconds > self.slow_keys.get(key, 0.0):
+                self.slow_keys[key] = seconds
+                if len(self.slow_keys) > settings.METRICS_SLOW_KEYS:
+                    fastest = min(self.slow_keys, key=self.slow_keys.get)
+                    del self.slow_keys[fastest]
+
+    def count_missing_key(self, client):
+        '''
+        Count a redirect to an unknown key from a client address.
+        Only the METRICS_MISSING_KEY_CLIENTS busiest clients are kept.
+        '''
+
+        limit = settings.METRICS_MISSING_KEY_CLIENTS
+        with self._lock:
+            self.missing_keys[client] += 1
+            if len(self.missing_keys) > 2 * limit:
+                self.missing_keys = collections.Counter(
+                    dict(self.missing_keys.most_common(limit))
+                )
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'views': {
+                    view: dict(stats, buckets=list(stats['buckets']))
+                    for view, stats in self.views.items()
+                },
+                'slow_keys': sorted(
+                    (
+                        (seconds, key)
+                        for key, seconds in self.slow_keys.items()
+                    ),
+                    reverse=True
+                ),
+                'missing_keys': dict(self.missing_keys),
+                'geoip': list(self.geoip),
+            }
+
+    def write(self, force=False):
+        '''
+        Write this worker's counters to METRICS_DIR.
+        '''
+
+        if not settings.METRICS_DIR:
+            return
+
+        now = time.monotonic()
+        if not force and now - self._written_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self._written_at = now
+
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = os.path.join(settings.METRICS_DIR, '{}.json'.format(os.getpid()))
+
+        # Replace the file at once, so readers never see half of it.
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        '''
+        Return the counters of every worker added up.
+        '''
+
+        if not settings.METRICS_DIR:
+            return self.snapshot()
+
+        self.write(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            # Drop the files of workers that exited, so restarted workers
+            # do not pile up. Their counters reset, like a restart does.
+            pid = int(os.path.basename(path).split('.')[0])
+            if not process_exists(pid):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # The worker went away, or the file is being replaced.
+                continue
+
+        return merge_snapshots(snapshots)
+
+
+def merge_snapshots(snapshots):
+    merged = {'views': {}, 'geoip': [0, 0.0]}
+    slow_keys = {}
+    missing_keys = collections.Counter()
+
+    for snapshot in snapshots:
+        for view, stats in snapshot['views'].items():
+            total = merged['views'].get(view)
+            if total is None:
+                merged['views'][view] = dict(stats, buckets=list(stats['buckets']))
+                continue
+            for name, value in stats.items():
+                if name == 'buckets':
+                    total[name] = [a + b for a, b in zip(total[name], value)]
+                else:
+                    total[name] += value
+
+        # A key slow in several workers is reported once, at its slowest.
+        for seconds, key in snapshot['slow_keys']:
+            slow_keys[key] = max(seconds, slow_keys.get(key, 0.0))
+        missing_keys.update(snapshot.get('missing_keys', {}))
+        merged['geoip'][0] += snapshot['geoip'][0]
+        merged['geoip'][1] += snapshot['geoip'][1]
+
+    merged['slow_keys'] = heapq.nlargest(
+        settings.METRICS_SLOW_KEYS,
+        ((seconds, key) for key, seconds in slow_keys.items())
+    )
+    merged['missing_keys'] = dict(
+        missing_keys.most_common(settings.METRICS_MISSING_KEY_CLIENTS)
+    )
+    return merged
+
+
+def escape_label(value):
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def render_prometheus(snapshot):
+    '''
+    Render counters in the Prometheus text exposition format.
+    '''
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for suffix, labels, value in samples:
+            label_text = ','.join(
+                '{}="{}"'.format(label, escape_label(label_value))
+                for label, label_value in labels
+            )
+            lines.append('{}{}{} {}'.format(
+                name, suffix, '{' + label_text + '}' if label_text else '', value
+            ))
+
+    views = sorted(snapshot['views'].items())
+
+    metric(
+        'http_requests_total', 'counter', 'Requests per URL name.',
+        [('', [('view', view)], stats['requests']) for view, stats in views]
+    )
+
+    samples = []
+    for view, stats in views:
+        count = 0
+        for bound, bucket in zip(BUCKETS + ('+Inf',), stats['buckets']):
+            count += bucket
+            samples.append(('_bucket', [('view', view), ('le', bound)], count))
+        samples.append(('_sum', [('view', view)], stats['seconds']))
+        samples.append(('_count', [('view', view)], stats['requests']))
+    metric(
+        'http_request_duration_seconds', 'histogram',
+        'Request latency per URL name.', samples
+    )
+
+    metric(
+        'http_db_queries_total', 'counter', 'Database queries per URL name.',
+        [('', [('view', view)], stats['queries']) for view, stats in views]
+    )
+    for name, help_text in (
+            ('db', 'Time spent in database queries'),
+            ('template', 'Time spent rendering templates'),
+            ('geoip', 'Time spent in GeoIP lookups')):
+        metric(
+            'http_{}_seconds_total'.format(name), 'counter',
+            '{} per URL name.'.format(help_text),
+            [
+                ('', [('view', view)], stats['{}_seconds'.format(name)])
+                for view, stats in views
+            ]
+        )
+
+    metric(
+        'geoip_lookups_total', 'counter', 'GeoIP database lookups.',
+        [('', [], snapshot['geoip'][0])]
+    )
+    metric(
+        'geoip_lookup_seconds_total', 'counter', 'Time spent in GeoIP lookups.',
+        [('', [], snapshot['geoip'][1])]
+    )
+    metric(
+        'redirect_slow_key_seconds', 'gauge',
+        'Slowest redirects by key since the workers started.',
+        [('', [('key', key)], seconds) for seconds, key in snapshot['slow_keys']]
+    )
+    metric(
+        'redirect_missing_key_requests', 'gauge',
+        'Redirects to unknown keys by the busiest client addresses.',
+        [
+            ('', [('client', client)], count)
+            for client, count in sorted(snapshot['missing_keys'].items())
+        ]
+    )
+
+    return '\n'.join(lines) + '\n'
+
+
+class TimedTemplate(object):
+    '''
+    A template that adds its render time to the current request.
+    '''
+
+    def __init__(self, template):
+        self.template = template
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.add_time('template', time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    '''
+    The Django template backend, with timed templates.
+    '''
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class TimedCursorMixin(object):
+    '''
+    Add the time of every query to the request metrics.
+    '''
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            metrics.add_query(time.perf_counter() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, param_list)
+        finally:
+            metrics.add_query(time.perf_counter() - start)
+
+
+class TimedCursorWrapper(TimedCursorMixin, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(TimedCursorMixin, CursorDebugWrapper):
+    pass
+
+
+class MetricsMiddleware(object):
+    '''
+    Count requests per URL name, with their latency, their database
+    queries and the time spent in templates and GeoIP lookups.
+
+    Queries are timed by the cursors of the database backend, so
+    query logging stays off.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics.start()
+        start = time.perf_counter()
+        response = None
+        try:
+            response = self.get_response(request)
+        finally:
+            seconds = time.perf_counter() - start
+            queries = metrics.request_queries()
+
+            match = request.resolver_match
+            view = match.view_name if match else 'unresolved'
+            key = None
+            if match and match.url_name == 'redirect-to-link':
+                key = match.kwargs.get('key')
+
+            metrics.finish(view, seconds, queries, key)
+
+            # Count probes for unknown keys per client, to spot scanners.
+            missing = response is not None and response.status_code == 404
+            if key is not None and missing:
+                metrics.count_missing_key(get_ip(request) or 'unknown')
+            metrics.write()
+
+        return response
+
+
+@staff_member_required
+def metrics_view(request):
+    return HttpResponse(
+        render_prometheus(metrics.collect()),
+        content_type='text/plain; version=0.0.4'
+    )
+
+
+metrics = Metrics()
@@ -1,5 +1,42 @@
+import os
+
 from config.settings import *
 
 DEBUG = False
 
 ALLOWED_HOSTS = ['*']
+
+CLICK_PIPELINE_ASYNC = True
+
+CLICK_LOG_ENABLED = True
+
+KEY_FILTER_ASYNC = True
+
+SEARCH_INDEX_ASYNC = True
+
+# Add up the metrics of all gunicorn workers.
+METRICS_DIR = os.path.join(ROOT_DIR, 'metrics')
+
+# Caches shared by all gunicorn workers. Rate limit buckets are many
+# small entries, so that cache is large and only culled now and then.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(ROOT_DIR, 'cache'),
+    },
+    'ratelimit': {
+        'BACKEND': 'config.caches.LazyCullFileBasedCache',
+        'LOCATION': os.path.join(ROOT_DIR, 'ratelimit'),
+        'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_INTERVAL': 1000},
+    },
+}
+
+# Compile each template once per process. The warm-up loads the busiest
+# ones before gunicorn forks the workers.
+TEMPLATES[0]['APP_DIRS'] = False
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
@@ -0,0 +1,77 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+from ipware.ip import get_ip
+
+
+def take_token(bucket, capacity, period, now=None):
+    '''
+    Take a token from a bucket that holds `capacity` tokens and refills
+    them evenly over `period` seconds. Return 0 if a token was taken,
+    or the seconds until one is available.
+
+    Buckets are kept in the RATE_LIMIT_CACHE_ALIAS cache, shared by all
+    workers. The check is one get and one set. Two workers may both take
+    the last token, so a burst can pass a few requests over the limit.
+    '''
+
+    cache = caches[settings.RATE_LIMIT_CACHE_ALIAS]
+    now = time.time() if now is None else now
+    rate = capacity / period
+
+    tokens, updated_at = cache.get(bucket) or (capacity, now)
+    tokens = min(capacity, tokens + (now - updated_at) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+
+    # A bucket left alone for a whole period is full again,
+    # which is what a missing bucket means.
+    cache.set(bucket, (tokens - 1, now), math.ceil(period))
+    return 0
+
+
+REJECTED = 'Too many requests, please try again later.'
+
+
+def rate_limited(name, methods=('POST',), as_json=False):
+    '''
+    Limit requests to a view with the RATE_LIMITS[name] token bucket,
+    per user when logged in and per client address otherwise.
+
+    Requests over the limit get a 429 with a Retry-After header, and
+    with the error as a form error if as_json is set.
+    '''
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            limit = settings.RATE_LIMITS.get(name)
+            if limit is not None and request.method in methods:
+                if request.user.is_authenticated:
+                    client = 'user:{}'.format(request.user.pk)
+                else:
+                    client = 'ip:{}'.format(get_ip(request) or 'unknown')
+
+                wait = take_token(
+                    'ratelimit:{}:{}'.format(name, client), *limit
+                )
+                if wait:
+                    if as_json:
+                        response = JsonResponse(
+                            {'__all__': [REJECTED]}, status=429
+                        )
+                    else:
+                        response = HttpResponse(
+                            REJECTED, content_type='text/plain', status=429
+                        )
+                    response['Retry-After'] = str(math.ceil(wait))
+                    return response
+
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
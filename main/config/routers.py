@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+class AnalyticsRouter(object):
+    '''
+    Keep the models of the analytics app in ANALYTICS_DATABASE,
+    and everything else out of it.
+
+    Analytics rows point at Links in the other database, so their
+    foreign keys to Link have no constraint and no cascade, and
+    queries must not join across the two.
+
+    The analytics tables of the databases in LEGACY_ANALYTICS_DATABASES
+    are migrated along with them, so that copy_analytics_database can
+    read them with the current models.
+    '''
+
+    app_label = 'analytics'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return settings.ANALYTICS_DATABASE
+        # Not the database of a hinted instance, which may be an
+        # analytics row pointing at its Link.
+        return DEFAULT_DB_ALIAS
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if self.app_label in (obj1._meta.app_label, obj2._meta.app_label):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == self.app_label:
+            return (
+                db == settings.ANALYTICS_DATABASE or
+                db in settings.LEGACY_ANALYTICS_DATABASES
+            )
+        if db == settings.ANALYTICS_DATABASE:
+            return False
+        return None
@@ -37,8 +37,98 @@ HASH_ALPHABET = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890'
 
 HASH_LENGTH = 5
 
+# Number of keys each worker reserves at a time.
+KEY_BLOCK_SIZE = 1000
+
+# Bloom filter of taken keys. False positive rate, and the
+# smallest number of keys the filter is sized for.
+KEY_FILTER_ERROR_RATE = 0.01
+
+KEY_FILTER_MIN_CAPACITY = 100000
+
+# Seconds between picking up keys created by other workers,
+# and between full rebuilds that drop deleted keys.
+KEY_FILTER_REFRESH_INTERVAL = 1
+
+KEY_FILTER_REBUILD_INTERVAL = 3600
+
+# Build the key filter in a background thread, checking keys in the
+# Database until the first build is done.
+KEY_FILTER_ASYNC = False
+
 TAG_LIMIT = 8
 
+# Seconds the tag counts of a user are cached for.
+TAG_COUNTS_TTL = 3600
+
+# Maximum number of links in one bulk shorten request.
+BULK_SHORTEN_LIMIT = 10000
+
+# Maximum size in bytes of a bulk shorten request body. The bulk view
+# reads it past DATA_UPLOAD_MAX_MEMORY_SIZE, which is sized for forms.
+BULK_SHORTEN_MAX_BODY_SIZE = 10 * 1024 * 1024
+
+# Number of links per dashboard page.
+DASHBOARD_PAGE_SIZE = 50
+
+# Search links with the SQLite FTS5 table when it exists ('auto'),
+# or always with an in-process inverted index ('memory').
+SEARCH_BACKEND = 'auto'
+
+# Seconds between picking up links created by other workers, and
+# between full rebuilds of the in-process index.
+SEARCH_INDEX_REFRESH_INTERVAL = 1
+
+SEARCH_INDEX_REBUILD_INTERVAL = 3600
+
+# Build the in-process index in a background thread, searching
+# the Database with LIKE until the first build is done.
+SEARCH_INDEX_ASYNC = False
+
+
+# Link Cache
+
+# Number of keys each worker keeps, and how long (seconds) an entry lives.
+LINK_CACHE_SIZE = 10000
+
+LINK_CACHE_TTL = 300
+
+# Number of unknown keys each worker remembers, and for how long (seconds).
+LINK_MISSING_CACHE_SIZE = 10000
+
+LINK_MISSING_CACHE_TTL = 30
+
+# Workers notice invalidations from other workers within N seconds.
+LINK_CACHE_SYNC_INTERVAL = 5
+
+# The shared cache holding the tag counts of users.
+LINK_CACHE_ALIAS = 'default'
+
+# Number of most clicked keys loaded before gunicorn forks workers.
+WARMUP_HOT_KEYS = 1000
+
+
+# Redirect Settings
+
+# Build redirect responses without the template engine.
+REDIRECT_FAST_PATH = True
+
+
+# Rate Limits
+
+# Token buckets per user, or per client address for anonymous requests,
+# as (requests, seconds): up to `requests` at once, refilled over `seconds`.
+RATE_LIMITS = {
+    'shorten': (30, 60),
+    'signup': (5, 300),
+}
+
+# The cache holding the buckets, one entry per client. It is kept apart
+# from the Link cache, so new clients never evict the tag counts.
+# It must be shared by all workers to limit clients across them; the local
+# memory cache limits per worker.
+RATE_LIMIT_CACHE_ALIAS = 'ratelimit'
+
 
 # Cache Control Headers
 
@@ -47,6 +137,44 @@ CC_MAX_AGE = 30
 CC_PRIVATE = True
 
 
+# Click Pipeline
+
+# Apply click events from a background thread instead of in the request.
+CLICK_PIPELINE_ASYNC = False
+
+# Maximum number of click events waiting to be applied.
+CLICK_QUEUE_SIZE = 10000
+
+# Apply waiting click events every N milliseconds, or every M events.
+CLICK_FLUSH_INTERVAL = 500
+
+CLICK_FLUSH_SIZE = 500
+
+# Count unique clicks exactly, one IPAddress row per address ('exact'),
+# or approximately, with HyperLogLog sketches ('hll').
+UNIQUE_CLICKS_MODE = 'exact'
+
+# In 'hll' mode, also keep one sketch per Link per day.
+UNIQUE_CLICKS_DAILY_SKETCHES = False
+
+# Number of referer urls, and of referer host ids, each worker keeps.
+REFERER_CACHE_SIZE = 50000
+
+# Keep hourly click rollups for N hours before they are folded into days.
+CLICK_ROLLUP_HOURLY_RETENTION = 48
+
+
+# Click Log
+
+# Append every applied click to binary segment files in CLICK_LOG_DIR.
+CLICK_LOG_ENABLED = False
+
+CLICK_LOG_DIR = os.path.join(ROOT_DIR, 'click_log')
+
+# Start a new segment once the current one reaches N bytes.
+CLICK_LOG_SEGMENT_SIZE = 64 * 1024 * 1024
+
+
 # Request Log directory
 
 REQUEST_LOG_DIR = 'request_logs'
@@ -56,6 +184,26 @@ REQUEST_LOG_DIR = 'request_logs'
 
 GEOIP_PATH = os.path.join(ROOT_DIR, 'geo_ip')
 
+# Number of ip address lookups each worker keeps.
+GEOIP_CACHE_SIZE = 50000
+
+
+# Metrics
+
+# Directory where each worker writes its request metrics, so the
+# metrics endpoint can add them up. None keeps them per process.
+METRICS_DIR = None
+
+# Write a worker's metrics at most every N seconds.
+METRICS_FLUSH_INTERVAL = 10
+
+# Number of slowest redirect keys each worker reports.
+METRICS_SLOW_KEYS = 20
+
+# Number of client addresses with the most redirects to unknown keys
+# each worker reports.
+METRICS_MISSING_KEY_CLIENTS = 50
+
 
 # Application definition
 
@@ -102,6 +250,7 @@ LOGIN_REDIRECT_URL = 'index'
 LOGOUT_REDIRECT_URL = 'index'
 
 MIDDLEWARE = [
+    'config.metrics.MetricsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -116,7 +265,7 @@ ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'config.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -138,9 +287,61 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'config.sqlite_backend',
         'NAME': os.path.join(ROOT_DIR, 'db.sqlite3'),
-    }
+        # Keep connections open between requests, for a minute.
+        'CONN_MAX_AGE': 60,
+    },
+    'analytics': {
+        'ENGINE': 'config.sqlite_backend',
+        'NAME': os.path.join(ROOT_DIR, 'analytics.sqlite3'),
+        'CONN_MAX_AGE': 60,
+    },
+}
+
+# Click writes go to their own database, so they do not hold up Link
+# reads. Migrate it with `manage.py migrate --database=analytics`.
+DATABASE_ROUTERS = ['config.routers.AnalyticsRouter']
+
+ANALYTICS_DATABASE = 'analytics'
+
+# Databases that held every app before the split. Their analytics tables
+# are migrated along with them, until copy_analytics_database copies the
+# rows over and drops them. Add 'default' here to upgrade a deployment.
+LEGACY_ANALYTICS_DATABASES = ()
+
+# Set on every new SQLite connection. WAL lets readers and a writer
+# work at the same time. Negative cache sizes are in KiB.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+}
+
+# Statements wait up to busy_timeout for the write lock. The click flusher
+# thread then retries a batch N times, waiting up to SQLITE_LOCK_BACKOFF
+# seconds, doubled after every attempt. Requests never retry, so they
+# fail well within the gunicorn timeout.
+SQLITE_LOCK_RETRIES = 5
+
+SQLITE_LOCK_BACKOFF = 0.01
+
+
+# Caches
+# https://docs.djangoproject.com/en/1.10/ref/settings/#caches
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ratelimit',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
 }
 
 
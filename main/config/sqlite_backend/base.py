@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+from config.metrics import TimedCursorDebugWrapper, TimedCursorWrapper
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    '''
+    The SQLite backend, with SQLITE_PRAGMAS set on every new
+    connection, and queries timed for the request metrics.
+
+    Statements wait for the write lock for up to the `busy_timeout`
+    pragma, then fail. They are not retried on top of that, so a
+    locked request fails well before gunicorn kills its worker.
+
+    Transactions take the write lock when they begin. A deferred
+    transaction that reads first fails without waiting when it tries
+    to write after another connection committed, so it could only be
+    retried as a whole.
+    '''
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
+
+    def make_cursor(self, cursor):
+        return TimedCursorWrapper(cursor, self)
+
+    def make_debug_cursor(self, cursor):
+        return TimedCursorDebugWrapper(cursor, self)
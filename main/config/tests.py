@@ -0,0 +1,346 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.urlresolvers import reverse
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+
+from config.caches import LazyCullFileBasedCache
+from config.metrics import merge_snapshots, metrics, render_prometheus
+from config.ratelimit import take_token
+from config.sqlite_backend.base import DatabaseWrapper
+from links.cache import link_cache
+from links.models import Link
+from users.models import User
+
+
+class MetricsTests(TestCase):
+    fixtures = ['users', 'links']
+    multi_db = True
+
+    def setUp(self):
+        metrics.reset()
+        link_cache.clear()
+        self.staff = User.objects.get(email='admin@email.com')
+
+    def test_requests_are_counted_per_view(self):
+        '''
+        Requests are counted per URL name, with their queries,
+        template time and the key of redirects.
+        '''
+
+        link = Link.objects.first()
+        self.client.get(reverse('redirect-to-link', args=[link.key]))
+        self.client.force_login(self.staff)
+        self.client.get(reverse('dashboard'))
+
+        snapshot = metrics.snapshot()
+        redirect = snapshot['views']['redirect-to-link']
+        self.assertEqual(redirect['requests'], 1)
+        self.assertEqual(sum(redirect['buckets']), 1)
+        self.assertGreater(redirect['queries'], 0)
+        self.assertEqual(redirect['template_seconds'], 0)
+
+        dashboard = snapshot['views']['dashboard']
+        self.assertGreater(dashboard['template_seconds'], 0)
+        self.assertGreater(dashboard['seconds'], dashboard['template_seconds'])
+
+        self.assertEqual(
+            [key for seconds, key in snapshot['slow_keys']], [link.key]
+        )
+
+    def test_missing_keys_are_counted_per_client(self):
+        '''
+        Redirects to unknown keys are counted per client address.
+        '''
+
+        url = reverse('redirect-to-link', args=['not-a-key'])
+        for i in range(3):
+            self.client.get(url, REMOTE_ADDR='203.0.113.9')
+        self.client.get(url, REMOTE_ADDR='203.0.113.10')
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(
+            snapshot['missing_keys'], {'203.0.113.9': 3, '203.0.113.10': 1}
+        )
+        self.assertIn(
+            'redirect_missing_key_requests{client="203.0.113.9"} 3',
+            render_prometheus(snapshot)
+        )
+
+    def test_metrics_endpoint_is_staff_only(self):
+        '''
+        The metrics endpoint serves the Prometheus text format to staff.
+        '''
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+
+        # The rejected request was counted before this one.
+        self.assertIn(
+            'http_request_duration_seconds_bucket{view="metrics",le="+Inf"} 1',
+            response.content.decode()
+        )
+
+    def test_worker_metrics_are_added_up(self):
+        '''
+        Counters written by other workers are added to this one's.
+        '''
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        metrics.finish('index', 0.02, queries=2)
+        other = metrics.snapshot()
+        other['slow_keys'] = [[3.0, 'slow"key']]
+        with open(os.path.join(directory, '1.json'), 'w') as f:
+            json.dump(other, f)
+
+        with self.settings(METRICS_DIR=directory):
+            snapshot = metrics.collect()
+
+        self.assertEqual(snapshot['views']['index']['requests'], 2)
+        self.assertEqual(snapshot['views']['index']['queries'], 4)
+        self.assertEqual(snapshot['slow_keys'], [(3.0, 'slow"key')])
+
+        text = render_prometheus(snapshot)
+        self.assertIn('http_requests_total{view="index"} 2', text)
+        self.assertIn('redirect_slow_key_seconds{key="slow\\"key"} 3.0', text)
+        self.assertEqual(merge_snapshots([])['views'], {})
+
+    def test_slow_keys_are_reported_once(self):
+        '''
+        A key slow in several requests and workers is
+        reported once, with its slowest time.
+        '''
+
+        metrics.finish('redirect-to-link', 1.0, key='slow')
+        metrics.finish('redirect-to-link', 2.0, key='slow')
+        metrics.finish('redirect-to-link', 0.5, key='slow')
+        self.assertEqual(metrics.snapshot()['slow_keys'], [(2.0, 'slow')])
+
+        other = {'views': {}, 'slow_keys': [[4.0, 'slow']], 'geoip': [0, 0.0]}
+        snapshot = merge_snapshots([metrics.snapshot(), other])
+        self.assertEqual(snapshot['slow_keys'], [(4.0, 'slow')])
+        self.assertEqual(
+            render_prometheus(snapshot).count('redirect_slow_key_seconds{'), 1
+        )
+
+    @override_settings(METRICS_SLOW_KEYS=2)
+    def test_slow_keys_are_bounded(self):
+        '''
+        Only the METRICS_SLOW_KEYS slowest keys are kept.
+        '''
+
+        for seconds, key in ((1.0, 'a'), (3.0, 'b'), (2.0, 'c')):
+            metrics.finish('redirect-to-link', seconds, key=key)
+        self.assertEqual(
+            metrics.snapshot()['slow_keys'], [(3.0, 'b'), (2.0, 'c')]
+        )
+
+    def test_exited_worker_metrics_are_removed(self):
+        '''
+        The files of workers that exited are removed when collecting.
+        '''
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        process = subprocess.Popen(['true'])
+        process.wait()
+        path = os.path.join(directory, '{}.json'.format(process.pid))
+        with open(path, 'w') as f:
+            json.dump(metrics.snapshot(), f)
+
+        with self.settings(METRICS_DIR=directory):
+            metrics.collect()
+
+        self.assertFalse(os.path.exists(path))
+
+    def test_queries_are_timed_without_logging(self):
+        '''
+        Queries are counted without turning on query logging.
+        '''
+
+        link = Link.objects.first()
+        self.client.get(reverse('redirect-to-link', args=[link.key]))
+
+        self.assertFalse(connection.queries_logged)
+        self.assertFalse(connection.queries)
+        redirect = metrics.snapshot()['views']['redirect-to-link']
+        self.assertGreater(redirect['queries'], 0)
+        self.assertGreater(redirect['db_seconds'], 0)
+
+
+class SQLiteBackendTests(TestCase):
+    def test_pragmas_are_set(self):
+        '''
+        New connections get the pragmas from SQLITE_PRAGMAS.
+        '''
+
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def connect(self):
+        '''
+        Return a DatabaseWrapper and a plain sqlite3 connection
+        to a new database file with a `clicks` table.
+        '''
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'db.sqlite3')
+
+        wrapper = DatabaseWrapper(
+            dict(connection.settings_dict, NAME=path), alias='locked'
+        )
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('CREATE TABLE clicks (id integer)')
+
+        other = sqlite3.connect(
+            path, timeout=0, isolation_level=None, check_same_thread=False
+        )
+        self.addCleanup(other.close)
+        return wrapper, other
+
+    def test_transactions_take_the_write_lock(self):
+        '''
+        Transactions hold the write lock from the start, so they never
+        read a snapshot another connection writes over before they do.
+        '''
+
+        pragmas = {'journal_mode': 'WAL', 'busy_timeout': 0}
+        with self.settings(SQLITE_PRAGMAS=pragmas):
+            wrapper, other = self.connect()
+
+            wrapper.set_autocommit(
+                False, force_begin_transaction_with_broken_autocommit=True
+            )
+            with self.assertRaises(sqlite3.OperationalError):
+                other.execute('BEGIN IMMEDIATE')
+
+            wrapper.commit()
+            wrapper.set_autocommit(True)
+            other.execute('BEGIN IMMEDIATE')
+            other.execute('COMMIT')
+
+    def test_locked_statements_wait_for_the_busy_timeout(self):
+        '''
+        Statements wait for the busy timeout while another connection
+        holds the lock, then fail without being retried.
+        '''
+
+        pragmas = {'journal_mode': 'WAL', 'busy_timeout': 1000}
+        with self.settings(SQLITE_PRAGMAS=pragmas):
+            wrapper, other = self.connect()
+            other.execute('BEGIN EXCLUSIVE')
+            threading.Timer(0.05, other.execute, ['COMMIT']).start()
+
+            with wrapper.cursor() as cursor:
+                cursor.execute('INSERT INTO clicks VALUES (1)')
+                cursor.execute('SELECT count(*) FROM clicks')
+                self.assertEqual(cursor.fetchone()[0], 1)
+
+            other.execute('BEGIN EXCLUSIVE')
+            started = time.monotonic()
+            with self.assertRaises(OperationalError), wrapper.cursor() as cursor:
+                cursor.execute('INSERT INTO clicks VALUES (2)')
+            self.assertLess(time.monotonic() - started, 2)
+            other.execute('COMMIT')
+
+
+@override_settings(RATE_LIMITS={'shorten': (2, 60), 'signup': (1, 300)})
+class RateLimitTests(TestCase):
+    fixtures = ['users']
+
+    def setUp(self):
+        caches[settings.RATE_LIMIT_CACHE_ALIAS].clear()
+
+    def test_token_bucket_refills(self):
+        '''
+        A bucket allows a burst of `capacity` requests,
+        then one request per refilled token.
+        '''
+
+        self.assertEqual(take_token('bucket', 2, 60, now=0), 0)
+        self.assertEqual(take_token('bucket', 2, 60, now=0), 0)
+        self.assertEqual(take_token('bucket', 2, 60, now=0), 30)
+        self.assertAlmostEqual(take_token('bucket', 2, 60, now=10), 20)
+        self.assertEqual(take_token('bucket', 2, 60, now=30), 0)
+
+    def test_shorten_is_limited_per_client(self):
+        '''
+        Clients over the limit get a 429 with Retry-After,
+        while other clients and users are not affected.
+        '''
+
+        url = reverse('shorten-link')
+        data = {'destination': 'http://google.com/'}
+
+        for i in range(2):
+            response = self.client.post(url, data, REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(url, data, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(int(response['Retry-After']), 30)
+        self.assertIn('__all__', response.json())
+
+        response = self.client.post(url, data, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_login(User.objects.get(email='user@email.com'))
+        response = self.client.post(url, data, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_signup_posts_are_limited(self):
+        '''
+        Only signup attempts count against the limit.
+        '''
+
+        url = reverse('signup')
+        self.client.post(url, {'email': 'new@email.com'})
+
+        response = self.client.post(url, {'email': 'new@email.com'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_buckets_cache_culls_lazily(self):
+        '''
+        The file based buckets cache only culls every CULL_INTERVAL sets.
+        '''
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        buckets = LazyCullFileBasedCache(directory, {'OPTIONS': {
+            'MAX_ENTRIES': 2,
+            'CULL_FREQUENCY': 1,
+            'CULL_INTERVAL': 4,
+        }})
+
+        for i in range(3):
+            buckets.set('bucket-{}'.format(i), i)
+        self.assertEqual(len(os.listdir(directory)), 3)
+
+        # The fourth set culls the three entries, then adds its own.
+        buckets.set('bucket-3', 3)
+        self.assertEqual(len(os.listdir(directory)), 1)
+        self.assertEqual(buckets.get('bucket-3'), 3)
@@ -17,9 +17,13 @@ from django.conf.urls import url, include
 from django.conf import settings
 from django.contrib import admin
 
+from config.metrics import metrics_view
+
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
+    url(r'^metrics/$', metrics_view, name='metrics'),
     url(r'', include('users.urls')),
+    url(r'', include('analytics.urls')),
     url(r'', include('links.urls')),
 ]
 
@@ -1,6 +1,7 @@
 import collections
 import datetime
 import json
+import os
 from os.path import join
 
 from django.conf import settings
@@ -29,3 +30,18 @@ def serialize_request(data):
         else:
             request_data[key] = value
     return request_data
+
+
+def process_exists(pid):
+    '''
+    Return True if a process with this pid is running.
+    '''
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists, but belongs to another user.
+        return True
+    return True
@@ -0,0 +1,70 @@
+import gc
+import logging
+
+from django.conf import settings
+from django.db import connections
+from django.template.loader import get_template
+from django.core.urlresolvers import get_resolver
+
+from analytics.geoip import geoip_service
+from links.bloom import key_filter
+from links.cache import link_cache
+from links.search import fts5_available, search_index
+
+logger = logging.getLogger(__name__)
+
+
+# Templates rendered on the busiest pages. The cached template loader of
+# production keeps them compiled.
+TEMPLATES = (
+    'links/index.html',
+    'links/dashboard.html',
+    'links/redirect.html',
+)
+
+
+def load_urls(resolver):
+    '''
+    Compile every URL pattern and import every view.
+    '''
+
+    for pattern in resolver.url_patterns:
+        # Both properties are computed once, then cached.
+        pattern.regex
+        if hasattr(pattern, 'url_patterns'):
+            load_urls(pattern)
+        else:
+            pattern.callback
+
+
+def warm_up():
+    '''
+    Load the state every worker needs before gunicorn forks them,
+    so it is shared copy-on-write instead of built once per worker.
+    '''
+
+    geoip_service.open()
+
+    resolver = get_resolver()
+    load_urls(resolver)
+    resolver.reverse_dict  # Populates the reverse lookups.
+
+    for template in TEMPLATES:
+        get_template(template)
+
+    key_filter.build()
+    if not fts5_available():
+        search_index.build()
+    loaded = link_cache.preload(settings.WARMUP_HOT_KEYS)
+
+    # Connections must not be shared with the workers.
+    for connection in connections.all():
+        connection.close()
+
+    # Keep the loaded objects out of later collections, which would
+    # touch their pages and copy them into every worker.
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    logger.info('Warmed up with %d hot keys.', loaded)
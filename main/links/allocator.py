@@ -0,0 +1,144 @@
+import collections
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .bloom import key_filter
+from .models import KeyCounter, Link
+
+
+class KeySpaceExhausted(Exception):
+    pass
+
+
+def scramble(number, space):
+    '''
+    Map a number in range(space) to another one, one to one.
+
+    A small Feistel network permutes the smallest even number of bits
+    that covers the space. Results outside the space are permuted again
+    until they land inside it, which keeps the mapping one to one.
+    '''
+
+    half = (space.bit_length() + 1) // 2
+    mask = (1 << half) - 1
+
+    while True:
+        left, right = number >> half, number & mask
+        for key in (0x5bd1e995, 0x1b873593, 0xcc9e2d51, 0xe6546b64):
+            mixed = (right * key + (right >> 3)) & mask
+            left, right = right, left ^ mixed
+        number = (left << half) | right
+        if number < space:
+            return number
+
+
+def encode_key(number, alphabet, length):
+    '''
+    Encode a number as a fixed length key.
+
+    Numbers are first scrambled, so consecutive
+    numbers do not give similar keys.
+    '''
+
+    base = len(alphabet)
+    number = scramble(number, base ** length)
+
+    digits = []
+    for i in range(length):
+        number, digit = divmod(number, base)
+        digits.append(alphabet[digit])
+    return ''.join(reversed(digits))
+
+
+class KeyAllocator(object):
+    '''
+    Hands out Link keys from blocks of numbers reserved in the
+    KeyCounter table, KEY_BLOCK_SIZE numbers at a time.
+
+    A block costs one counter update and one query to drop keys that
+    are reserved words or already taken by custom keys, so the cost
+    per key does not grow with the number of Links.
+    '''
+
+    counter_name = 'links'
+
+    def __init__(self):
+        self._keys = collections.deque()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def allocate(self, count=1):
+        '''
+        Return a list of `count` unused keys.
+        '''
+
+        with self._lock:
+            # Blocks reserved before a fork belong to the parent process.
+            if self._pid != os.getpid():
+                self._keys.clear()
+                self._pid = os.getpid()
+
+            while len(self._keys) < count:
+                self._keys.extend(self._reserve_block(
+                    max(settings.KEY_BLOCK_SIZE, count - len(self._keys))
+                ))
+
+            return [self._keys.popleft() for i in range(count)]
+
+    def next_key(self):
+        return self.allocate(1)[0]
+
+    def _reserve_block(self, size):
+        '''
+        Reserve `size` numbers from the counter and return their
+        keys, without reserved words and taken keys.
+        '''
+
+        alphabet = settings.HASH_ALPHABET
+        length = settings.HASH_LENGTH
+
+        with transaction.atomic():
+            KeyCounter.objects.get_or_create(name=self.counter_name)
+            KeyCounter.objects.filter(name=self.counter_name).update(
+                value=F('value') + size
+            )
+            end = KeyCounter.objects.values_list('value', flat=True).get(
+                name=self.counter_name
+            )
+
+        start = end - size
+        if end > len(alphabet) ** length:
+            raise KeySpaceExhausted(
+                'All {}-character keys have been allocated.'.format(length)
+            )
+
+        keys = [encode_key(n, alphabet, length) for n in range(start, end)]
+        unavailable = taken_keys(keys)
+        unavailable.update(getattr(settings, 'blacklist', []))
+        return [key for key in keys if key not in unavailable]
+
+
+def taken_keys(keys, chunk_size=500, exact=False):
+    '''
+    Return the set of keys that are used by a Link.
+    Only keys that the key filter cannot rule out are queried, unless
+    `exact` is set: the filter may not know about keys other workers
+    have just taken.
+    '''
+
+    keys = [key for key in keys if exact or key_filter.might_exist(key)]
+    taken = set()
+    for i in range(0, len(keys), chunk_size):
+        taken.update(
+            Link.objects
+            .filter(key__in=keys[i:i + chunk_size])
+            .values_list('key', flat=True)
+        )
+    return taken
+
+
+key_allocator = KeyAllocator()
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class LinksConfig(AppConfig):
     name = 'links'
+
+    def ready(self):
+        from . import signals  # noqa
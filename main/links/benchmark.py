@@ -0,0 +1,241 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.shortcuts import reverse
+from django.test import Client
+from django.utils import timezone
+
+from analytics.models import (
+    Country,
+    IPAddress,
+    Referer,
+    RefererHost,
+    Region
+)
+from users.models import User
+
+from .allocator import key_allocator
+from .models import Link
+from .utils import reconcile_click_counts
+
+
+BENCHMARK_EMAIL = 'benchmark@example.com'
+BENCHMARK_PASSWORD = 'benchmark'
+
+# Settings that change what a request does, reported with the results.
+REPORTED_SETTINGS = (
+    'CLICK_PIPELINE_ASYNC',
+    'CLICK_LOG_ENABLED',
+    'UNIQUE_CLICKS_MODE',
+    'SEARCH_BACKEND',
+    'SEARCH_INDEX_ASYNC',
+    'DEBUG',
+)
+
+
+def seed_database(links, clicks, user_links=1000, seed=0, batch_size=5000):
+    '''
+    Create `links` Links, `user_links` of them owned by a benchmark
+    user, and about `clicks` Region, Referer and IPAddress rows spread
+    over them. The same seed gives the same data.
+    Return the benchmark user.
+    '''
+
+    rng = random.Random(seed)
+    now = timezone.now()
+
+    user = User.objects.create_user(BENCHMARK_EMAIL, BENCHMARK_PASSWORD)
+
+    keys = key_allocator.allocate(links)
+    for i in range(0, links, batch_size):
+        Link.objects.bulk_create(
+            Link(
+                key=key,
+                destination='http://example{}.com/{}'.format(n % 97, n),
+                title='Link - {}'.format(key),
+                user=user if n < user_links else None,
+                modified_on=now,
+            )
+            for n, key in enumerate(keys[i:i + batch_size], i)
+        )
+
+    link_ids = list(Link.objects.values_list('pk', flat=True))
+    countries = [
+        Country.objects.create(name='Country {}'.format(i), code='C{}'.format(i))
+        for i in range(20)
+    ]
+    hosts = [
+        RefererHost.objects.create(name='referer{}.com'.format(i))
+        for i in range(50)
+    ]
+
+    # Draw clicks at random, and count them per row.
+    regions = {}
+    referers = {}
+    addresses = set()
+    for i in range(clicks):
+        link_id = rng.choice(link_ids)
+        region = (link_id, rng.choice(countries).pk)
+        referer = (link_id, rng.choice(hosts).pk)
+        regions[region] = regions.get(region, 0) + 1
+        referers[referer] = referers.get(referer, 0) + 1
+        addresses.add((link_id, '10.{}.{}.{}'.format(
+            rng.randrange(256), rng.randrange(256), rng.randrange(256)
+        )))
+
+    Region.objects.bulk_create(
+        (
+            Region(
+                link_id=link_id,
+                country_id=country_id,
+                total_clicks=count,
+                last_visited=now
+            )
+            for (link_id, country_id), count in regions.items()
+        )
+    )
+    Referer.objects.bulk_create(
+        (
+            Referer(
+                link_id=link_id,
+                host_id=host_id,
+                total_clicks=count,
+                last_visited=now
+            )
+            for (link_id, host_id), count in referers.items()
+        )
+    )
+    IPAddress.objects.bulk_create(
+        (
+            IPAddress(link_id=link_id, address=address)
+            for link_id, address in addresses
+        )
+    )
+    reconcile_click_counts()
+
+    return user
+
+
+def describe_environment():
+    '''
+    Return the middleware, the Databases with their engine, file and
+    pragmas, the caches and the settings the benchmarks ran with.
+    '''
+
+    databases = {}
+    for connection in connections.all():
+        pragmas = {}
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                for name in sorted(settings.SQLITE_PRAGMAS):
+                    # Some pragmas return no row for in-memory Databases.
+                    cursor.execute('PRAGMA {}'.format(name))
+                    row = cursor.fetchone()
+                    pragmas[name] = row[0] if row else None
+        databases[connection.alias] = {
+            'engine': connection.settings_dict['ENGINE'],
+            'name': connection.settings_dict['NAME'],
+            'pragmas': pragmas,
+        }
+
+    return {
+        'middleware': list(settings.MIDDLEWARE),
+        'databases': databases,
+        'caches': {
+            alias: cache['BACKEND'] for alias, cache in settings.CACHES.items()
+        },
+        'settings': {
+            name: getattr(settings, name, None) for name in REPORTED_SETTINGS
+        },
+    }
+
+
+def summarize(timings, elapsed):
+    '''
+    Return the request count, throughput and latency
+    percentiles in milliseconds of a list of timings.
+    '''
+
+    timings = sorted(timings)
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p / 100))]
+
+    return {
+        'requests': len(timings),
+        'throughput': len(timings) / elapsed if elapsed else None,
+        'mean_ms': statistics.mean(timings),
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'max_ms': timings[-1],
+    }
+
+
+def measure(func, args, expected_status):
+    '''
+    Call func with each of args. Every call must return a
+    response with expected_status.
+    '''
+
+    timings = []
+    started = time.perf_counter()
+    for arg in args:
+        start = time.perf_counter()
+        response = func(arg)
+        timings.append((time.perf_counter() - start) * 1000)
+
+        if response.status_code != expected_status:
+            raise AssertionError('Expected status {}, got {}.'.format(
+                expected_status, response.status_code
+            ))
+
+    return summarize(timings, time.perf_counter() - started)
+
+
+def run_benchmarks(user, requests=1000, seed=0):
+    '''
+    Measure the redirect, shorten and dashboard views
+    through the full request stack.
+    '''
+
+    rng = random.Random(seed)
+    keys = list(Link.objects.values_list('key', flat=True))
+    client = Client()
+
+    redirect = measure(
+        lambda key: client.get(
+            '/{}/'.format(key),
+            HTTP_REFERER='http://referer{}.com/'.format(rng.randrange(50)),
+            REMOTE_ADDR='10.0.{}.{}'.format(rng.randrange(256), rng.randrange(256))
+        ),
+        [rng.choice(keys) for i in range(requests)],
+        301
+    )
+
+    shorten = measure(
+        lambda n: client.post(
+            reverse('shorten-link'),
+            {'destination': 'http://shortened.com/{}'.format(n)},
+            # One client per request, to stay within the rate limit.
+            REMOTE_ADDR='10.1.{}.{}'.format(n // 256 % 256, n % 256)
+        ),
+        range(max(requests // 10, 1)),
+        200
+    )
+
+    client.force_login(user)
+    dashboard = measure(
+        lambda n: client.get(reverse('dashboard')),
+        range(max(requests // 10, 1)),
+        200
+    )
+
+    return {
+        'redirect_to_link': redirect,
+        'shorten_link': shorten,
+        'dashboard': dashboard,
+    }
@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Link
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter(object):
+    '''
+    Set membership with false positives but no false negatives.
+    '''
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        ))
+        self.hash_count = max(
+            1, int(round(self.size / capacity * math.log(2)))
+        )
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+
+class KeyFilter(object):
+    '''
+    Bloom filter over the keys of all Links.
+
+    A key that is not in the filter is not taken, so only possible hits
+    need a Database query. The filter is built on first use, picks up
+    Links created by other workers every KEY_FILTER_REFRESH_INTERVAL
+    seconds, and is rebuilt every KEY_FILTER_REBUILD_INTERVAL seconds to
+    forget deleted keys and to grow with the table.
+
+    With KEY_FILTER_ASYNC on, builds run in a background thread, so no
+    request reads the whole table. The previous filter answers in the
+    meantime, or the Database before the first build is done.
+    '''
+
+    def __init__(self):
+        self._filter = None
+        self._last_pk = 0
+        self._built_at = None
+        self._refreshed_at = None
+        # Process whose thread is building the filter.
+        self._builder = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        '''
+        Build the filter from every Link key, then swap it in.
+        '''
+
+        bloom, last_pk = self._read()
+
+        with self._lock:
+            self._filter = bloom
+            self._last_pk = last_pk
+            # Keys created while the table was read.
+            self._refresh()
+            self._built_at = time.monotonic()
+
+    def _read(self):
+        '''
+        Return a new filter of every Link key, and the last pk read.
+        '''
+
+        capacity = max(
+            2 * Link.objects.count(),
+            settings.KEY_FILTER_MIN_CAPACITY
+        )
+        bloom = BloomFilter(capacity, settings.KEY_FILTER_ERROR_RATE)
+        last_pk = 0
+        keys = Link.objects.order_by('pk').values_list('pk', 'key')
+        for last_pk, key in keys.iterator():
+            bloom.add(key)
+        return bloom, last_pk
+
+    def refresh(self):
+        '''
+        Add the keys of Links created since the last refresh.
+        '''
+
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        keys = (
+            Link.objects
+            .filter(pk__gt=self._last_pk)
+            .order_by('pk')
+            .values_list('pk', 'key')
+        )
+        for pk, key in keys:
+            self._filter.add(key)
+            self._last_pk = pk
+        self._refreshed_at = time.monotonic()
+
+    def _ensure_built(self):
+        '''
+        Build the filter if it is missing or old, in a
+        background thread if KEY_FILTER_ASYNC is on.
+        '''
+
+        if not settings.KEY_FILTER_ASYNC:
+            self.build()
+            return
+
+        with self._lock:
+            # Threads do not survive a fork, forked workers start their own.
+            if self._builder == os.getpid():
+                return
+            self._builder = os.getpid()
+            threading.Thread(
+                target=self._build_in_background,
+                name='key-filter',
+                daemon=True
+            ).start()
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Could not build the key filter.')
+        finally:
+            with self._lock:
+                self._builder = None
+            connection.close()
+
+    def add(self, key):
+        if self._filter is not None:
+            self._filter.add(key)
+
+    def reset(self):
+        '''
+        Drop the filter. It is built again on next use.
+        '''
+
+        with self._lock:
+            self._filter = None
+            self._builder = None
+
+    def might_exist(self, key):
+        '''
+        Return False if no Link has key, True if one might.
+        '''
+
+        now = time.monotonic()
+        if (self._filter is None or
+                now - self._built_at > settings.KEY_FILTER_REBUILD_INTERVAL):
+            self._ensure_built()
+        if self._filter is None:
+            return True
+
+        # Old filters are refreshed while they are rebuilt.
+        if now - self._refreshed_at > settings.KEY_FILTER_REFRESH_INTERVAL:
+            self.refresh()
+
+        return key in self._filter
+
+    def exists(self, key):
+        '''
+        Return True if a Link has key.
+        '''
+
+        return (
+            self.might_exist(key) and
+            Link.objects.filter(key=key).exists()
+        )
+
+
+key_filter = KeyFilter()
@@ -0,0 +1,277 @@
+import json
+from urllib.parse import urlparse
+
+from django import forms
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db import IntegrityError, transaction
+
+from .allocator import key_allocator, taken_keys
+from .bloom import key_filter
+from .cache import link_cache
+from .models import Link, Tag
+from .search import fts5_available, search_index
+from .utils import invalidate_tag_counts, resolve_tags
+
+
+class BulkParseError(ValueError):
+    pass
+
+
+def read_body(request):
+    '''
+    Return the request body, which may be larger than
+    DATA_UPLOAD_MAX_MEMORY_SIZE but not BULK_SHORTEN_MAX_BODY_SIZE.
+    Raise BulkParseError if it is too large.
+    '''
+
+    limit = settings.BULK_SHORTEN_MAX_BODY_SIZE
+    error = BulkParseError(
+        'Request body cannot be larger than {} bytes.'.format(limit)
+    )
+    if int(request.META.get('CONTENT_LENGTH') or 0) > limit:
+        raise error
+
+    # Reading the stream skips the check done by request.body. A body
+    # without a Content-Length is read one byte past the limit, so one
+    # that is too large is refused rather than cut off.
+    body = request.read(limit + 1)
+    if len(body) > limit:
+        raise error
+    return body
+
+
+def parse_items(body, content_type):
+    '''
+    Return the list of items in a JSON array or an NDJSON
+    request body. Raise BulkParseError if it cannot be parsed.
+    '''
+
+    try:
+        text = body.decode('utf-8')
+        if content_type == 'application/x-ndjson':
+            items = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            items = json.loads(text)
+    except ValueError as e:
+        raise BulkParseError('Invalid JSON: {}'.format(e))
+
+    if not isinstance(items, list):
+        raise BulkParseError('Expected a list of links.')
+
+    if len(items) > settings.BULK_SHORTEN_LIMIT:
+        raise BulkParseError(
+            'Cannot shorten more than {} links at once.'.format(
+                settings.BULK_SHORTEN_LIMIT
+            )
+        )
+
+    return items
+
+
+def clean_item(item, site_domain, url_field):
+    '''
+    Validate one item. Return (cleaned item, None) or (None, errors).
+    Key availability is checked for the whole batch afterwards.
+    '''
+
+    if not isinstance(item, dict):
+        return None, {'__all__': ['Expected an object.']}
+
+    errors = {}
+    cleaned = {}
+
+    # Destination must be a url that does not originate from this site.
+    try:
+        destination = url_field.clean(item.get('destination'))
+        if urlparse(destination).hostname == site_domain:
+            raise forms.ValidationError('Sorry, this url is not allowed!')
+        cleaned['destination'] = destination
+    except forms.ValidationError as e:
+        errors['destination'] = e.messages
+
+    # Keys may only contain alphanumeric characters and dashes.
+    key = item.get('key')
+    if key:
+        cleaned['key'] = Link.normalize_key(str(key))
+        if not cleaned['key']:
+            errors['key'] = [
+                'Custom key can only contain alphanumeric '
+                'characters and dashes'
+            ]
+        elif len(cleaned['key']) > Link._meta.get_field('key').max_length:
+            errors['key'] = ['Custom key is too long.']
+
+    title = str(item.get('title') or '')
+    if len(title) > Link._meta.get_field('title').max_length:
+        errors['title'] = ['Title is too long.']
+    cleaned['title'] = title
+
+    # Tags may be given as a list or a comma separated string.
+    tags = item.get('tags') or []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    tags = [Tag.normalize_text(str(tag)) for tag in tags]
+    tags = list(filter(lambda x: x, tags))
+    if len(tags) > settings.TAG_LIMIT:
+        errors['tags'] = [
+            'Cannot have more than {} tags.'.format(settings.TAG_LIMIT)
+        ]
+    cleaned['tags'] = tags
+
+    if errors:
+        return None, errors
+    return cleaned, None
+
+
+def validate_items(items):
+    '''
+    Validate a batch of items. Return a list of (cleaned item, errors)
+    pairs, one per item, where one of the two is None.
+    '''
+
+    site_domain = Site.objects.get_current().domain
+    url_field = forms.URLField(
+        max_length=Link._meta.get_field('destination').max_length
+    )
+
+    results = [clean_item(item, site_domain, url_field) for item in items]
+
+    # Custom keys must not be taken, nor repeated within the batch.
+    unavailable = taken_keys(
+        cleaned['key'] for cleaned, errors in results
+        if cleaned and cleaned.get('key')
+    )
+    unavailable.update(getattr(settings, 'blacklist', []))
+
+    seen = set()
+    for index, (cleaned, errors) in enumerate(results):
+        key = cleaned.get('key') if cleaned else None
+        if not key:
+            continue
+        if key in unavailable or key in seen:
+            results[index] = (None, {'key': ['Custom link is already taken!']})
+        seen.add(key)
+
+    return results
+
+
+def allocate_keys(items):
+    '''
+    Give every item without a custom key a generated key.
+    '''
+
+    custom_keys = {item['key'] for item in items if item.get('key')}
+    needed = [item for item in items if not item.get('key')]
+
+    keys = []
+    while len(keys) < len(needed):
+        keys.extend(
+            key for key in key_allocator.allocate(len(needed) - len(keys))
+            if key not in custom_keys
+        )
+
+    for item, key in zip(needed, keys):
+        item['key'] = key
+
+
+def create_links(items, user, batch_size=500):
+    '''
+    Insert Links for cleaned items in one transaction.
+
+    Custom keys may be taken by another request after they were
+    validated. Items with such keys are left out, the others are
+    inserted again, and the set of those keys is returned.
+    '''
+
+    custom_keys = {item['key'] for item in items if item.get('key')}
+    allocate_keys(items)
+
+    conflicts = set()
+    while True:
+        try:
+            with transaction.atomic():
+                insert_links(items, user, batch_size)
+            break
+        except IntegrityError:
+            taken = taken_keys((item['key'] for item in items), exact=True)
+            if not taken:
+                raise
+
+            conflicts.update(taken & custom_keys)
+            items = [item for item in items if item['key'] not in conflicts]
+
+            # Generated keys that were taken are replaced.
+            for item in items:
+                if item['key'] in taken:
+                    item['key'] = None
+            allocate_keys(items)
+
+    if any(item['tags'] for item in items):
+        invalidate_tag_counts(user.pk)
+
+    # bulk_create sends no post_save signals.
+    for item in items:
+        key_filter.add(item['key'])
+    link_cache.forget_missing(item['key'] for item in items)
+    if not fts5_available():
+        index_links([item['key'] for item in items], batch_size)
+
+    return conflicts
+
+
+def index_links(keys, batch_size):
+    '''
+    Add the Links with keys to the in-memory search index. They are
+    read back, since bulk_create does not set their primary keys.
+    '''
+
+    for i in range(0, len(keys), batch_size):
+        links = Link.objects.filter(key__in=keys[i:i + batch_size]).only(
+            'pk', 'user_id', 'title', 'destination'
+        )
+        for link in links:
+            search_index.update(link)
+
+
+def insert_links(items, user, batch_size):
+    '''
+    Insert Links for items with keys, and tag them.
+    '''
+
+    Link.objects.bulk_create(
+        [
+            Link(
+                destination=item['destination'],
+                key=item['key'],
+                title=item['title'] or 'Link - {}'.format(item['key']),
+                user=user,
+            )
+            for item in items
+        ],
+        batch_size=batch_size
+    )
+
+    # Tag the new Links.
+    tagged = [item for item in items if item['tags']]
+    if not tagged:
+        return
+
+    tags = resolve_tags(name for item in tagged for name in item['tags'])
+    link_ids = {}
+    for i in range(0, len(tagged), batch_size):
+        link_ids.update(
+            Link.objects
+            .filter(key__in=[item['key'] for item in tagged[i:i + batch_size]])
+            .values_list('key', 'pk')
+        )
+
+    Through = Link.tags.through
+    Through.objects.bulk_create(
+        [
+            Through(link_id=link_ids[item['key']], tag_id=tags[name].pk)
+            for item in tagged
+            for name in set(item['tags'])
+        ],
+        batch_size=batch_size
+    )
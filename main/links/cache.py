@@ -0,0 +1,259 @@
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import KeyCounter, Link
+
+
+CachedLink = collections.namedtuple(
+    'CachedLink',
+    ['id', 'key', 'destination', 'status']
+)
+
+
+class LinkCache(object):
+    '''
+    Per-worker LRU cache that maps a Link key to a CachedLink.
+
+    Entries expire after LINK_CACHE_TTL seconds. Invalidating a key
+    also bumps a generation counter, a KeyCounter row that is
+    incremented atomically, so concurrent bumps are all seen. Every
+    worker checks that counter at most every LINK_CACHE_SYNC_INTERVAL
+    seconds and drops its entries when it changed, which bounds how long
+    any worker can serve a stale destination.
+
+    Keys that have no Link are remembered too, for LINK_MISSING_CACHE_TTL
+    seconds, so repeated probes for unknown keys skip the Database.
+    Creating a Link forgets its key in every worker the same way, with
+    a second generation counter.
+    '''
+
+    generation_key = 'links:cache-generation'
+    missing_generation_key = 'links:missing-generation'
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self._missing = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._missing_generation = None
+        self._synced_at = None
+        self.hits = 0
+        self.misses = 0
+        self.missing_hits = 0
+
+    def get(self, key):
+        '''
+        Return the cached Link for key, or None.
+        '''
+
+        self._sync()
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                link, expires = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return link
+                del self._entries[key]
+
+        self.misses += 1
+        return None
+
+    def set(self, link):
+        '''
+        Store a CachedLink, evicting the least recently used entry.
+        '''
+
+        expires = time.monotonic() + settings.LINK_CACHE_TTL
+
+        with self._lock:
+            self._entries[link.key] = (link, expires)
+            self._entries.move_to_end(link.key)
+            while len(self._entries) > settings.LINK_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def lookup(self, key):
+        '''
+        Return the CachedLink for key, loading it from the Database
+        on a miss. Return None if the Link does not exist.
+        '''
+
+        link = self.get(key)
+        if link is not None:
+            return link
+
+        if self.is_missing(key):
+            return None
+
+        row = (
+            Link.objects
+            .filter(key=key)
+            .values_list('pk', 'key', 'destination', 'redirect_status')
+            .first()
+        )
+        if row is None:
+            self.set_missing(key)
+            return None
+
+        link = CachedLink(*row)
+        self.set(link)
+        return link
+
+    def is_missing(self, key):
+        '''
+        Return True if key was recently found to have no Link.
+        '''
+
+        now = time.monotonic()
+
+        with self._lock:
+            expires = self._missing.get(key)
+            if expires is not None:
+                if expires > now:
+                    self.missing_hits += 1
+                    return True
+                del self._missing[key]
+
+        return False
+
+    def set_missing(self, key):
+        '''
+        Remember that key has no Link, evicting the oldest unknown key.
+        '''
+
+        expires = time.monotonic() + settings.LINK_MISSING_CACHE_TTL
+
+        with self._lock:
+            self._missing[key] = expires
+            self._missing.move_to_end(key)
+            while len(self._missing) > settings.LINK_MISSING_CACHE_SIZE:
+                self._missing.popitem(last=False)
+
+    def forget_missing(self, keys):
+        '''
+        Forget that new keys had no Link, here and in the other workers.
+        Like invalidations, creations bump an atomic KeyCounter row, so
+        concurrent creations in other workers are never missed.
+        '''
+
+        with self._lock:
+            for key in keys:
+                self._missing.pop(key, None)
+
+        generation = self._bump(self.missing_generation_key)
+        if not self._follows(self._missing_generation, generation):
+            with self._lock:
+                self._missing.clear()
+        self._missing_generation = generation
+
+    def preload(self, count):
+        '''
+        Load the `count` most clicked Links in one query.
+        Return the number of Links loaded.
+        '''
+
+        # Catch up with invalidations first, so the next
+        # lookup does not drop the preloaded entries.
+        self._synced_at = None
+        self._sync()
+
+        rows = (
+            Link.objects
+            .order_by('-total_clicks')
+            .values_list('pk', 'key', 'destination', 'redirect_status')
+        )[:min(count, settings.LINK_CACHE_SIZE)]
+
+        # Load the most clicked Link last, as the most recently used.
+        rows = list(rows)
+        for row in reversed(rows):
+            self.set(CachedLink(*row))
+        return len(rows)
+
+    def invalidate(self, key):
+        '''
+        Drop key from this worker and signal the other workers.
+        '''
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+        generation = self._bump(self.generation_key)
+        if not self._follows(self._generation, generation):
+            with self._lock:
+                self._entries.clear()
+        self._generation = generation
+
+    def _bump(self, generation_key):
+        '''
+        Increment a generation counter in the Database.
+        Return its new value.
+        '''
+
+        counter = KeyCounter.objects.filter(name=generation_key)
+        if not counter.update(value=F('value') + 1):
+            with transaction.atomic():
+                KeyCounter.objects.get_or_create(name=generation_key)
+                counter.update(value=F('value') + 1)
+
+        # Another bump may land before this read. The value read is then
+        # not the one after ours, and the caller drops all entries.
+        return counter.values_list('value', flat=True).get()
+
+    def _follows(self, previous, generation):
+        '''
+        Return True if generation is the only bump since the last sync.
+        Otherwise another worker bumped the counter in between, and
+        adopting it would skip that worker's change.
+        '''
+
+        return previous is not None and generation == previous + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._missing.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _sync(self):
+        '''
+        Drop all entries if another worker invalidated a key, and
+        all unknown keys if another worker created a Link.
+        '''
+
+        now = time.monotonic()
+        interval = settings.LINK_CACHE_SYNC_INTERVAL
+        if self._synced_at is not None and now - self._synced_at < interval:
+            return
+        self._synced_at = now
+
+        names = [self.generation_key, self.missing_generation_key]
+        generations = dict(
+            KeyCounter.objects
+            .filter(name__in=names)
+            .values_list('name', 'value')
+        )
+
+        generation = generations.get(self.generation_key)
+        if generation != self._generation:
+            self._generation = generation
+            with self._lock:
+                self._entries.clear()
+
+        generation = generations.get(self.missing_generation_key)
+        if generation != self._missing_generation:
+            self._missing_generation = generation
+            with self._lock:
+                self._missing.clear()
+
+
+link_cache = LinkCache()
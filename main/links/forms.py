@@ -3,8 +3,11 @@ from urllib.parse import urlparse
 from django import forms
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.db import IntegrityError, transaction
 
+from .bloom import key_filter
 from .models import Link, Tag
+from .utils import delete_orphan_tags, invalidate_tag_counts, resolve_tags
 
 
 class LinkFormMixin(object):
@@ -15,11 +18,14 @@ class LinkFormMixin(object):
         key_field = self.fields.get('key')
         title_field = self.fields.get('title')
         tags_field = self.fields.get('tags')
+        redirect_status_field = self.fields.get('redirect_status')
 
         if key_field:
             key_field.required = False
         if title_field:
             title_field.required = False
+        if redirect_status_field:
+            redirect_status_field.required = False
         if tags_field:
             tags_field.initial = ','.join(
                 self.instance.tags.values_list('name', flat=True)
@@ -54,7 +60,7 @@ class LinkFormMixin(object):
             raise forms.ValidationError('Only logged in users can define key.')
 
         # If a key is given and an existing url has same key, raise exception.
-        if key and Link.objects.filter(key=key).exists():
+        if key and key_filter.exists(key):
             raise forms.ValidationError('Custom link is already taken!')
 
         # Normalize key. Raise validation error if a raw key
@@ -85,6 +91,14 @@ class LinkFormMixin(object):
             )
         return title
 
+    def clean_redirect_status(self):
+        '''
+        Keep the current redirect status if none is given.
+        '''
+
+        redirect_status = self.cleaned_data.get('redirect_status')
+        return redirect_status or self.instance.redirect_status
+
     def clean_tags(self):
         '''
         Resolve tags from an input string.
@@ -114,8 +128,9 @@ class LinkFormMixin(object):
                     'Cannot have more than {} tags.'.format(settings.TAG_LIMIT)
                 )
 
-            # Resolve Tag objects from tags list.
-            tags = [Tag.objects.get_or_create(name=tag)[0] for tag in tags]
+            # Resolve Tag objects from tags list, in one go.
+            resolved = resolve_tags(tags)
+            tags = [resolved[tag] for tag in dict.fromkeys(tags)]
 
         return tags
 
@@ -124,24 +139,30 @@ class LinkFormMixin(object):
         Overrides form save method.
         Generates key if key does not exist.
         Sets User if user is authenticated.
+
+        Return None, with an error on the form, if another request
+        took the custom key since the form was validated.
         '''
 
         link = super(LinkFormMixin, self).save(commit=False)
 
-        # Generate random key for Link if key does not exist.
-        if not link.key:
-            link.key = Link.make_key()
-
         # Set User if User is authenticated.
         if self.user and self.user.is_authenticated:
             link.user = self.user
 
-        # Set default link title
-        if not link.title:
-            title = 'Link - {}'.format(link.key)
-            link.title = title
+        # Generate key for Link if key does not exist.
+        if link.key:
+            # Set default link title
+            if not link.title:
+                title = 'Link - {}'.format(link.key)
+                link.title = title
 
-        link.save()
+            if link.pk is not None:
+                link.save()
+            elif not self._save_with_custom_key(link):
+                return None
+        else:
+            self._save_with_generated_key(link)
 
         # Get tags to update link tags.
         tags = self.cleaned_data.get('tags')
@@ -151,23 +172,67 @@ class LinkFormMixin(object):
 
             # Get tags before saving edit and
             # tags that were just entered.
-            old_tags = set(link.tags.all())
-            new_tags = set(tags)
+            old_tags = set(link.tags.values_list('pk', flat=True))
+            new_tags = {tag.pk for tag in tags}
 
-            # Clear existing tags.
-            link.tags.clear()
+            # Only touch the tags that changed.
+            removed = old_tags.difference(new_tags)
+            added = new_tags.difference(old_tags)
+            if removed:
+                link.tags.remove(*removed)
+            if added:
+                link.tags.add(*added)
 
-            # Remove cleared tags that have no m2m to links.
-            for tag in old_tags.difference(new_tags):
-                if not tag.links.exists():
-                    tag.delete()
+            # Remove removed tags that have no m2m to links.
+            delete_orphan_tags(removed)
 
-            if tags:
-                # Add tags to link.
-                link.tags.add(*tags)
+            if removed or added:
+                invalidate_tag_counts(link.user_id)
 
         return link
 
+    def _save_with_custom_key(self, link):
+        '''
+        Save a new Link with a custom key. Another request may take the
+        key after the form was validated, in which case an error is
+        added to the form and False is returned.
+        '''
+
+        try:
+            with transaction.atomic():
+                link.save()
+            return True
+        except IntegrityError:
+            if not Link.objects.filter(key=link.key).exists():
+                raise
+            self.add_error('key', 'Custom link is already taken!')
+            return False
+
+    def _save_with_generated_key(self, link):
+        '''
+        Save a new Link with a generated key. A custom key created
+        after the key was reserved makes the insert fail, in which
+        case another key is tried.
+        '''
+
+        default_title = not link.title
+
+        while True:
+            link.key = Link.make_key()
+
+            # Set default link title
+            if default_title:
+                link.title = 'Link - {}'.format(link.key)
+
+            try:
+                with transaction.atomic():
+                    link.save()
+                return
+            except IntegrityError:
+                if Link.objects.filter(key=link.key).exists():
+                    continue
+                raise
+
 
 class LinkForm(LinkFormMixin, forms.ModelForm):
     class Meta:
@@ -180,4 +245,4 @@ class LinkEditForm(LinkFormMixin, forms.ModelForm):
 
     class Meta:
         model = Link
-        fields = ['destination', 'title']
+        fields = ['destination', 'title', 'redirect_status']
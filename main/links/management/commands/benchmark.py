@@ -0,0 +1,155 @@
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings, setup_test_environment
+
+from links.benchmark import describe_environment, run_benchmarks, seed_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the redirect, shorten and dashboard views against a '
+        'seeded throwaway test database, and print the results as JSON. '
+        'The test databases are files, like in production.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--links',
+            type=int,
+            default=100000,
+            help='Number of links to seed.'
+        )
+        parser.add_argument(
+            '--clicks',
+            type=int,
+            default=500000,
+            help='Number of clicks to seed analytics rows from.'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=2000,
+            help='Number of redirects to measure. A tenth as many '
+                 'shorten and dashboard requests are measured.'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Seed of the synthetic data and request order.'
+        )
+        parser.add_argument(
+            '--database-dir',
+            help='Directory to create the test database files in. '
+                 'Defaults to a temporary directory.'
+        )
+        parser.add_argument(
+            '--output',
+            help='File to write the results to.'
+        )
+        parser.add_argument(
+            '--compare',
+            help='Results of an earlier run to compare against.'
+        )
+
+    def git_commit(self):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR,
+                stderr=subprocess.DEVNULL
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, results, path):
+        '''
+        Print the change of each latency against an earlier run.
+        '''
+
+        with open(path) as f:
+            baseline = json.load(f)
+
+        self.stdout.write('Compared to {}:'.format(
+            baseline.get('commit') or path
+        ))
+        for name, current in sorted(results['results'].items()):
+            previous = baseline['results'].get(name)
+            if not previous:
+                continue
+            self.stdout.write('{:>18} {}'.format(name, '  '.join(
+                '{} {:+.1f}%'.format(
+                    stat, 100.0 * (current[stat] - previous[stat]) / previous[stat]
+                )
+                for stat in ('p50_ms', 'p99_ms')
+                if previous[stat]
+            )))
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+
+        # SQLite test databases are in memory by default, which
+        # hides the cost of the journal and of reading pages.
+        database_dir = options['database_dir'] or tempfile.mkdtemp()
+        os.makedirs(database_dir, exist_ok=True)
+
+        old_names = {}
+        for connection in connections.all():
+            old_names[connection] = (
+                connection.settings_dict['NAME'],
+                connection.settings_dict['TEST'].get('NAME'),
+            )
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                database_dir, 'benchmark_{}.sqlite3'.format(connection.alias)
+            )
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            # The debug toolbar and query logging would skew the timings.
+            with override_settings(DEBUG=False):
+                user = seed_database(
+                    options['links'], options['clicks'], seed=options['seed']
+                )
+                measured = run_benchmarks(
+                    user, options['requests'], seed=options['seed']
+                )
+                environment = describe_environment()
+        finally:
+            for connection, (old_name, old_test_name) in old_names.items():
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                connection.settings_dict['TEST']['NAME'] = old_test_name
+            if not options['database_dir']:
+                shutil.rmtree(database_dir, ignore_errors=True)
+
+        results = {
+            'commit': self.git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'environment': environment,
+            'parameters': {
+                name: options[name]
+                for name in ('links', 'clicks', 'requests', 'seed')
+            },
+            'results': measured,
+        }
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self.compare(results, options['compare'])
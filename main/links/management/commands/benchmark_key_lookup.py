@@ -0,0 +1,124 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max
+from django.utils import timezone
+
+from analytics.models import Country, Region
+from links.models import Link
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure key and region lookup latency as the number of links grows. '
+        'Runs against a throwaway test database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='1000,10000,100000',
+            help='Comma separated table sizes to measure.'
+        )
+        parser.add_argument(
+            '--lookups',
+            type=int,
+            default=2000,
+            help='Number of lookups per table size.'
+        )
+
+    def grow_to(self, size):
+        '''
+        Insert links (with one region each) until there are `size` links.
+        '''
+
+        count = Link.objects.count()
+        last_pk = Link.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+        now = timezone.now()
+        batch = []
+
+        for i in range(count, size):
+            batch.append(Link(
+                key='{}{}'.format(
+                    ''.join(random.sample(settings.HASH_ALPHABET, 4)), i
+                ),
+                destination='http://example.com/{}'.format(i),
+                modified_on=now,
+            ))
+            if len(batch) == 5000:
+                Link.objects.bulk_create(batch)
+                batch = []
+        Link.objects.bulk_create(batch)
+
+        Region.objects.bulk_create(
+            Region(link_id=pk, country_id=Country.UNKNOWN_ID)
+            for pk in (
+                Link.objects.filter(pk__gt=last_pk).values_list('pk', flat=True)
+            )
+        )
+
+    def measure(self, func, args):
+        '''
+        Return the median and 99th percentile time of func in microseconds.
+        '''
+
+        timings = []
+        for arg in args:
+            start = time.perf_counter()
+            func(arg)
+            timings.append((time.perf_counter() - start) * 1e6)
+
+        timings.sort()
+        return (
+            timings[len(timings) // 2],
+            timings[int(len(timings) * 0.99)]
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        lookups = options['lookups']
+
+        old_names = {}
+        for connection in connections.all():
+            old_names[connection] = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        self.stdout.write('{:>10} {:>22} {:>22} {:>22}'.format(
+            'links', 'key get (p50/p99 us)',
+            'key exists (p50/p99 us)', 'region get (p50/p99 us)'
+        ))
+
+        try:
+            for size in sizes:
+                self.grow_to(size)
+
+                keys = list(Link.objects.values_list('key', flat=True))
+                keys = [random.choice(keys) for i in range(lookups)]
+                ids = list(Link.objects.values_list('pk', flat=True))
+                ids = [random.choice(ids) for i in range(lookups)]
+
+                key_get = self.measure(
+                    lambda key: Link.objects.get(key=key), keys
+                )
+                key_exists = self.measure(
+                    lambda key: Link.objects.filter(key=key).exists(), keys
+                )
+                region_get = self.measure(
+                    lambda pk: Region.objects.get(
+                        link_id=pk, country_id=Country.UNKNOWN_ID
+                    ),
+                    ids
+                )
+
+                self.stdout.write('{:>10} {:>22} {:>22} {:>22}'.format(
+                    size,
+                    '{:.0f} / {:.0f}'.format(*key_get),
+                    '{:.0f} / {:.0f}'.format(*key_exists),
+                    '{:.0f} / {:.0f}'.format(*region_get),
+                ))
+        finally:
+            for connection, old_name in old_names.items():
+                connection.creation.destroy_test_db(old_name, verbosity=0)
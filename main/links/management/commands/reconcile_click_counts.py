@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from links.utils import reconcile_click_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute the click counters of every Link from its analytics'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of Links corrected per transaction.'
+        )
+
+    def handle(self, *args, **options):
+        corrected = reconcile_click_counts(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Corrected click counters of {} links.'.format(corrected)
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from links.utils import sweep_orphan_tags
+
+
+class Command(BaseCommand):
+    help = 'Delete tags that are not used by any link'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of tags deleted per transaction.'
+        )
+
+    def handle(self, *args, **options):
+        deleted = sweep_orphan_tags(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Deleted {} orphan tags.'.format(deleted)
+        ))
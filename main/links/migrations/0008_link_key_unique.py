@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    def rename_duplicate_keys(apps, schema_editor):
+        Links = apps.get_model('links', 'Link')
+        db = schema_editor.connection.alias
+
+        # Keep the oldest Link for every key and give
+        # the newer duplicates a key suffixed with their id.
+        seen = set()
+        for link in Links.objects.using(db).order_by('pk').only('pk', 'key'):
+            if link.key in seen:
+                Links.objects.using(db).filter(pk=link.pk).update(
+                    key='{}-{}'.format(link.key, link.pk)
+                )
+            seen.add(link.key)
+
+    dependencies = [
+        ('links', '0007_remove_link_total_clicks'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='link',
+            name='key',
+            field=models.CharField(help_text='The unique identifier for the link', max_length=80, unique=True, verbose_name='Key'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('links', '0008_link_key_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='link',
+            name='redirect_status',
+            field=models.PositiveSmallIntegerField(choices=[(301, '301 Moved Permanently'), (302, '302 Found'), (307, '307 Temporary Redirect'), (308, '308 Permanent Redirect')], default=301, help_text='The status code used to redirect to the destination', verbose_name='Redirect status'),
+        ),
+    ]
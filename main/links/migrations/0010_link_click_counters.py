@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models, router
+from django.db.models import Count, Sum
+
+
+class Migration(migrations.Migration):
+    def count_clicks(apps, schema_editor):
+        Links = apps.get_model('links', 'Link')
+        IPAddresses = apps.get_model('analytics', 'IPAddress')
+        Regions = apps.get_model('analytics', 'Region')
+        db = schema_editor.connection.alias
+
+        # Skip when the analytics tables are in another database.
+        if not router.allow_migrate_model(db, Regions):
+            return
+
+        total_clicks = (
+            Regions.objects.using(db)
+            .values_list('link')
+            .annotate(clicks=Sum('total_clicks'))
+        )
+        for link_id, clicks in total_clicks:
+            (
+                Links.objects.using(db)
+                .filter(pk=link_id)
+                .update(total_clicks=clicks)
+            )
+
+        unique_clicks = (
+            IPAddresses.objects.using(db)
+            .values_list('link')
+            .annotate(clicks=Count('pk'))
+        )
+        for link_id, clicks in unique_clicks:
+            (
+                Links.objects.using(db)
+                .filter(pk=link_id)
+                .update(unique_clicks=clicks)
+            )
+
+    dependencies = [
+        ('links', '0009_link_redirect_status'),
+        ('analytics', '0005_unique_link_rows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='link',
+            name='total_clicks',
+            field=models.PositiveIntegerField(default=0, help_text='The total clicks for this link, across all regions', verbose_name='Total clicks'),
+        ),
+        migrations.AddField(
+            model_name='link',
+            name='unique_clicks',
+            field=models.PositiveIntegerField(default=0, help_text='The number of unique addresses that visited this link', verbose_name='Unique clicks'),
+        ),
+        migrations.RunPython(count_clicks, migrations.RunPython.noop),
+    ]
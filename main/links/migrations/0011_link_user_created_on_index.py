@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:36
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('links', '0010_link_click_counters'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='link',
+            index_together=set([('user', 'created_on', 'id')]),
+        ),
+    ]
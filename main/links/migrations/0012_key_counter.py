@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('links', '0011_link_user_created_on_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeyCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='The name of the counter', max_length=40, unique=True, verbose_name='Counter name')),
+                ('value', models.BigIntegerField(default=0, help_text='The first number that was not reserved yet', verbose_name='Value')),
+            ],
+        ),
+    ]
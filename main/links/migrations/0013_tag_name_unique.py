@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    def merge_duplicate_tags(apps, schema_editor):
+        Tags = apps.get_model('links', 'Tag')
+        Through = apps.get_model('links', 'Link').tags.through
+        db = schema_editor.connection.alias
+
+        # Keep the oldest Tag for every name, move the Links
+        # of newer duplicates over to it and delete them.
+        kept = {}
+        for tag in Tags.objects.using(db).order_by('pk'):
+            if tag.name not in kept:
+                kept[tag.name] = tag.pk
+                continue
+
+            tagged = set(
+                Through.objects.using(db)
+                .filter(tag_id=kept[tag.name])
+                .values_list('link_id', flat=True)
+            )
+            Through.objects.using(db).bulk_create(
+                Through(link_id=link_id, tag_id=kept[tag.name])
+                for link_id in Through.objects.using(db)
+                .filter(tag_id=tag.pk)
+                .values_list('link_id', flat=True)
+                if link_id not in tagged
+            )
+            Through.objects.using(db).filter(tag_id=tag.pk).delete()
+            tag.delete()
+
+    dependencies = [
+        ('links', '0012_key_counter'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(help_text='Name of tag', max_length=80, unique=True, verbose_name='Tag Name'),
+        ),
+        # Find the Links of a Tag from the index alone.
+        migrations.RunSQL(
+            'CREATE INDEX links_link_tags_tag_id_link_id '
+            'ON links_link_tags (tag_id, link_id)',
+            'DROP INDEX links_link_tags_tag_id_link_id'
+        ),
+    ]
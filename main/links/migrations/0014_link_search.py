@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 17:56
+from __future__ import unicode_literals
+
+from django.db import migrations, OperationalError
+
+
+class Migration(migrations.Migration):
+    def create_search_table(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+
+        # The table indexes the title, destination and owner of every
+        # Link, and reads their text from links_link. Triggers keep it
+        # in sync, but not on updates of other columns like the click
+        # counters.
+        try:
+            schema_editor.execute(
+                'CREATE VIRTUAL TABLE links_link_search USING fts5('
+                'title, destination, user_id, '
+                'content=\'links_link\', content_rowid=\'id\')'
+            )
+        except OperationalError:
+            # SQLite was built without FTS5. Searches
+            # use the in-process index instead.
+            return
+
+        schema_editor.execute(
+            'CREATE TRIGGER links_link_search_insert AFTER INSERT ON links_link '
+            'BEGIN '
+            'INSERT INTO links_link_search(rowid, title, destination, user_id) '
+            'VALUES (new.id, new.title, new.destination, new.user_id); '
+            'END'
+        )
+        schema_editor.execute(
+            'CREATE TRIGGER links_link_search_delete AFTER DELETE ON links_link '
+            'BEGIN '
+            'INSERT INTO links_link_search(links_link_search, rowid, title, destination, user_id) '
+            'VALUES (\'delete\', old.id, old.title, old.destination, old.user_id); '
+            'END'
+        )
+        schema_editor.execute(
+            'CREATE TRIGGER links_link_search_update '
+            'AFTER UPDATE OF title, destination, user_id ON links_link '
+            'BEGIN '
+            'INSERT INTO links_link_search(links_link_search, rowid, title, destination, user_id) '
+            'VALUES (\'delete\', old.id, old.title, old.destination, old.user_id); '
+            'INSERT INTO links_link_search(rowid, title, destination, user_id) '
+            'VALUES (new.id, new.title, new.destination, new.user_id); '
+            'END'
+        )
+        schema_editor.execute(
+            'INSERT INTO links_link_search(links_link_search) VALUES (\'rebuild\')'
+        )
+
+    def drop_search_table(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(
+                'DROP TRIGGER IF EXISTS links_link_search_{}'.format(trigger)
+            )
+        schema_editor.execute('DROP TABLE IF EXISTS links_link_search')
+
+    dependencies = [
+        ('links', '0013_tag_name_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -1,17 +1,23 @@
-import random
 import re
 
-from django.conf import settings
 from django.db import models
-from django.db.models import Sum
 from django.utils import timezone
 
+from analytics.hyperloglog import HyperLogLog
+
 
 class Link(models.Model):
     '''
     Basic Link.
     '''
 
+    REDIRECT_STATUS_CHOICES = (
+        (301, '301 Moved Permanently'),
+        (302, '302 Found'),
+        (307, '307 Temporary Redirect'),
+        (308, '308 Permanent Redirect'),
+    )
+
     created_on = models.DateTimeField(auto_now_add=True)
     modified_on = models.DateTimeField(default=timezone.now)
     tags = models.ManyToManyField(
@@ -36,10 +42,30 @@ class Link(models.Model):
 
     key = models.CharField(
         max_length=80,
+        unique=True,
         verbose_name='Key',
         help_text='The unique identifier for the link'
     )
 
+    redirect_status = models.PositiveSmallIntegerField(
+        choices=REDIRECT_STATUS_CHOICES,
+        default=301,
+        verbose_name='Redirect status',
+        help_text='The status code used to redirect to the destination'
+    )
+
+    total_clicks = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Total clicks',
+        help_text='The total clicks for this link, across all regions'
+    )
+
+    unique_clicks = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Unique clicks',
+        help_text='The number of unique addresses that visited this link'
+    )
+
     user = models.ForeignKey(
         'users.User',
         related_name='links',
@@ -53,51 +79,31 @@ class Link(models.Model):
     def __str__(self):
         return '{} - {}'.format(self.key, self.destination[:20])
 
-    def add_unique_ip(self, ip_address=None):
-        '''
-        Update Unique IP Address for the Link.
-        '''
-        if ip_address:
-            self.addresses.update_or_create(address=ip_address)
-
-    @property
-    def total_clicks(self):
-        '''
-        Return sum of all region's total clicks.
-        '''
-        sum_data = self.regions.aggregate(Sum('total_clicks'))
-        total_clicks = sum_data['total_clicks__sum']
-        return total_clicks if total_clicks else 0
-
-    @property
-    def unique_clicks(self):
+    def unique_clicks_between(self, start, end):
         '''
-        Return the total number of unique addresses that visited the Link.
+        Return the estimated number of unique addresses that visited the
+        Link from day `start` to day `end`, inclusive. Counts come from
+        the daily sketches kept when UNIQUE_CLICKS_DAILY_SKETCHES is on.
         '''
-        return self.addresses.count()
 
-    @staticmethod
-    def _generate_key():
-        '''
-        Generate a random string based on the Hash length and Alphabet.
-        '''
+        registers = self.sketches.filter(
+            day__range=(start, end)
+        ).values_list('registers', flat=True)
 
-        return ''.join(
-            random.choice(settings.HASH_ALPHABET)
-            for x in range(settings.HASH_LENGTH)
-        )
+        return HyperLogLog.union(
+            HyperLogLog.from_bytes(data) for data in registers
+        ).count()
 
     @classmethod
     def make_key(cls):
         '''
-        Make random key for Link.
-        Ensure uniqueness of key by querying Database.
+        Make a unique key for Link, from this worker's block of keys.
         '''
 
-        key = cls._generate_key()
-        while cls.objects.filter(key=key).exists():
-            key = cls._generate_key()
-        return key
+        # The allocator module imports this one.
+        from .allocator import key_allocator
+
+        return key_allocator.next_key()
 
     @classmethod
     def normalize_key(cls, text):
@@ -125,11 +131,37 @@ class Link(models.Model):
 
     class Meta:
         ordering = ('created_on',)
+        index_together = [
+            ('user', 'created_on', 'id'),
+        ]
+
+
+class KeyCounter(models.Model):
+    '''
+    A named counter that key allocators reserve blocks of numbers from.
+    '''
+
+    name = models.CharField(
+        max_length=40,
+        unique=True,
+        verbose_name='Counter name',
+        help_text='The name of the counter'
+    )
+
+    value = models.BigIntegerField(
+        default=0,
+        verbose_name='Value',
+        help_text='The first number that was not reserved yet'
+    )
+
+    def __str__(self):
+        return '{} ({})'.format(self.name, self.value)
 
 
 class Tag(models.Model):
     name = models.CharField(
         max_length=80,
+        unique=True,
         verbose_name='Tag Name',
         help_text='Name of tag',
     )
@@ -0,0 +1,365 @@
+import bisect
+import collections
+import logging
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Link
+
+logger = logging.getLogger(__name__)
+
+
+SEARCH_TABLE = 'links_link_search'
+
+# Matches of a term in the title count more than in the destination.
+TITLE_WEIGHT = 2.0
+DESTINATION_WEIGHT = 1.0
+
+
+def tokenize(text):
+    '''
+    Split text into lowercase alphanumeric terms, as the
+    FTS5 unicode61 tokenizer does for ascii text.
+    '''
+
+    return re.findall(r'[0-9a-z]+', (text or '').lower())
+
+
+_fts5_tables = {}
+
+
+def fts5_available():
+    '''
+    Return True if the Link search table exists in the Database.
+    The answer is kept per Database, for the life of the process.
+    '''
+
+    if settings.SEARCH_BACKEND == 'memory' or connection.vendor != 'sqlite':
+        return False
+
+    name = connection.settings_dict['NAME']
+    if name not in _fts5_tables:
+        with connection.cursor() as cursor:
+            _fts5_tables[name] = (
+                SEARCH_TABLE in connection.introspection.table_names(cursor)
+            )
+    return _fts5_tables[name]
+
+
+def term_weights(title, destination):
+    '''
+    Return the weight of every term of a Link.
+    '''
+
+    weights = collections.Counter()
+    for term in tokenize(title):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize(destination):
+        weights[term] += DESTINATION_WEIGHT
+    return weights
+
+
+class UserPostings(object):
+    '''
+    The terms of the Links of one User, each with the weights of the
+    Links that contain it. Terms are kept sorted, so prefixes are found
+    by bisection.
+    '''
+
+    __slots__ = ('postings', 'terms')
+
+    def __init__(self):
+        self.postings = collections.defaultdict(dict)
+        self.terms = []
+
+
+class InvertedIndex(object):
+    '''
+    In-process index from terms to the Links whose title or
+    destination contains them, for Databases without FTS5.
+
+    Postings are kept per User, so a search only looks at the terms
+    of the User's own Links. Like the key filter, the index picks up
+    Links created by other workers every SEARCH_INDEX_REFRESH_INTERVAL
+    seconds and is rebuilt every SEARCH_INDEX_REBUILD_INTERVAL seconds
+    to see their edits.
+
+    With SEARCH_INDEX_ASYNC on, builds run in a background thread.
+    Searches are answered by the previous index meanwhile, or by the
+    Database before the first build is done.
+    '''
+
+    def __init__(self):
+        self._users = None
+        self._documents = {}
+        self._last_pk = 0
+        self._built_at = None
+        self._refreshed_at = None
+        # Links edited while a build reads the table.
+        self._dirty = None
+        # Process whose thread is building the index.
+        self._builder = None
+        self._lock = threading.RLock()
+
+    def build(self):
+        '''
+        Index every Link. Links edited while the table is read are
+        read again before the new index replaces the old one.
+        '''
+
+        with self._lock:
+            self._dirty = set()
+
+        try:
+            users, documents, last_pk = self._read(
+                Link.objects.order_by('pk')
+            )
+
+            with self._lock:
+                self._users = users
+                self._documents = documents
+                self._last_pk = last_pk
+
+                for pk in self._dirty:
+                    self._remove(pk)
+                self._index(
+                    Link.objects
+                    .filter(Q(pk__in=self._dirty) | Q(pk__gt=last_pk))
+                    .order_by('pk')
+                )
+                self._built_at = self._refreshed_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._dirty = None
+
+    def refresh(self):
+        with self._lock:
+            self._index(
+                Link.objects.filter(pk__gt=self._last_pk).order_by('pk')
+            )
+            self._refreshed_at = time.monotonic()
+
+    def _read(self, links):
+        '''
+        Return new postings per User, documents and the
+        last pk for links, without touching the index.
+        '''
+
+        users = collections.defaultdict(UserPostings)
+        documents = {}
+        last_pk = 0
+
+        rows = links.values_list('pk', 'user_id', 'title', 'destination')
+        for pk, user_id, title, destination in rows.iterator():
+            weights = term_weights(title, destination)
+            postings = users[user_id].postings
+            for term, weight in weights.items():
+                postings[term][pk] = weight
+            documents[pk] = (user_id, list(weights))
+            last_pk = max(last_pk, pk)
+
+        for user in users.values():
+            user.terms = sorted(user.postings)
+        return dict(users), documents, last_pk
+
+    def _index(self, links):
+        rows = links.values_list('pk', 'user_id', 'title', 'destination')
+        for pk, user_id, title, destination in rows.iterator():
+            self._remove(pk)
+            self._add(pk, user_id, title, destination)
+            self._last_pk = max(self._last_pk, pk)
+
+    def _add(self, pk, user_id, title, destination):
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._users[user_id] = UserPostings()
+
+        weights = term_weights(title, destination)
+        for term, weight in weights.items():
+            if term not in user.postings:
+                bisect.insort(user.terms, term)
+            user.postings[term][pk] = weight
+        self._documents[pk] = (user_id, list(weights))
+
+    def _remove(self, pk):
+        user_id, terms = self._documents.pop(pk, (None, []))
+        user = self._users.get(user_id)
+        for term in terms:
+            user.postings[term].pop(pk, None)
+
+    def update(self, link):
+        '''
+        Index a new or edited Link.
+        '''
+
+        with self._lock:
+            if self._dirty is not None:
+                self._dirty.add(link.pk)
+            if self._users is None:
+                return
+            self._remove(link.pk)
+            self._add(link.pk, link.user_id, link.title, link.destination)
+
+    def remove(self, pk):
+        with self._lock:
+            if self._dirty is not None:
+                self._dirty.add(pk)
+            if self._users is not None:
+                self._remove(pk)
+
+    def reset(self):
+        with self._lock:
+            self._users = None
+            self._dirty = None
+            self._builder = None
+
+    def _ensure_built(self):
+        '''
+        Build the index if it is missing or old, in a
+        background thread if SEARCH_INDEX_ASYNC is on.
+        '''
+
+        with self._lock:
+            due = (
+                self._users is None or
+                time.monotonic() - self._built_at >
+                settings.SEARCH_INDEX_REBUILD_INTERVAL
+            )
+            if not due:
+                return
+
+            if not settings.SEARCH_INDEX_ASYNC:
+                self.build()
+                return
+
+            # Threads do not survive a fork, forked workers start their own.
+            if self._builder == os.getpid():
+                return
+            self._builder = os.getpid()
+            threading.Thread(
+                target=self._build_in_background,
+                name='search-index',
+                daemon=True
+            ).start()
+
+    def _build_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Could not build the search index.')
+        finally:
+            with self._lock:
+                self._builder = None
+            connection.close()
+
+    def search(self, user_id, query, limit):
+        '''
+        Return the ids of the User's Links matching every term
+        of query as a prefix, best matches first. Return None if
+        the index is not built yet.
+        '''
+
+        self._ensure_built()
+
+        with self._lock:
+            if self._users is None:
+                return None
+
+            now = time.monotonic()
+            if now - self._refreshed_at > settings.SEARCH_INDEX_REFRESH_INTERVAL:
+                self.refresh()
+
+            user = self._users.get(user_id)
+            if user is None:
+                return []
+
+            scores = None
+            for prefix in tokenize(query):
+                matches = collections.Counter()
+                start = bisect.bisect_left(user.terms, prefix)
+                for term in user.terms[start:]:
+                    if not term.startswith(prefix):
+                        break
+                    matches.update(user.postings[term])
+
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = collections.Counter({
+                        pk: score + matches[pk]
+                        for pk, score in scores.items() if pk in matches
+                    })
+
+            scores = scores or collections.Counter()
+            return [pk for pk, score in scores.most_common(limit)]
+
+
+def fts5_query(user_id, query):
+    '''
+    Return an FTS5 query for the Links of a User whose title or
+    destination match every term of query as a prefix.
+    '''
+
+    terms = ' AND '.join('"{}"*'.format(term) for term in tokenize(query))
+    return 'user_id : "{}" AND {{title destination}} : ({})'.format(
+        int(user_id), terms
+    )
+
+
+def fts5_search(user_id, query, limit):
+    '''
+    Return the ids of matching Links, ranked by BM25.
+    '''
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+            'ORDER BY bm25({table}, %s, %s, 0) LIMIT %s'.format(
+                table=SEARCH_TABLE
+            ),
+            [fts5_query(user_id, query), TITLE_WEIGHT, DESTINATION_WEIGHT, limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def like_search(user_id, query, limit):
+    '''
+    Return the ids of the User's Links whose title or destination
+    contain every term of query, newest first.
+    '''
+
+    links = Link.objects.filter(user_id=user_id)
+    for term in tokenize(query):
+        links = links.filter(
+            Q(title__icontains=term) | Q(destination__icontains=term)
+        )
+    return list(links.order_by('-pk').values_list('pk', flat=True)[:limit])
+
+
+def search_links(user, query, limit=50):
+    '''
+    Return the User's Links whose title or destination have words
+    starting with every word of query, best matches first.
+    '''
+
+    if not tokenize(query):
+        return []
+
+    if fts5_available():
+        ids = fts5_search(user.pk, query, limit)
+    else:
+        ids = search_index.search(user.pk, query, limit)
+        if ids is None:
+            ids = like_search(user.pk, query, limit)
+
+    links = Link.objects.prefetch_related('tags').in_bulk(ids)
+    return [links[pk] for pk in ids if pk in links]
+
+
+search_index = InvertedIndex()
@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .bloom import key_filter
+from .cache import link_cache
+from .models import Link
+from .search import search_index
+from .utils import invalidate_tag_counts
+
+
+@receiver(post_save, sender=Link)
+def add_created_key(sender, instance, created, **kwargs):
+    '''
+    Mark the key of a new Link as taken, and index its words.
+    Any other save may change the redirect, so cached ones are dropped.
+    '''
+
+    if created:
+        key_filter.add(instance.key)
+        link_cache.forget_missing([instance.key])
+    else:
+        link_cache.invalidate(instance.key)
+    search_index.update(instance)
+
+
+@receiver(post_delete, sender=Link)
+def invalidate_deleted_link(sender, instance, **kwargs):
+    '''
+    Stop redirecting a deleted Link, and stop counting its tags.
+    '''
+
+    link_cache.invalidate(instance.key)
+    invalidate_tag_counts(instance.user_id)
+    search_index.remove(instance.pk)
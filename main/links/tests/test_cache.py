@@ -0,0 +1,217 @@
+from django.test import TestCase, override_settings
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+
+from users.models import User
+from links.cache import CachedLink, LinkCache
+from links.forms import LinkEditForm
+from links.models import KeyCounter, Link
+
+
+class LinkCacheTests(TestCase):
+    fixtures = ['users', 'links']
+    site_domain = 'testexample.com'
+
+    def setUp(self):
+        '''
+        Modify the current site with the
+        predefined site domain.
+        '''
+
+        site = Site.objects.get_current()
+        site.domain = self.site_domain
+        site.name = self.site_domain
+        site.save()
+
+        cache.clear()
+        self.link_cache = LinkCache()
+
+    def test_lookup_populates_cache(self):
+        '''
+        The first lookup loads the Link, the second is a cache hit.
+        '''
+
+        link = Link.objects.first()
+
+        # The first lookup also reads the generation counters.
+        with self.assertNumQueries(2):
+            cached = self.link_cache.lookup(link.key)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.link_cache.lookup(link.key), cached)
+
+        self.assertEqual(cached.id, link.pk)
+        self.assertEqual(cached.destination, link.destination)
+        self.assertEqual(self.link_cache.hits, 1)
+
+    def test_lookup_missing_key(self):
+        '''
+        Missing keys return None.
+        '''
+
+        self.assertIsNone(self.link_cache.lookup('does-not-exist'))
+
+    @override_settings(LINK_CACHE_SYNC_INTERVAL=0)
+    def test_missing_keys_are_remembered_until_created(self):
+        '''
+        Unknown keys are looked up once, until a Link
+        with that key is created in any worker.
+        '''
+
+        other_worker = LinkCache()
+        for worker in (self.link_cache, other_worker):
+            self.assertIsNone(worker.lookup('scanned'))
+        # Only the generation counters are read.
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.link_cache.lookup('scanned'))
+        self.assertEqual(self.link_cache.missing_hits, 1)
+
+        Link.objects.create(key='scanned', destination='http://example.com')
+
+        for worker in (self.link_cache, other_worker):
+            self.assertEqual(worker.lookup('scanned').key, 'scanned')
+
+    @override_settings(LINK_MISSING_CACHE_SIZE=1)
+    def test_missing_keys_are_bounded(self):
+        '''
+        At most LINK_MISSING_CACHE_SIZE unknown keys are kept.
+        '''
+
+        self.link_cache.set_missing('a')
+        self.link_cache.set_missing('b')
+        self.assertFalse(self.link_cache.is_missing('a'))
+        self.assertTrue(self.link_cache.is_missing('b'))
+
+    @override_settings(LINK_CACHE_SIZE=2)
+    def test_least_recently_used_is_evicted(self):
+        '''
+        The cache never holds more than LINK_CACHE_SIZE entries.
+        '''
+
+        for key in ('a', 'b', 'c'):
+            self.link_cache.set(CachedLink(1, key, 'http://example.com', 301))
+
+        self.assertEqual(len(self.link_cache), 2)
+        self.assertIsNone(self.link_cache.get('a'))
+        self.assertIsNotNone(self.link_cache.get('c'))
+
+    @override_settings(LINK_CACHE_TTL=-1)
+    def test_expired_entries_are_missed(self):
+        '''
+        Entries older than LINK_CACHE_TTL are not returned.
+        '''
+
+        self.link_cache.set(CachedLink(1, 'a', 'http://example.com', 301))
+        self.assertIsNone(self.link_cache.get('a'))
+
+    @override_settings(LINK_CACHE_SYNC_INTERVAL=0)
+    def test_invalidation_reaches_other_workers(self):
+        '''
+        Invalidating a key in one worker drops
+        the entries of another worker.
+        '''
+
+        other_worker = LinkCache()
+        other_worker.set(CachedLink(1, 'a', 'http://example.com', 301))
+        self.assertIsNotNone(other_worker.get('a'))
+
+        self.link_cache.invalidate('b')
+        self.assertIsNone(other_worker.get('a'))
+
+    @override_settings(LINK_CACHE_SYNC_INTERVAL=3600)
+    def test_interleaved_invalidations_are_not_skipped(self):
+        '''
+        A worker invalidating a key after another worker did
+        still drops the entries the other worker invalidated.
+        '''
+
+        other_worker = LinkCache()
+        for worker in (self.link_cache, other_worker):
+            worker.get('a')
+        self.link_cache.set(CachedLink(1, 'a', 'http://example.com', 301))
+
+        other_worker.invalidate('a')
+        self.link_cache.invalidate('b')
+        self.assertIsNone(self.link_cache.get('a'))
+
+    @override_settings(LINK_CACHE_SYNC_INTERVAL=3600)
+    def test_interleaved_creations_are_not_skipped(self):
+        '''
+        A worker creating a Link after another worker did
+        still forgets the key the other worker created.
+        '''
+
+        other_worker = LinkCache()
+        for worker in (self.link_cache, other_worker):
+            worker.get('a')
+        self.link_cache.set_missing('a')
+
+        other_worker.forget_missing(['a'])
+        self.link_cache.forget_missing(['b'])
+        self.assertFalse(self.link_cache.is_missing('a'))
+
+    @override_settings(LINK_CACHE_SYNC_INTERVAL=0)
+    def test_any_save_invalidates(self):
+        '''
+        Saving a Link outside the forms, like in the admin or a
+        shell, drops its redirect from the other workers too.
+        '''
+
+        link = Link.objects.first()
+        self.link_cache.lookup(link.key)
+
+        link.redirect_status = 302
+        link.save()
+
+        self.assertEqual(self.link_cache.lookup(link.key).status, 302)
+
+    def test_creations_are_all_counted(self):
+        '''
+        Every creation bumps the missing keys generation once,
+        whichever worker makes it.
+        '''
+
+        counter = KeyCounter.objects.filter(
+            name=LinkCache.missing_generation_key
+        )
+        before = counter.get().value
+
+        workers = [LinkCache() for i in range(3)]
+        for i, worker in enumerate(workers):
+            worker.forget_missing(['key-{}'.format(i)])
+
+        self.assertEqual(counter.get().value, before + 3)
+
+    def test_edit_invalidates_destination(self):
+        '''
+        Redirects follow the new destination after an edit.
+        '''
+
+        from links.cache import link_cache
+
+        user = User.objects.get(email='user@email.com')
+        link = Link.objects.filter(user=user).first()
+        link_cache.lookup(link.key)
+
+        form = LinkEditForm({
+            'destination': 'http://example-edited.com',
+            'title': link.title,
+        }, instance=link, user=user)
+        self.assertTrue(form.is_valid())
+        form.save()
+
+        self.assertEqual(
+            link_cache.lookup(link.key).destination,
+            'http://example-edited.com'
+        )
+
+    def test_preload_most_clicked(self):
+        '''
+        Preloading caches the most clicked links, so their
+        redirects do not query the database.
+        '''
+
+        Link.objects.filter(key='KlilG').update(total_clicks=100)
+
+        self.assertEqual(self.link_cache.preload(1), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.link_cache.lookup('KlilG').key, 'KlilG')
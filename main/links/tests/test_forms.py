@@ -69,6 +69,27 @@ class LinkTests(TestCase):
         # Ensure that the Link has an associated User.
         self.assertEqual(link.user, user)
 
+    def test_link_form_key_taken_concurrently(self):
+        '''
+        A custom key taken by another request after the form
+        was validated is reported as a form error.
+        '''
+
+        user = User.objects.first()
+        form = LinkForm({
+            'destination': 'http://example2.com',
+            'key': 'race',
+        }, user=user)
+        self.assertEqual(form.is_valid(), True)
+
+        Link.objects.create(destination='http://race.com', key='race')
+
+        self.assertIsNone(form.save())
+        self.assertEqual(form.errors['key'], ['Custom link is already taken!'])
+        self.assertEqual(
+            Link.objects.get(key='race').destination, 'http://race.com'
+        )
+
     def test_link_edit_anon(self):
         '''
         Attempt to edit a link with LinkEditForm
@@ -265,3 +286,34 @@ class LinkTests(TestCase):
         self.assertTrue(tag1 in link1.tags.all())
         # Check that tag still exists.
         self.assertTrue(Tag.objects.get(name=tag1.name).exists())
+
+    def test_retag_is_set_based(self):
+        '''
+        Replace the 8 tags of a link with 8 others, and check
+        that the queries do not grow with the number of tags
+        and that the replaced tags are deleted.
+        '''
+
+        user = User.objects.get(email='user@email.com')
+        link = Link.objects.filter(user=user).first()
+
+        d = {
+            'destination': link.destination,
+            'title': link.title,
+            'tags': ','.join('old-{}'.format(i) for i in range(8))
+        }
+        form = LinkEditForm(d, instance=link, user=user)
+        self.assertTrue(form.is_valid())
+        form.save()
+
+        d['tags'] = ','.join('new-{}'.format(i) for i in range(8))
+        form = LinkEditForm(d, instance=link, user=user)
+        with self.assertNumQueries(15):
+            self.assertTrue(form.is_valid())
+            link = form.save()
+
+        self.assertEqual(
+            sorted(link.tags.values_list('name', flat=True)),
+            ['new-{}'.format(i) for i in range(8)]
+        )
+        self.assertFalse(Tag.objects.filter(name__startswith='old-').exists())
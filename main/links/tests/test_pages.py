@@ -1,7 +1,10 @@
 from django.test import TestCase
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 
+from links.forms import LinkEditForm
+from links.models import Link
 from users.models import User
 
 
@@ -80,3 +83,133 @@ class LinkTests(TestCase):
         url = reverse('edit-link', kwargs={'key': link.key})
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
+
+    def test_dashboard_pages(self):
+        '''
+        Test that following the dashboard's next page cursors
+        visits every link of the user once, newest first.
+        '''
+
+        # Get the User and Login the User.
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+
+        expected = list(
+            user.links.order_by('-created_on', '-id').values_list('pk', flat=True)
+        )
+
+        seen = []
+        url = reverse('dashboard')
+        data = {}
+        with self.settings(DASHBOARD_PAGE_SIZE=3):
+            while True:
+                response = self.client.get(url, data)
+                self.assertEqual(response.status_code, 200)
+                seen.extend(link.pk for link in response.context['links'])
+
+                next_cursor = response.context['next_cursor']
+                if not next_cursor:
+                    break
+                data = {'after': next_cursor}
+
+        self.assertEqual(seen, expected)
+
+    def test_dashboard_query_count(self):
+        '''
+        Test that the dashboard does not query once per link.
+        '''
+
+        # Get the User and Login the User.
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+
+        url = reverse('dashboard')
+        self.client.get(url)
+
+        # Session, user, links and their tags.
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+    def test_dashboard_invalid_cursor(self):
+        '''
+        Test that an invalid cursor shows the first page.
+        '''
+
+        # Get the User and Login the User.
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+
+        url = reverse('dashboard')
+        response = self.client.get(url, {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+
+    def tag_links(self, user):
+        '''
+        Tag the first three links of user with
+        'a', 'a,b' and 'b' through the edit form.
+        '''
+
+        links = list(Link.objects.filter(user=user).order_by('pk')[:3])
+        for link, tags in zip(links, ('a', 'a,b', 'b')):
+            form = LinkEditForm({
+                'destination': link.destination,
+                'title': link.title,
+                'tags': tags,
+            }, instance=link, user=user)
+            self.assertTrue(form.is_valid())
+            form.save()
+        return links
+
+    def test_dashboard_tag_filter(self):
+        '''
+        Test that the dashboard filters links having
+        all, or any, of the given tags.
+        '''
+
+        cache.clear()
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+        links = self.tag_links(user)
+
+        url = reverse('dashboard')
+        response = self.client.get(url, {'tags': 'a, b'})
+        self.assertEqual(response.context['links'], [links[1]])
+
+        response = self.client.get(url, {'tags': 'a,b', 'match': 'any'})
+        self.assertEqual(
+            sorted(link.pk for link in response.context['links']),
+            [link.pk for link in links]
+        )
+        self.assertEqual(response.context['tag_counts'], [('a', 2), ('b', 2)])
+
+    def test_tag_api(self):
+        '''
+        Test the links and tags JSON API, and that tag
+        counts are refreshed when tags are edited.
+        '''
+
+        cache.clear()
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+        links = self.tag_links(user)
+
+        response = self.client.get(reverse('api-links'), {'tags': 'b'})
+        self.assertEqual(
+            sorted(link['key'] for link in response.json()['links']),
+            sorted(link.key for link in links[1:])
+        )
+        self.assertEqual(response.json()['next'], None)
+
+        response = self.client.get(reverse('api-tags'))
+        self.assertEqual(response.json()['tags'], [
+            {'name': 'a', 'count': 2},
+            {'name': 'b', 'count': 2},
+        ])
+
+        # Deleting a link changes the counts.
+        links[0].delete()
+        response = self.client.get(reverse('api-tags'))
+        self.assertEqual(response.json()['tags'], [
+            {'name': 'a', 'count': 1},
+            {'name': 'b', 'count': 2},
+        ])
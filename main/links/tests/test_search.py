@@ -0,0 +1,127 @@
+from unittest import mock
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+
+from links.bulk import create_links
+from links.models import Link
+from links.search import fts5_available, search_index, search_links
+from users.models import User
+
+
+class SearchTestMixin(object):
+    fixtures = ['users', 'links']
+
+    def setUp(self):
+        search_index.reset()
+        self.user = User.objects.get(email='user@email.com')
+        self.other = User.objects.get(email='admin@email.com')
+
+        self.python = Link.objects.create(
+            key='python', user=self.user, title='Python docs',
+            destination='http://docs.python.org/',
+        )
+        self.monty = Link.objects.create(
+            key='monty', user=self.user, title='Monty',
+            destination='http://example.com/python-sketches',
+        )
+        Link.objects.create(
+            key='others', user=self.other, title='Python for others',
+            destination='http://python.org/',
+        )
+
+    def search(self, query):
+        return [link.key for link in search_links(self.user, query)]
+
+    def test_prefix_and_ranking(self):
+        '''
+        Test that words match as prefixes, title matches rank
+        first, and other users' links are not found.
+        '''
+
+        self.assertEqual(self.search('pyth'), ['python', 'monty'])
+        self.assertEqual(self.search('pyth sketch'), ['monty'])
+        self.assertEqual(self.search('nothing'), [])
+        self.assertEqual(self.search('  '), [])
+
+    def test_index_follows_edits(self):
+        '''
+        Test that edited and deleted links are searched as they are now.
+        '''
+
+        self.search('python')
+
+        self.monty.title = 'Flying circus'
+        self.monty.save()
+        self.python.delete()
+
+        self.assertEqual(self.search('fly'), ['monty'])
+        self.assertEqual(self.search('docs'), [])
+
+    def test_index_follows_bulk_creation(self):
+        '''
+        Test that links created in bulk are found right away.
+        '''
+
+        self.search('python')
+
+        create_links([{
+            'destination': 'http://bulk.com/', 'key': 'bulk',
+            'title': 'Bulk circus', 'tags': [],
+        }], self.user)
+
+        self.assertEqual(self.search('circus'), ['bulk'])
+
+    def test_search_api(self):
+        '''
+        Test the search JSON endpoint.
+        '''
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('api-search'), {'q': 'docs pyth'})
+        self.assertEqual(
+            [link['key'] for link in response.json()['links']], ['python']
+        )
+
+        response = self.client.get(reverse('dashboard'), {'q': 'monty'})
+        self.assertEqual(response.context['links'], [self.monty])
+
+
+class FTS5SearchTest(SearchTestMixin, TestCase):
+    def test_uses_fts5(self):
+        self.assertTrue(fts5_available())
+
+
+@override_settings(SEARCH_BACKEND='memory')
+class MemorySearchTest(SearchTestMixin, TestCase):
+    def test_uses_index(self):
+        self.assertFalse(fts5_available())
+
+    @override_settings(SEARCH_INDEX_ASYNC=True)
+    def test_background_build(self):
+        '''
+        Test that the Database is searched until the index is built in
+        the background, and that edits made during the build are kept.
+        '''
+
+        with mock.patch('links.search.threading.Thread') as thread:
+            self.assertEqual(self.search('pyth'), ['monty', 'python'])
+            self.assertEqual(self.search('docs'), ['python'])
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+
+        read = search_index._read
+
+        def read_then_edit(links):
+            rows = read(links)
+            self.monty.title = 'Flying circus'
+            self.monty.save()
+            return rows
+
+        # Run the build the thread would run.
+        with mock.patch.object(search_index, '_read') as _read:
+            _read.side_effect = read_then_edit
+            search_index.build()
+
+        self.assertEqual(self.search('fly'), ['monty'])
+        self.assertEqual(self.search('pyth'), ['python', 'monty'])
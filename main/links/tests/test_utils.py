@@ -1,6 +1,15 @@
-from django.test import TestCase
+from unittest import mock
 
-from links.models import Link, Tag
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from links.allocator import KeyAllocator, encode_key
+from links.benchmark import describe_environment, run_benchmarks, seed_database
+from links.bloom import BloomFilter, KeyFilter, key_filter
+from links.models import KeyCounter, Link, Tag
+from links.utils import resolve_tags, sweep_orphan_tags
 
 
 class TagUtilsTest(TestCase):
@@ -239,3 +248,232 @@ class LinkUtilsTest(TestCase):
         self.assertEqual(text4, 'hello-there')
         self.assertEqual(text5, 'hello-there')
         self.assertEqual(text6, 'hello-there')
+
+
+class KeyAllocatorTest(TestCase):
+    fixtures = ['users', 'links']
+
+    def setUp(self):
+        self.allocator = KeyAllocator()
+
+        # Do not let a refresh of the shared key filter
+        # add queries to some blocks only.
+        key_filter.reset()
+        overrides = self.settings(KEY_FILTER_REFRESH_INTERVAL=3600)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_encode_key_is_a_bijection(self):
+        '''
+        Test that distinct numbers give distinct keys
+        of the configured length.
+        '''
+
+        keys = {encode_key(n, 'abc', 4) for n in range(3 ** 4)}
+        self.assertEqual(len(keys), 3 ** 4)
+        self.assertTrue(all(len(key) == 4 for key in keys))
+
+    def test_allocated_keys_are_unique(self):
+        '''
+        Test that keys are unique across blocks.
+        '''
+
+        with self.settings(KEY_BLOCK_SIZE=10):
+            keys = []
+            for i in range(5):
+                keys.extend(self.allocator.allocate(5))
+
+        self.assertEqual(len(set(keys)), 25)
+        self.assertEqual(KeyCounter.objects.get(name='links').value, 30)
+
+    def test_blocks_skip_taken_and_reserved_keys(self):
+        '''
+        Test that a block skips custom keys and reserved words.
+        '''
+
+        taken = encode_key(0, settings.HASH_ALPHABET, settings.HASH_LENGTH)
+        reserved = encode_key(1, settings.HASH_ALPHABET, settings.HASH_LENGTH)
+        Link.objects.create(key=taken, destination='http://example.com')
+
+        with self.settings(KEY_BLOCK_SIZE=5, blacklist=[reserved]):
+            keys = self.allocator.allocate(3)
+
+        self.assertNotIn(taken, keys)
+        self.assertNotIn(reserved, keys)
+        self.assertEqual(len(keys), 3)
+
+    def test_block_costs_constant_queries(self):
+        '''
+        Test that allocating a block of keys costs the same
+        number of queries whatever its size.
+        '''
+
+        queries = []
+        for size in (10, 10, 400):
+            with self.settings(KEY_BLOCK_SIZE=size):
+                with CaptureQueriesContext(connection) as context:
+                    self.allocator.allocate(size)
+            queries.append(len(context))
+
+        # The first block also creates the counter.
+        self.assertEqual(queries[1], queries[2])
+
+
+class KeyFilterTest(TestCase):
+    fixtures = ['users', 'links']
+
+    def setUp(self):
+        self.key_filter = KeyFilter()
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        '''
+        Test that every added value is found, and that
+        few values that were not added are.
+        '''
+
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('key-{}'.format(i))
+
+        self.assertTrue(all('key-{}'.format(i) in bloom for i in range(1000)))
+        false_positives = sum(
+            'other-{}'.format(i) in bloom for i in range(10000)
+        )
+        self.assertLess(false_positives, 300)
+
+    def test_existing_keys(self):
+        '''
+        Test that existing keys are found and unknown keys
+        are ruled out without querying the Database.
+        '''
+
+        link = Link.objects.first()
+        self.assertTrue(self.key_filter.exists(link.key))
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.key_filter.exists('not-a-key-at-all'))
+
+    def test_refresh_finds_keys_created_elsewhere(self):
+        '''
+        Test that keys created without the signal, such as
+        by another worker, are picked up on refresh.
+        '''
+
+        self.key_filter.build()
+        Link.objects.bulk_create([
+            Link(key='elsewhere', destination='http://example.com')
+        ])
+
+        with self.settings(KEY_FILTER_REFRESH_INTERVAL=0):
+            self.assertTrue(self.key_filter.exists('elsewhere'))
+
+    @override_settings(KEY_FILTER_ASYNC=True)
+    def test_background_build(self):
+        '''
+        Test that the filter is built in the background, keys are
+        checked in the Database until then, and keys created while
+        the table is read are added.
+        '''
+
+        link = Link.objects.first()
+        with mock.patch('links.bloom.threading.Thread') as thread:
+            self.assertTrue(self.key_filter.exists(link.key))
+            self.assertFalse(self.key_filter.exists('not-a-key-at-all'))
+        thread.assert_called_once()
+
+        # Run the build the thread would run, with a Link created
+        # by another worker after the keys were read.
+        read = self.key_filter._read
+
+        def read_then_create():
+            keys = read()
+            Link.objects.bulk_create([
+                Link(key='during-build', destination='http://example.com')
+            ])
+            return keys
+
+        with mock.patch.object(self.key_filter, '_read') as _read:
+            _read.side_effect = read_then_create
+            self.key_filter.build()
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.key_filter.exists('not-a-key-at-all'))
+        self.assertTrue(self.key_filter.exists('during-build'))
+
+
+class BenchmarkTest(TestCase):
+    multi_db = True
+
+    def test_seed_and_run(self):
+        '''
+        Seed a small database and check that every
+        benchmark reports its latency percentiles.
+        '''
+
+        user = seed_database(links=30, clicks=200, user_links=10)
+
+        self.assertEqual(Link.objects.count(), 30)
+        self.assertEqual(user.links.count(), 10)
+        self.assertEqual(
+            sum(Link.objects.values_list('total_clicks', flat=True)), 200
+        )
+
+        results = run_benchmarks(user, requests=20)
+        self.assertEqual(
+            sorted(results),
+            ['dashboard', 'redirect_to_link', 'shorten_link']
+        )
+        self.assertEqual(results['redirect_to_link']['requests'], 20)
+        for result in results.values():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_describe_environment(self):
+        '''
+        Test that the middleware, Database pragmas and
+        settings the benchmarks ran with are reported.
+        '''
+
+        environment = describe_environment()
+
+        self.assertEqual(environment['middleware'], settings.MIDDLEWARE)
+        default = environment['databases']['default']
+        self.assertEqual(default['engine'], 'config.sqlite_backend')
+        self.assertEqual(default['pragmas']['busy_timeout'], 5000)
+        self.assertIn('CLICK_PIPELINE_ASYNC', environment['settings'])
+
+
+class TagCleanupTest(TestCase):
+    fixtures = ['users', 'links']
+
+    def test_sweep_orphan_tags(self):
+        '''
+        Test that the sweeper deletes unused tags
+        in batches and keeps the used ones.
+        '''
+
+        tags = resolve_tags('tag-{}'.format(i) for i in range(5))
+        link = Link.objects.first()
+        link.tags.add(tags['tag-0'])
+
+        self.assertEqual(sweep_orphan_tags(batch_size=2), 4)
+        self.assertEqual(
+            list(Tag.objects.values_list('name', flat=True)), ['tag-0']
+        )
+
+    def test_resolve_tags_created_concurrently(self):
+        '''
+        Test that Tags another request creates in the
+        meantime are read instead of failing the insert.
+        '''
+
+        bulk_create = Tag.objects.bulk_create
+
+        def create_first(tags):
+            Tag.objects.create(name='b')
+            return bulk_create(tags)
+
+        with mock.patch.object(Tag.objects, 'bulk_create', create_first):
+            tags = resolve_tags(['a', 'b'])
+
+        self.assertEqual(sorted(tags), ['a', 'b'])
+        self.assertEqual(Tag.objects.count(), 2)
@@ -1,13 +1,20 @@
-from django.test import TestCase
+import io
+import json
+from unittest import mock
+
+from django.test import TestCase, override_settings
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import reverse
 
 from users.models import User
+from links import bulk
+from links.cache import link_cache
 from links.models import Link, Tag
 
 
 class LinkTests(TestCase):
     fixtures = ['users', 'links']
+    multi_db = True
     site_domain = 'testexample.com'
 
     def setUp(self):
@@ -21,6 +28,9 @@ class LinkTests(TestCase):
         site.name = self.site_domain
         site.save()
 
+        # Drop Links cached by previous tests.
+        link_cache.clear()
+
     def test_guest_link_post(self):
         '''
         Test the 'shorten-link' endpoint with VALID
@@ -346,3 +356,270 @@ class LinkTests(TestCase):
             response,
             'Cannot have more than {} tags.'.format(tag_limit),
             1, 200)
+
+    def test_redirect_fast_path_matches_template(self):
+        '''
+        Test that the fast path 'redirect-to-link' body
+        is the same as the rendered template.
+        '''
+
+        link = Link.objects.first()
+        url = reverse('redirect-to-link', kwargs={'key': link.key})
+
+        with self.settings(REDIRECT_FAST_PATH=True):
+            fast_response = self.client.get(url)
+        with self.settings(REDIRECT_FAST_PATH=False):
+            template_response = self.client.get(url)
+
+        self.assertEqual(fast_response.status_code, 301)
+        self.assertEqual(fast_response['Location'], link.destination)
+        self.assertEqual(
+            fast_response.content.split(),
+            template_response.content.split()
+        )
+
+    def test_redirect_head(self):
+        '''
+        Test the 'redirect-to-link' endpoint with a HEAD request.
+        '''
+
+        link = Link.objects.first()
+        url = reverse('redirect-to-link', kwargs={'key': link.key})
+
+        response = self.client.head(url)
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], link.destination)
+        self.assertEqual(response.content, b'')
+
+    def test_redirect_custom_status_code(self):
+        '''
+        Test that each link redirects with its own status code.
+        '''
+
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+
+        link = Link.objects.filter(user=user).first()
+
+        # Change the redirect status of the link.
+        url = reverse('edit-link', kwargs={'key': link.key})
+        response = self.client.post(url, data={
+            'destination': link.destination,
+            'title': link.title,
+            'redirect_status': 307,
+        })
+        self.assertEqual(response.status_code, 302)
+
+        url = reverse('redirect-to-link', kwargs={'key': link.key})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 307)
+        self.assertEqual(response['Location'], link.destination)
+
+    def test_bulk_shorten_json(self):
+        '''
+        Test the 'bulk-shorten-link' endpoint with a JSON array
+        of valid and invalid links.
+        '''
+
+        # Get the User and Login the User.
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+
+        existing_key = Link.objects.first().key
+        items = [
+            {'destination': 'http://bulk1.com'},
+            {'destination': 'http://bulk2.com', 'key': 'bulk-2',
+             'title': 'Bulk 2', 'tags': ['bulk', 'two']},
+            {'destination': 'not a url'},
+            {'destination': 'http://bulk4.com', 'key': existing_key},
+            {'destination': 'http://bulk5.com', 'key': 'bulk-2'},
+            {'destination': 'http://{}/x'.format(self.site_domain)},
+            {'destination': 'http://bulk7.com', 'tags': 'bulk, seven'},
+        ]
+
+        url = reverse('bulk-shorten-link')
+        response = self.client.post(
+            url,
+            data=json.dumps(items),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        results = [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual([r['index'] for r in results], list(range(7)))
+
+        # Valid links were created with their keys, titles and tags.
+        valid = [r for r in results if 'url' in r]
+        self.assertEqual([r['index'] for r in valid], [0, 1, 6])
+        self.assertEqual(valid[1]['url'], 'bulk-2')
+
+        link = Link.objects.get(key='bulk-2')
+        self.assertEqual(link.user, user)
+        self.assertEqual(link.title, 'Bulk 2')
+        self.assertEqual(
+            set(link.tags.values_list('name', flat=True)),
+            {'bulk', 'two'}
+        )
+        link = Link.objects.get(key=valid[2]['url'])
+        self.assertEqual(link.title, 'Link - {}'.format(link.key))
+        self.assertEqual(link.tags.count(), 2)
+
+        # Invalid links were reported.
+        self.assertIn('destination', results[2]['errors'])
+        self.assertIn('key', results[3]['errors'])
+        self.assertIn('key', results[4]['errors'])
+        self.assertIn('destination', results[5]['errors'])
+
+    def test_bulk_shorten_ndjson(self):
+        '''
+        Test the 'bulk-shorten-link' endpoint with NDJSON.
+        '''
+
+        # Get the User and Login the User.
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+
+        count = Link.objects.count()
+        body = '\n'.join(
+            json.dumps({'destination': 'http://bulk{}.com'.format(i)})
+            for i in range(20)
+        )
+
+        url = reverse('bulk-shorten-link')
+        response = self.client.post(
+            url,
+            data=body,
+            content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        keys = [
+            json.loads(line)['url']
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(len(set(keys)), 20)
+        self.assertEqual(Link.objects.count(), count + 20)
+
+    @override_settings(
+        BULK_SHORTEN_LIMIT=100,
+        BULK_SHORTEN_MAX_BODY_SIZE=64 * 1024,
+        DATA_UPLOAD_MAX_MEMORY_SIZE=1024,
+    )
+    def test_bulk_shorten_limits(self):
+        '''
+        Test the 'bulk-shorten-link' endpoint with as many links as
+        allowed, in a body larger than DATA_UPLOAD_MAX_MEMORY_SIZE.
+        '''
+
+        # Get the User and Login the User.
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+
+        url = reverse('bulk-shorten-link')
+        items = [
+            {'destination': 'http://bulk{}.com/{}'.format(i, 'x' * 100)}
+            for i in range(101)
+        ]
+
+        response = self.client.post(
+            url,
+            data=json.dumps(items[:100]),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 100)
+
+        # One link too many.
+        response = self.client.post(
+            url,
+            data=json.dumps(items),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # A body that is too large.
+        body = json.dumps([{'destination': 'http://bulk.com/' + 'x' * 65536}])
+        response = self.client.post(
+            url,
+            data=body,
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # A chunked body that is too large, without a Content-Length.
+        request = mock.Mock(META={}, read=io.BytesIO(body.encode()).read)
+        with self.assertRaises(bulk.BulkParseError):
+            bulk.read_body(request)
+
+    def test_bulk_shorten_concurrent_keys(self):
+        '''
+        Test the 'bulk-shorten-link' endpoint when another request
+        takes a custom key after the batch was validated.
+        '''
+
+        # Get the User and Login the User.
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+
+        allocate_keys = bulk.allocate_keys
+
+        def take_key(items):
+            # bulk_create sends no signals, like a Link of another worker.
+            if not Link.objects.filter(key='bulk-race').exists():
+                Link.objects.bulk_create([
+                    Link(destination='http://race.com', key='bulk-race')
+                ])
+            allocate_keys(items)
+
+        items = [
+            {'destination': 'http://bulk1.com', 'key': 'bulk-race'},
+            {'destination': 'http://bulk2.com', 'key': 'bulk-fine',
+             'tags': ['bulk']},
+            {'destination': 'http://bulk3.com'},
+        ]
+
+        url = reverse('bulk-shorten-link')
+        with mock.patch('links.bulk.allocate_keys', side_effect=take_key):
+            response = self.client.post(
+                url,
+                data=json.dumps(items),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+        results = [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+        self.assertIn('key', results[0]['errors'])
+        self.assertEqual(results[1]['url'], 'bulk-fine')
+        self.assertIn('url', results[2])
+
+        self.assertEqual(
+            Link.objects.get(key='bulk-race').destination, 'http://race.com'
+        )
+        link = Link.objects.get(key='bulk-fine')
+        self.assertEqual(link.user, user)
+        self.assertEqual(link.tags.count(), 1)
+        self.assertTrue(Link.objects.filter(key=results[2]['url']).exists())
+
+    def test_bulk_shorten_invalid_body(self):
+        '''
+        Test the 'bulk-shorten-link' endpoint with an invalid body.
+        '''
+
+        # Get the User and Login the User.
+        user = User.objects.get(email='user@email.com')
+        self.client.login(email=user.email, password='user')
+
+        url = reverse('bulk-shorten-link')
+        response = self.client.post(
+            url,
+            data='{"destination": "http://bulk.com"}',
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
@@ -18,6 +18,26 @@ urlpatterns = [
         views.shorten_link,
         name='shorten-link'
     ),
+    url(
+        r'^shorten/bulk/$',
+        views.bulk_shorten_link,
+        name='bulk-shorten-link'
+    ),
+    url(
+        r'^api/links/$',
+        views.links_api,
+        name='api-links'
+    ),
+    url(
+        r'^api/search/$',
+        views.search_api,
+        name='api-search'
+    ),
+    url(
+        r'^api/tags/$',
+        views.tags_api,
+        name='api-tags'
+    ),
     url(
         r'^edit/(?P<key>[A-Za-z0-9-]+)/$',
         views.edit_link,
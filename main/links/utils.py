@@ -1,75 +1,288 @@
-from django.contrib.gis.geoip2 import GeoIP2
-from django.contrib.sites.models import Site
-from django.db.models import F
-from django.utils import timezone
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+from django.utils.dateparse import parse_datetime
 
-import geoip2
+from analytics.geoip import geoip_service
+from analytics.hyperloglog import HyperLogLog
+from analytics.models import Country, IPAddress, Region, UniqueVisitorSketch
 
-from analytics.models import Country, Referer, Region
+from .models import Link, Tag
 
 
-def update_link_unique_ips(link, ip_address=None):
+def lookup_country(ip_address=None):
     '''
-    Update Unique IP addresses for Link.
+    Return the Country object for an ip address, or None.
     '''
 
-    link.add_unique_ip(ip_address)
+    # Attempt to get country for ip address.
+    data = geoip_service.country(ip_address)
+    if data is None:
+        return None
+
+    # Get or create country if country does not exist.
+    name, code = data
+    country, created = Country.objects.get_or_create(name=name, code=code)
+    return country
 
 
-def update_link_regions(link, ip_address=None):
+def reconcile_click_counts(batch_size=1000, link_ids=None):
     '''
-    Create or Update Region objects for Link.
+    Recompute the click counters of every Link, or of link_ids, from
+    its Regions and IPAddresses, or its lifetime sketch in 'hll' mode.
+    Return the number of Links that were corrected.
     '''
 
-    # Initialize GeoIP object.
-    g = GeoIP2()
-    country = None
+    def of_links(queryset, field='link_id'):
+        if link_ids is None:
+            return queryset
+        return queryset.filter(**{field + '__in': link_ids})
 
-    # Attempt to get country for ip address.
+    total_clicks = dict(
+        of_links(Region.objects)
+        .values_list('link')
+        .annotate(clicks=Sum('total_clicks'))
+        .order_by()
+    )
+    unique_clicks = dict(
+        of_links(IPAddress.objects)
+        .values_list('link')
+        .annotate(clicks=Count('pk'))
+        .order_by()
+    )
+    if settings.UNIQUE_CLICKS_MODE == 'hll':
+        # Links clicked since 'hll' mode was turned on have a lifetime
+        # sketch, which also holds the addresses counted exactly before.
+        sketches = (
+            of_links(UniqueVisitorSketch.objects)
+            .filter(day=UniqueVisitorSketch.LIFETIME)
+            .values_list('link', 'registers')
+            .iterator()
+        )
+        unique_clicks.update(
+            (link_id, HyperLogLog.from_bytes(registers).count())
+            for link_id, registers in sketches
+        )
+
+    # Find the Links whose counters drifted.
+    corrections = []
+    links = (
+        of_links(Link.objects, 'pk')
+        .values_list('pk', 'total_clicks', 'unique_clicks')
+        .order_by()
+        .iterator()
+    )
+    for pk, total, unique in links:
+        counts = (total_clicks.get(pk, 0), unique_clicks.get(pk, 0))
+        if counts != (total, unique):
+            corrections.append((pk, counts))
+
+    # Apply the corrections in batches.
+    for i in range(0, len(corrections), batch_size):
+        with transaction.atomic():
+            for pk, (total, unique) in corrections[i:i + batch_size]:
+                Link.objects.filter(pk=pk).update(
+                    total_clicks=total,
+                    unique_clicks=unique
+                )
+
+    return len(corrections)
+
+
+def encode_cursor(link):
+    '''
+    Return a cursor pointing right after Link in a
+    ('-created_on', '-id') ordering.
+    '''
+
+    return '{}_{}'.format(link.created_on.isoformat(), link.pk)
+
+
+def decode_cursor(cursor):
+    '''
+    Return the (created_on, id) pair of a cursor, or None if it is invalid.
+    '''
+
+    created_on, sep, pk = (cursor or '').rpartition('_')
     try:
-        data = g.country(ip_address)
-        country = data.get('country_name')
-        code = data.get('country_code')
+        created_on = parse_datetime(created_on)
+        pk = int(pk)
+    except ValueError:
+        return None
+
+    if created_on is None:
+        return None
+    return created_on, pk
+
+
+def paginate_links(links, cursor=None, page_size=50):
+    '''
+    Return one page of links, newest first, starting after cursor,
+    and the cursor of the next page (None on the last page).
+
+    Pages are found with a (created_on, id) keyset instead of an
+    OFFSET, so every page costs the same no matter how deep it is.
+    '''
+
+    links = links.order_by('-created_on', '-id')
+
+    position = decode_cursor(cursor)
+    if position:
+        created_on, pk = position
+        links = links.filter(
+            Q(created_on__lt=created_on) |
+            Q(created_on=created_on, id__lt=pk)
+        )
+
+    # Fetch one extra Link to know whether there is a next page.
+    page = list(links[:page_size + 1])
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_cursor(page[-1])
+
+    return page, None
+
+
+def parse_tag_names(text):
+    '''
+    Return the normalized, distinct tag names of a comma separated string.
+    '''
+
+    names = [Tag.normalize_text(name) for name in (text or '').split(',')]
+    return list(dict.fromkeys(name for name in names if name))
+
 
-        # Get or create country if country does not exist.
-        if country:
-            country, created = Country.objects.get_or_create(
-                name=country,
-                code=code
-            )
+def filter_links_by_tags(links, names, match='all'):
+    '''
+    Filter links to those with all, or any, of the named tags.
+
+    The matching Link ids come from a subquery on the
+    Link-Tag table, so the filter stays a single query.
+    '''
+
+    if not names:
+        return links
+
+    tagged = (
+        Link.tags.through.objects
+        .filter(tag__name__in=names)
+        .values('link_id')
+    )
+    if match == 'all':
+        tagged = (
+            tagged
+            .annotate(matched=Count('tag_id'))
+            .filter(matched=len(set(names)))
+            .values('link_id')
+        )
+
+    return links.filter(pk__in=tagged)
+
+
+def tag_counts_key(user_id):
+    return 'links:tag-counts:{}'.format(user_id)
 
-    except (TypeError, geoip2.errors.AddressNotFoundError):
-        # Ignore the cases where `ip_address` is None, or
-        # the ip address does not exist in the GeoIP2 database.
-        pass
 
-    # Get or create Region object, where country is either an object or None.
-    region, created = Region.objects.get_or_create(link=link, country=country)
+def user_tag_counts(user):
+    '''
+    Return a list of (tag name, number of Links) pairs of a User,
+    cached until the tags of one of its Links change.
+    '''
+
+    cache = caches[settings.LINK_CACHE_ALIAS]
+    counts = cache.get(tag_counts_key(user.pk))
+
+    if counts is None:
+        counts = list(
+            Tag.objects
+            .filter(links__user=user)
+            .annotate(count=Count('links'))
+            .order_by('name')
+            .values_list('name', 'count')
+        )
+        cache.set(tag_counts_key(user.pk), counts, settings.TAG_COUNTS_TTL)
+
+    return counts
 
-    # Update last visited, clicks, and save changes.
-    region.last_visited = timezone.now()
-    region.total_clicks = F('total_clicks') + 1
-    region.save()
 
+def invalidate_tag_counts(user_id):
+    if user_id is not None:
+        caches[settings.LINK_CACHE_ALIAS].delete(tag_counts_key(user_id))
 
-def update_link_referers(link, referer_source=None):
+
+def resolve_tags(names):
     '''
-    Create or Update Referer objects for Link.
+    Return a dict of Tag objects by name, creating the missing ones.
+    Costs one query, plus an insert and a second read if some are new.
     '''
 
-    # If referer exists, normalize.
-    if referer_source:
-        referer_source = Referer.normalize_source(referer_source)
-        if referer_source == Site.objects.get_current().domain:
-            referer_source = ''
+    names = set(names)
+    if not names:
+        return {}
+
+    def existing():
+        return {tag.name: tag for tag in Tag.objects.filter(name__in=names)}
+
+    tags = existing()
+    missing = names.difference(tags)
+    if missing:
+        try:
+            with transaction.atomic():
+                Tag.objects.bulk_create(Tag(name=name) for name in missing)
+        except IntegrityError:
+            # Another request created some of the Tags first.
+            for name in missing:
+                Tag.objects.get_or_create(name=name)
+
+        # bulk_create does not set primary keys on SQLite.
+        tags = existing()
 
-    # Get or create Referer object.
-    referer, created = Referer.objects.get_or_create(
-        link=link,
-        source=referer_source
+    return tags
+
+
+def orphan_tags():
+    '''
+    Return a queryset of Tags that no Link uses.
+    '''
+
+    return Tag.objects.exclude(
+        pk__in=Link.tags.through.objects.values('tag_id')
     )
 
-    # Update last visited, clicks, and save changes.
-    referer.last_visited = timezone.now()
-    referer.total_clicks = F('total_clicks') + 1
-    referer.save()
+
+def delete_orphan_tags(tag_ids):
+    '''
+    Delete the Tags of tag_ids that no Link uses.
+    Return the number of deleted Tags.
+    '''
+
+    if not tag_ids:
+        return 0
+
+    deleted, per_model = orphan_tags().filter(pk__in=tag_ids).delete()
+    return per_model.get(Tag._meta.label, 0)
+
+
+def sweep_orphan_tags(batch_size=1000):
+    '''
+    Delete every Tag that no Link uses, batch_size at a time.
+    Return the number of deleted Tags.
+    '''
+
+    deleted = 0
+    last_pk = 0
+
+    while True:
+        tag_ids = list(
+            orphan_tags()
+            .filter(pk__gt=last_pk)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not tag_ids:
+            return deleted
+
+        with transaction.atomic():
+            deleted += delete_orphan_tags(tag_ids)
+        last_pk = tag_ids[-1]
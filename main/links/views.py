@@ -1,21 +1,37 @@
+import json
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.sites.models import Site
-from django.http import JsonResponse, HttpResponse
-from django.shortcuts import render, redirect, reverse, get_object_or_404
+from django.http import (
+    Http404,
+    JsonResponse,
+    HttpResponse,
+    StreamingHttpResponse
+)
+from django.shortcuts import render, redirect, reverse
 from django.template.loader import get_template
 from django.utils.cache import patch_cache_control
+from django.utils.html import escape
+from django.utils.http import urlencode
 from django.views.decorators.http import require_http_methods
 
 from ipware.ip import get_ip
 
+from analytics.pipeline import click_pipeline
+from config.ratelimit import rate_limited
+
+from . import bulk
+from .cache import link_cache
 from .decorators import link_owner
 from .forms import LinkForm, LinkEditForm
 from .models import Link
+from .search import search_links
 from .utils import (
-    update_link_unique_ips,
-    update_link_referers,
-    update_link_regions
+    filter_links_by_tags,
+    paginate_links,
+    parse_tag_names,
+    user_tag_counts
 )
 
 
@@ -25,18 +41,116 @@ def index(request):
     return render(request, 'links/index.html', {'form': form, 'site': site})
 
 
+def tagged_links(request):
+    '''
+    Return one page of the User's Links, filtered by the `tags` and
+    `match` ('all' or 'any') parameters, and the next page's cursor.
+    '''
+
+    match = 'any' if request.GET.get('match') == 'any' else 'all'
+    links = filter_links_by_tags(
+        Link.objects.filter(user=request.user),
+        parse_tag_names(request.GET.get('tags')),
+        match
+    )
+    return paginate_links(
+        links.prefetch_related('tags'),
+        cursor=request.GET.get('after'),
+        page_size=settings.DASHBOARD_PAGE_SIZE
+    )
+
+
+def link_json(link):
+    return {
+        'key': link.key,
+        'title': link.title,
+        'destination': link.destination,
+        'tags': [tag.name for tag in link.tags.all()],
+        'total_clicks': link.total_clicks,
+        'created_on': link.created_on,
+    }
+
+
 @login_required
 def dashboard(request):
-    links = Link.objects.filter(user=request.user).order_by('-created_on')
+    query = request.GET.get('q', '').strip()
+    if query:
+        # Search results are ranked, on a single page.
+        links = search_links(
+            request.user, query, settings.DASHBOARD_PAGE_SIZE
+        )
+        next_cursor = None
+    else:
+        links, next_cursor = tagged_links(request)
     site = Site.objects.get_current()
+
+    # Keep the tag filter on the next page.
+    tags = ','.join(parse_tag_names(request.GET.get('tags')))
+    match = request.GET.get('match', 'all')
+    filters = urlencode({'tags': tags, 'match': match}) if tags else ''
+
     return render(
         request,
         'links/dashboard.html',
-        {'links': links, 'site': site}
+        {
+            'links': links,
+            'site': site,
+            'next_cursor': next_cursor,
+            'query': query,
+            'tags': tags,
+            'match': match,
+            'filters': filters,
+            'tag_counts': user_tag_counts(request.user),
+        }
     )
 
 
+@login_required
+def links_api(request):
+    '''
+    Return one page of the User's Links as JSON, optionally
+    filtered by tags like the dashboard.
+    '''
+
+    links, next_cursor = tagged_links(request)
+    return JsonResponse({
+        'links': [link_json(link) for link in links],
+        'next': next_cursor,
+    })
+
+
+@login_required
+def search_api(request):
+    '''
+    Return the User's Links matching the words of `q` as
+    prefixes, best matches first, as JSON.
+    '''
+
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 100)
+    except ValueError:
+        limit = 20
+
+    links = search_links(request.user, request.GET.get('q', ''), limit)
+    return JsonResponse({'links': [link_json(link) for link in links]})
+
+
+@login_required
+def tags_api(request):
+    '''
+    Return the User's tags with their number of Links as JSON.
+    '''
+
+    return JsonResponse({
+        'tags': [
+            {'name': name, 'count': count}
+            for name, count in user_tag_counts(request.user)
+        ]
+    })
+
+
 @require_http_methods(['POST'])
+@rate_limited('shorten', as_json=True)
 def shorten_link(request):
     form = LinkForm(
         request.POST or None,
@@ -45,10 +159,54 @@ def shorten_link(request):
 
     if form.is_valid():
         link = form.save(commit=False)
-        return JsonResponse({'url': link.key}, status=200)
-    else:
-        errors = form.errors
-        return JsonResponse(errors, status=400)
+        if link is not None:
+            return JsonResponse({'url': link.key}, status=200)
+
+    # Invalid, or the custom key was taken while saving.
+    errors = form.errors
+    return JsonResponse(errors, status=400)
+
+
+@login_required
+@require_http_methods(['POST'])
+def bulk_shorten_link(request):
+    '''
+    Shorten a JSON array or NDJSON list of links in one request.
+    Each item has a destination, and optionally a key, title and tags.
+
+    Valid items are inserted in one transaction. The response streams
+    one NDJSON line per item, with either its key or its errors.
+    '''
+
+    content_type = request.META.get('CONTENT_TYPE', '').split(';')[0]
+    try:
+        items = bulk.parse_items(bulk.read_body(request), content_type)
+    except bulk.BulkParseError as e:
+        return JsonResponse({'__all__': [str(e)]}, status=400)
+
+    results = bulk.validate_items(items)
+    conflicts = bulk.create_links(
+        [cleaned for cleaned, errors in results if cleaned],
+        user=request.user
+    )
+
+    # Report keys that were taken while the batch was validated.
+    for index, (cleaned, errors) in enumerate(results):
+        if cleaned and cleaned['key'] in conflicts:
+            results[index] = (None, {'key': ['Custom link is already taken!']})
+
+    def lines():
+        for index, (cleaned, errors) in enumerate(results):
+            if cleaned:
+                line = {'index': index, 'url': cleaned['key']}
+            else:
+                line = {'index': index, 'errors': errors}
+            yield json.dumps(line) + '\n'
+
+    return StreamingHttpResponse(
+        lines(),
+        content_type='application/x-ndjson'
+    )
 
 
 @login_required
@@ -69,31 +227,63 @@ def edit_link(request, key):
     return render(request, 'links/edit_url.html', {'form': form})
 
 
-@require_http_methods(['GET'])
-def redirect_to_link(request, key):
-    link = get_object_or_404(Link, key=key)
+# Body of a fast path redirect. Matches 'links/redirect.html'.
+REDIRECT_BODY = (
+    b'<html>\n'
+    b'    <head>\n'
+    b'        <title>%s</title>\n'
+    b'    </head>\n'
+    b'    <body>\n'
+    b'        <a href="%s">moved here</a>\n'
+    b'    </body>\n'
+    b'</html>\n'
+)
+
 
-    # Get data from request.
-    ip_address = get_ip(request)
-    referer_source = request.META.get('HTTP_REFERER', '')
+def render_redirect_body(request, link):
+    '''
+    Return the body of the redirect response for Link.
+    '''
 
-    # Update Unique IP Addresses.
-    update_link_unique_ips(link, ip_address)
+    # Responses to HEAD requests have no body.
+    if request.method == 'HEAD':
+        return b''
 
-    # Update Regions.
-    update_link_regions(link, ip_address)
+    site = Site.objects.get_current()
 
-    # Update Referers.
-    update_link_referers(link, referer_source)
+    if settings.REDIRECT_FAST_PATH:
+        return REDIRECT_BODY % (
+            escape(site.domain).encode(),
+            reverse('redirect-to-link', kwargs={'key': link.key}).encode()
+        )
 
-    # Prepare template response.
     template = get_template('links/redirect.html')
     context = {
-        'site': Site.objects.get_current(),
+        'site': site,
         'link': link
     }
+    return template.render(context, request)
+
+
+@require_http_methods(['GET', 'HEAD'])
+def redirect_to_link(request, key):
+    link = link_cache.lookup(key)
+    if link is None:
+        raise Http404
+
+    # Record the click. Unique IP Addresses, Regions and
+    # Referers are updated by the click pipeline.
+    if request.method == 'GET':
+        click_pipeline.record(
+            link.id,
+            ip_address=get_ip(request),
+            referer=request.META.get('HTTP_REFERER', '')
+        )
 
-    response = HttpResponse(template.render(context, request), status=301)
+    response = HttpResponse(
+        render_redirect_body(request, link),
+        status=link.status
+    )
     response['Location'] = link.destination
 
     # Set cache control to be private and to be contacted back after 60 seconds
@@ -1,9 +1,12 @@
 from django.contrib.auth import login
 from django.shortcuts import render, redirect
 
+from config.ratelimit import rate_limited
+
 from .forms import SignupForm
 
 
+@rate_limited('signup')
 def signup(request):
     '''
     Signup for a new User account.